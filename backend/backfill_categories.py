@@ -0,0 +1,42 @@
+"""Aplica as regras de categorização fiscal às conversões já guardadas.
+
+Uso: ``cd backend && python backfill_categories.py``
+
+Só trata as conversões concluídas com ``categorization_version`` diferente
+de ``categorization.RULES_VERSION``; pode ser interrompido e corrido de
+novo. As conversões antigas ainda por migrar são ignoradas: correr outra vez
+depois de o servidor terminar ``migrate_legacy_conversions``. As exportações das conversões que mudam são apagadas e geradas outra
+vez no próximo download.
+"""
+import argparse
+import asyncio
+import logging
+
+import server
+from categorization import RULES_VERSION, backfill_categories
+
+
+async def main(batch_size: int):
+    try:
+        totals = await backfill_categories(
+            server.db.conversions,
+            server.db.conversion_transactions,
+            server.invalidate_exports,
+            batch_size=batch_size,
+        )
+    finally:
+        server.client.close()
+    rate = totals["transactions"] / totals["seconds"] if totals["seconds"] else 0
+    logging.info(
+        f"Regras v{RULES_VERSION}: {totals['conversions']} conversões, {totals['transactions']} transações "
+        f"({totals['changed']} alteradas) em {totals['seconds']}s ({rate:,.0f} transações/s)"
+    )
+    if totals["legacy"]:
+        logging.warning(f"{totals['legacy']} conversões antigas por migrar ficaram de fora; correr de novo mais tarde")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill das categorias fiscais")
+    parser.add_argument("--batch-size", type=int, default=200, help="conversões lidas de cada vez")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
@@ -0,0 +1,379 @@
+"""Benchmark offline do pipeline de conversão.
+
+Corre a app FastAPI no próprio processo (httpx + ``ASGITransport``), com um
+LLM falso que implementa a interface ``LlmChat``/``send_message`` (latência e
+número de transações configuráveis) e o mongomock-motor no lugar do MongoDB.
+Não há chamadas de rede nem é preciso um mongod.
+
+Uso:
+
+    cd backend && python benchmark.py --users 20 --concurrency 10 \\
+        --uploads-per-user 2 --pages 12 --llm-latency 0.5 --transactions 200
+
+    # compara com uma execução anterior (p50/p95/p99 por endpoint e etapa)
+    cd backend && python benchmark.py --compare benchmark-<commit>.json
+
+Cada utilizador virtual faz registo, login, uploads, listagem e downloads
+CSV/XLSX; ``--concurrency`` utilizadores correm em simultâneo. O relatório
+tem throughput e p50/p95/p99 por endpoint e por etapa do pipeline, e é
+gravado em JSON (por omissão ``benchmark-<commit>.json``).
+
+Requer ``pip install mongomock-motor httpx`` além das dependências do backend.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).parent
+
+# Tempos em segundos por endpoint / etapa, e códigos de resposta por endpoint
+ENDPOINT_TIMINGS: Dict[str, List[float]] = defaultdict(list)
+ENDPOINT_STATUS: Dict[str, Counter] = defaultdict(Counter)
+STAGE_TIMINGS: Dict[str, List[float]] = defaultdict(list)
+
+
+# --- LLM falso -------------------------------------------------------------
+
+def install_llm_stub(latency: float, jitter: float, transactions: int):
+    """Regista ``emergentintegrations.llm.chat`` em ``sys.modules`` antes de importar o server."""
+
+    def fake_statement(n: int) -> Dict[str, Any]:
+        saldo = 10000.0
+        rows = []
+        for i in range(n):
+            valor = round(random.uniform(1, 500), 2)
+            tipo = random.choice(["débito", "crédito"])
+            saldo += valor if tipo == "crédito" else -valor
+            rows.append({
+                "data": f"{1 + i % 28:02d}/01/2025",
+                "descricao": f"COMPRA CARTAO {uuid.uuid4().hex[:12].upper()} LISBOA",
+                "valor": valor,
+                "tipo": tipo,
+            })
+        return {
+            "banco": "Millennium",
+            "conta": "0000 0000 0000",
+            "periodo": "01/01/2025 - 31/01/2025",
+            "saldo_inicial": 10000.0,
+            "saldo_final": round(saldo, 2),
+            "transacoes": rows,
+        }
+
+    class LlmChat:
+        def __init__(self, api_key: str, session_id: str, system_message: str):
+            pass
+
+        def with_model(self, provider: str, model: str):
+            return self
+
+        async def send_message(self, message) -> str:
+            await asyncio.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+            return "```json\n" + json.dumps(fake_statement(transactions), ensure_ascii=False) + "\n```"
+
+    class UserMessage:
+        def __init__(self, text: str, file_contents: Optional[list] = None):
+            self.text = text
+            self.file_contents = file_contents or []
+
+    class FileContentWithMimeType:
+        def __init__(self, file_path: str, mime_type: str):
+            self.file_path = file_path
+            self.mime_type = mime_type
+
+    chat = types.ModuleType("emergentintegrations.llm.chat")
+    chat.LlmChat = LlmChat
+    chat.UserMessage = UserMessage
+    chat.FileContentWithMimeType = FileContentWithMimeType
+    sys.modules["emergentintegrations"] = types.ModuleType("emergentintegrations")
+    sys.modules["emergentintegrations.llm"] = types.ModuleType("emergentintegrations.llm")
+    sys.modules["emergentintegrations.llm.chat"] = chat
+
+
+def make_pdf(pages: int) -> bytes:
+    """PDF mínimo com ``pages`` páginas e conteúdo único (evita acertos no cache de extrações)."""
+    marker = uuid.uuid4().hex
+    objs = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + i} 0 R" for i in range(pages)), pages),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i in range(pages):
+        objs.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {4 + pages + i} 0 R >>"
+        )
+    for i in range(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td (Pagina {i + 1} {marker}) Tj ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{off:010d} 00000 n \n".encode() for off in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+# --- Instrumentação --------------------------------------------------------
+
+def timed_async(stage: str, fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            STAGE_TIMINGS[stage].append(time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(server):
+    """Mede as etapas do pipeline substituindo as funções no namespace do server."""
+    for stage, name in [
+        ("upload.stream_to_disk", "stream_upload_to_disk"),
+        ("upload.reserve_quota", "reserve_quota"),
+        ("extraction.total", "extract_transactions_from_pdf"),
+        ("extraction.llm_call", "_extract_with_llm"),
+        ("upload.page_count", "get_pdf_page_count"),
+    ]:
+        setattr(server, name, timed_async(stage, getattr(server, name)))
+
+    # As funções enviadas para o pool de processos têm de continuar serializáveis:
+    # mede-se à volta de ``run_cpu`` em vez de as substituir
+    run_cpu = server.executors.run_cpu
+    cpu_stages = {
+        "split_pdf": "extraction.split_pdf",
+        "render_export": "export.render",
+        "write_xlsx_spool": "export.render",
+    }
+
+    async def timed_run_cpu(fn, *args, **kwargs):
+        stage = cpu_stages.get(getattr(fn, "__name__", ""))
+        if stage is None:
+            return await run_cpu(fn, *args, **kwargs)
+        return await timed_async(stage, run_cpu)(fn, *args, **kwargs)
+
+    server.executors.run_cpu = timed_run_cpu
+    server.transaction_store.save = timed_async("store.save_transactions", server.transaction_store.save)
+    server.transaction_store.load = timed_async("store.load_transactions", server.transaction_store.load)
+    server.password_hasher.hash = timed_async("auth.bcrypt_hash", server.password_hasher.hash)
+    server.password_hasher.verify_and_update = timed_async(
+        "auth.bcrypt_verify", server.password_hasher.verify_and_update
+    )
+
+
+def use_mongomock(server):
+    from mongomock_motor import AsyncMongoMockClient
+
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"]]
+    # Objetos criados no import do server guardam a coleção original
+    for value in list(vars(server).values()):
+        collection = getattr(value, "collection", None)
+        if collection is not None and hasattr(collection, "name"):
+            value.collection = server.db[collection.name]
+
+
+# --- Cenário ---------------------------------------------------------------
+
+async def call(http, endpoint: str, method: str, url: str, **kwargs):
+    start = time.perf_counter()
+    response = await http.request(method, url, **kwargs)
+    ENDPOINT_TIMINGS[endpoint].append(time.perf_counter() - start)
+    ENDPOINT_STATUS[endpoint][response.status_code] += 1
+    return response
+
+
+async def virtual_user(http, index: int, args):
+    email = f"bench-{index}-{uuid.uuid4().hex[:8]}@example.com"
+    password = "benchmark-password"
+    await call(http, "POST /auth/register", "POST", "/api/auth/register",
+               json={"email": email, "password": password, "name": f"Bench {index}"})
+    response = await call(http, "POST /auth/login", "POST", "/api/auth/login",
+                          json={"email": email, "password": password})
+    if response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    conversion_ids = []
+    for _ in range(args.uploads_per_user):
+        response = await call(
+            http, "POST /conversions/upload", "POST", "/api/conversions/upload",
+            params={"bank_name": "Millennium"},
+            files={"file": ("extrato.pdf", make_pdf(args.pages), "application/pdf")},
+            headers=headers,
+        )
+        if response.status_code == 200:
+            conversion_ids.append(response.json()["conversion_id"])
+
+    await call(http, "GET /conversions", "GET", "/api/conversions", headers=headers)
+    for conversion_id in conversion_ids:
+        await call(http, "GET /conversions/{id}", "GET", f"/api/conversions/{conversion_id}", headers=headers)
+        for fmt in ("csv", "excel"):
+            await call(http, f"GET /download/{fmt}", "GET",
+                       f"/api/conversions/{conversion_id}/download/{fmt}", headers=headers)
+
+
+async def run_benchmark(args) -> float:
+    import httpx
+    import server
+
+    # Uma linha de log por pedido distorceria os tempos medidos
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    use_mongomock(server)
+    instrument(server)
+    # Sem servidor ASGI não há eventos de arranque: cria os índices à mão
+    await server.start_conversion_workers()
+
+    transport = httpx.ASGITransport(app=server.app)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(i: int):
+        async with semaphore:
+            await virtual_user(http, i, args)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+
+    await server.shutdown_db_client()
+    return elapsed
+
+
+# --- Relatório -------------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por nearest-rank."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[float], elapsed: float) -> Dict[str, float]:
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "throughput_per_s": round(len(values) / elapsed, 3) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_report(args, elapsed: float) -> Dict[str, Any]:
+    endpoints = {}
+    for name, samples in ENDPOINT_TIMINGS.items():
+        endpoints[name] = summarize(samples, elapsed)
+        endpoints[name]["status"] = {str(code): n for code, n in sorted(ENDPOINT_STATUS[name].items())}
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(sum(len(s) for s in ENDPOINT_TIMINGS.values()) / elapsed, 3),
+        "endpoints": endpoints,
+        "stages": {name: summarize(samples, elapsed) for name, samples in STAGE_TIMINGS.items()},
+    }
+
+
+def print_section(title: str, rows: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict]] = None):
+    print(f"\n{title}")
+    print(f"  {'':32} {'n':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(rows):
+        r = rows[name]
+        line = f"  {name:32} {r['count']:>6} {r['throughput_per_s']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}"
+        if "status" in r:
+            line += "  " + " ".join(f"{code}x{n}" for code, n in r["status"].items())
+        old = (baseline or {}).get(name)
+        if old and old.get("p95_ms"):
+            line += f"  p95 {(r['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline de conversão")
+    parser.add_argument("--users", type=int, default=20, help="utilizadores virtuais")
+    parser.add_argument("--concurrency", type=int, default=10, help="utilizadores em simultâneo")
+    parser.add_argument("--uploads-per-user", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=4, help="páginas por PDF")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="latência do LLM falso (s)")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="variação da latência (± s)")
+    parser.add_argument("--transactions", type=int, default=100, help="transações por resposta do LLM")
+    parser.add_argument("--llm-rpm", type=float, default=60, help="LLM_REQUESTS_PER_MINUTE (0 desativa)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--output", help="ficheiro JSON de resultados (por omissão benchmark-<commit>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    upload_dir = tempfile.mkdtemp(prefix="bank-converter-bench-")
+    os.environ.update({
+        "MONGO_URL": "mongodb://benchmark.invalid:27017",
+        "DB_NAME": "benchmark",
+        "UPLOAD_DIR": upload_dir,
+        "EMERGENT_LLM_KEY": "benchmark",
+        "CONVERSION_WORKERS": "0",
+        # O PDF gerado tem camada de texto; sem isto o LLM nunca seria chamado
+        "TEXT_EXTRACTION_ENABLED": "false",
+        "LLM_REQUESTS_PER_MINUTE": str(args.llm_rpm),
+        "PASSWORD_HASH_ROUNDS": str(args.bcrypt_rounds),
+        "PASSWORD_HASH_MAX_PENDING": str(max(32, args.concurrency * 2)),
+    })
+    install_llm_stub(args.llm_latency, args.llm_jitter, args.transactions)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    # Os limites do plano gratuito cortariam os uploads a meio do benchmark
+    import quota
+    quota.FREE_CONVERSIONS_LIMIT = 10 ** 6
+
+    elapsed = asyncio.run(run_benchmark(args))
+    report = build_report(args, elapsed)
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        print(f"Comparação com {args.compare} (commit {baseline.get('commit')})")
+    print(f"\n{report['elapsed_s']} s, {report['requests_per_s']} pedidos/s, commit {report['commit']}")
+    print_section("Endpoints", report["endpoints"], baseline and baseline.get("endpoints"))
+    print_section("Etapas do pipeline", report["stages"], baseline and baseline.get("stages"))
+
+    output = Path(args.output or f"benchmark-{report['commit']}.json")
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nResultados gravados em {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Categorização fiscal das transações por regras, sem LLM.
+
+Cada regra associa uma categoria (deduções do IRS, setores com dedução do
+IVA no e-fatura, Segurança Social, pagamentos à AT, serviços essenciais,
+...) a padrões de palavras. A ``descricao`` é normalizada (maiúsculas, sem
+acentos nem pontuação, sem tokens com dígitos como referências e datas) e
+percorrida por um autómato Aho-Corasick sobre palavras: todos os padrões
+são procurados numa só passagem, com custo proporcional ao número de
+palavras da descrição e não ao número de regras.
+
+Quando vários padrões encontram, ganha o mais comprido em palavras
+("SEGURO SAUDE" antes de "SEGURO"); em empate, a regra que aparece
+primeiro em ``RULES``. Padrões com "^" só contam no início do comerciante
+("COMPRA REST O PESCADOR", mas não "TRF P/ JOAO REST"). As categorias de
+rendimentos (``CREDIT_CATEGORIES``) só se aplicam a créditos: um débito
+"TRF SALARIO" é um salário pago, não recebido. Os resultados ficam em
+memória por descrição, por isso os comerciantes repetidos (o caso normal)
+custam uma consulta.
+
+O resultado é determinístico e pode ser aplicado a conversões já
+guardadas (``backfill_categories``). Alterar as regras obriga a
+incrementar ``RULES_VERSION`` para o backfill as voltar a aplicar.
+"""
+import logging
+import time
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Incrementar sempre que as regras mudarem
+RULES_VERSION = "3"
+CATEGORY_FIELD = "categoria_fiscal"
+
+# (categoria, padrões); padrões já normalizados (maiúsculas, sem acentos).
+# Palavras curtas ou comuns noutros contextos ("NOS", "REST", "CAFE") não
+# entram sozinhas: ou fazem parte de um padrão com mais palavras, ou levam
+# "^" e só contam no início do comerciante (ver ``merchant_start``).
+RULES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("Reembolso de IRS", (
+        "REEMBOLSO IRS", "REEMBOLSO DE IRS", "REEMB IRS", "DEVOLUCAO IRS", "REEMBOLSO AT",
+    )),
+    ("Segurança Social", (
+        "SEGURANCA SOCIAL", "SEG SOCIAL", "SEG SOC", "INSTITUTO DA SEGURANCA SOCIAL", "ISS IP",
+        "CONTRIBUICOES SS",
+    )),
+    ("Pagamento à AT", (
+        "AUTORIDADE TRIBUTARIA", "AUTORIDADE TRIBUTARIA E ADUANEIRA", "AT AUTORIDADE", "FINANCAS",
+        "PORTAL DAS FINANCAS", "DGCI", "IMI", "IUC", "IMT", "IRS", "IVA", "PAGAMENTO AO ESTADO",
+        "PAGAMENTO ESTADO", "PAG ESTADO",
+    )),
+    ("Pensões", (
+        "^PENSAO", "PENSOES", "PENSAO DE REFORMA", "^CGA", "CAIXA GERAL DE APOSENTACOES",
+        "CENTRO NACIONAL DE PENSOES", "^CNP",
+    )),
+    ("Rendimentos do trabalho", (
+        "VENCIMENTO", "ORDENADO", "SALARIO", "REMUNERACAO", "SUBSIDIO DE FERIAS", "SUBSIDIO DE NATAL",
+        "HONORARIOS",
+    )),
+    ("Saúde", (
+        "FARMACIA", "FARMACIAS", "PARAFARMACIA", "HOSPITAL", "CLINICA", "CLINICA MEDICA", "CENTRO MEDICO",
+        "CONSULTORIO", "DENTISTA", "MEDICO DENTISTA", "CLINICA DENTARIA", "ANALISES CLINICAS",
+        "LABORATORIO DE ANALISES", "OTICA", "OTICAS", "OPTICA", "OPTICAS", "MULTIOPTICAS", "CUF",
+        "LUZ SAUDE", "HOSPITAL DA LUZ", "LUSIADAS", "TROFA SAUDE", "JOAQUIM CHAVES", "GERMANO DE SOUSA",
+        "UNILABS", "SYNLAB", "FISIOTERAPIA", "PSICOLOGIA", "WELLS", "SEGURO SAUDE", "SEGURO DE SAUDE",
+        "MEDIS", "MULTICARE", "ADVANCECARE", "TAXA MODERADORA",
+    )),
+    ("Educação", (
+        "ESCOLA", "ESCOLAS", "COLEGIO", "EXTERNATO", "INFANTARIO", "CRECHE", "JARDIM DE INFANCIA",
+        "UNIVERSIDADE", "FACULDADE", "INSTITUTO SUPERIOR", "POLITECNICO", "PROPINA", "PROPINAS", "^ATL",
+        "EXPLICACOES", "CENTRO DE ESTUDOS",
+    )),
+    ("Habitação", (
+        "RENDA", "RENDA CASA", "CONDOMINIO", "PRESTACAO HABITACAO", "CREDITO HABITACAO", "CRED HABITACAO",
+        "EMPRESTIMO HABITACAO",
+    )),
+    ("Lares", (
+        "LAR DE IDOSOS", "LAR RESIDENCIAL", "RESIDENCIA SENIOR", "CENTRO DE DIA",
+    )),
+    ("Serviços essenciais", (
+        "EDP", "EDP COMERCIAL", "ENDESA", "IBERDROLA", "GOLDENERGY", "GALP ENERGIA", "GALP POWER",
+        "LUZBOA", "COOPERNICO", "SU ELETRICIDADE", "PORTGAS", "LISBOAGAS", "GAS NATURAL", "EPAL",
+        "AGUAS DE", "AGUAS DO", "SMAS", "SIMAS", "INDAQUA", "MEO", "ALTICE", "NOS COMUNICACOES", "NOS SGPS",
+        "VODAFONE", "NOWO", "DIGI",
+    )),
+    ("Despesas gerais familiares", (
+        "CONTINENTE", "MODELO CONTINENTE", "PINGO DOCE", "LIDL", "ALDI", "MINIPRECO", "INTERMARCHE",
+        "AUCHAN", "JUMBO", "MERCADONA", "LECLERC", "E LECLERC", "SPAR", "MEU SUPER", "APOLONIA",
+        "EL CORTE INGLES", "SUPERMERCADO", "HIPERMERCADO", "MERCEARIA", "TALHO", "PADARIA",
+    )),
+    ("IVA - Restauração e alojamento", (
+        "RESTAURANTE", "^REST", "SNACK BAR", "CAFETARIA", "^CAFE", "PASTELARIA", "CERVEJARIA", "MARISQUEIRA",
+        "PIZZARIA", "TASCA", "HOTEL", "HOSTEL", "ALOJAMENTO LOCAL", "POUSADA", "MCDONALDS", "BURGER KING",
+        "TELEPIZZA", "UBER EATS", "GLOVO", "BOLT FOOD",
+    )),
+    ("IVA - Reparação de automóveis", (
+        "OFICINA", "AUTO REPARACOES", "MECANICA", "NORAUTO", "MIDAS", "CARGLASS", "EUROMASTER", "PNEUS",
+        "BATE CHAPA",
+    )),
+    ("IVA - Cabeleireiros", (
+        "CABELEIREIRO", "CABELEIREIRA", "CABELEIREIROS", "BARBEARIA", "BARBEIRO", "SALAO DE BELEZA",
+        "INSTITUTO DE BELEZA", "ESTETICA",
+    )),
+    ("IVA - Veterinários", (
+        "VETERINARIO", "VETERINARIA", "CLINICA VETERINARIA", "HOSPITAL VETERINARIO",
+    )),
+    ("IVA - Passes mensais", (
+        "NAVEGANTE", "^PASSE", "PASSE SOCIAL", "METROPOLITANO DE LISBOA", "METRO LISBOA", "METRO DO PORTO",
+        "CARRIS", "CARRIS METROPOLITANA", "CP COMBOIOS", "COMBOIOS DE PORTUGAL", "ANDANTE", "STCP",
+        "FERTAGUS", "TRANSTEJO", "VIVA VIAGEM",
+    )),
+    ("IVA - Ginásios", (
+        "GINASIO", "GINASIOS", "FITNESS", "HOLMES PLACE", "SOLINCA", "VIVAGYM", "GO FIT", "PHIVE", "GYM",
+    )),
+    ("Seguros", (
+        "SEGURO", "SEGUROS", "FIDELIDADE", "TRANQUILIDADE", "ALLIANZ", "GENERALI", "AGEAS", "ZURICH",
+        "LIBERTY SEGUROS", "MAPFRE", "VICTORIA SEGUROS", "OCIDENTAL",
+    )),
+)
+
+# Rendimentos: nunca atribuídos a débitos
+CREDIT_CATEGORIES = frozenset(("Reembolso de IRS", "Pensões", "Rendimentos do trabalho"))
+
+# Palavras da operação que o banco põe antes do comerciante ("COMPRA", "DD", "TRF"...)
+OPERATION_WORDS = frozenset((
+    "COMPRA", "COMPRAS", "PAG", "PAGAMENTO", "PAGTO", "PGTO", "SERV", "SERVICOS", "DD", "DEB", "DEBITO",
+    "DIRECTO", "DIRETO", "TRF", "TRANSF", "TRANSFERENCIA", "SEPA", "CARTAO", "CRT", "MB", "WAY", "POS",
+    "TPA", "CONTACTLESS", "INTERNACIONAL", "NACIONAL",
+))
+
+# Bytes que separam palavras: tudo menos A-Z e 0-9
+_SEPARATORS = bytes(c if 65 <= c <= 90 or 48 <= c <= 57 else 32 for c in range(256))
+
+
+def normalize_description(text: str) -> Tuple[str, ...]:
+    """'Compra 1234 Farmácia S. João 12/03' -> ('COMPRA', 'FARMACIA', 'S', 'JOAO')."""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+    words = text.upper().encode("ascii", "ignore").translate(_SEPARATORS).decode("ascii").split()
+    # Tokens com dígitos (referências, datas, NIFs) só atrapalham a memoização
+    return tuple([word for word in words if word.isalpha()])
+
+
+def merchant_start(tokens: Sequence[str]) -> int:
+    """Posição da primeira palavra do comerciante, depois das palavras da operação."""
+    start = 0
+    while start < len(tokens) and tokens[start] in OPERATION_WORDS:
+        start += 1
+    return start
+
+
+class _Automaton:
+    """Aho-Corasick sobre palavras: ``goto`` por nó, ligações de falha e saídas ordenadas por nó."""
+
+    def __init__(self, rules: Sequence[Tuple[str, Sequence[str]]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        # Padrões que terminam no nó (incluindo pelas ligações de falha), do
+        # melhor para o pior: ((-palavras, ordem da regra, categoria), ancorado)
+        self.output: List[List[Tuple[Tuple[int, int, str], bool]]] = [[]]
+        for order, (category, patterns) in enumerate(rules):
+            for pattern in patterns:
+                anchored = pattern.startswith("^")
+                words = pattern.lstrip("^").split()
+                node = 0
+                for word in words:
+                    nxt = self.goto[node].get(word)
+                    if nxt is None:
+                        nxt = len(self.goto)
+                        self.goto[node][word] = nxt
+                        self.goto.append({})
+                        self.output.append([])
+                    node = nxt
+                self.output[node].append(((-len(words), order, category), anchored))
+
+        # Ligações de falha em largura: cada nó herda as saídas do seu sufixo,
+        # que é menos profundo e por isso já tem a lista completa
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            self.output[node] = sorted(self.output[node] + self.output[self.fail[node]])
+            for word, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(word, 0)
+                self.fail[child] = target if target != child else 0
+                queue.append(child)
+
+    def best(self, tokens: Sequence[str], start: int = 0) -> Optional[str]:
+        """Categoria do melhor padrão em ``tokens``; os ancorados só contam a começar em ``start``."""
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        best = None
+        for end, token in enumerate(tokens):
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            for rank, anchored in output[node]:
+                if best is not None and rank >= best:
+                    break
+                if anchored and end + rank[0] + 1 != start:
+                    continue
+                best = rank
+                break
+        return best[2] if best is not None else None
+
+
+# Por ``credit``: os débitos usam um autómato sem as categorias de rendimentos
+_automata = {
+    True: _Automaton(RULES),
+    False: _Automaton([rule for rule in RULES if rule[0] not in CREDIT_CATEGORIES]),
+}
+
+
+def is_credit(transaction: Dict) -> bool:
+    """Pelo ``tipo`` ("crédito"/"débito"); sem tipo, pelo sinal do ``valor``."""
+    tipo = str(transaction.get("tipo") or "").strip().lower()
+    if tipo:
+        return tipo.startswith("c")
+    valor = transaction.get("valor")
+    return isinstance(valor, (int, float)) and valor > 0
+
+
+@lru_cache(maxsize=65536)
+def _categorize_tokens(tokens: Tuple[str, ...], credit: bool) -> Optional[str]:
+    return _automata[credit].best(tokens, merchant_start(tokens))
+
+
+@lru_cache(maxsize=65536)
+def categorize(descricao: str, credit: bool = False) -> Optional[str]:
+    """Categoria fiscal de uma descrição, ou None se nenhuma regra se aplicar."""
+    return _categorize_tokens(normalize_description(descricao), credit)
+
+
+def categorize_transactions(transactions: List[Dict]) -> Tuple[List[Dict], int]:
+    """Preenche ``categoria_fiscal`` num extrato inteiro: ``(transações, quantas mudaram)``.
+
+    As regras são a fonte da categoria (sem regra fica None). Só as linhas
+    que mudam são copiadas; as restantes são devolvidas tal como estão.
+    """
+    categorized = list(transactions)
+    changed = 0
+    for i, transaction in enumerate(transactions):
+        category = categorize(str(transaction.get("descricao") or ""), is_credit(transaction))
+        if transaction.get(CATEGORY_FIELD, ...) != category:
+            categorized[i] = {**transaction, CATEGORY_FIELD: category}
+            changed += 1
+    return categorized, changed
+
+
+def stats() -> Dict:
+    info = categorize.cache_info()
+    tokens_info = _categorize_tokens.cache_info()
+    return {
+        "rules_version": RULES_VERSION,
+        "descriptions_cached": info.currsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "merchants_cached": tokens_info.currsize,
+    }
+
+
+# Chamado para cada conversão cujas categorias mudaram (ex.: invalidar exportações)
+ChangedHandler = Callable[[Dict], Awaitable[None]]
+
+
+async def backfill_categories(
+    conversions,
+    transactions,
+    on_changed: Optional[ChangedHandler] = None,
+    batch_size: int = 200,
+) -> Dict:
+    """Aplica as regras atuais a todas as conversões concluídas ainda noutra versão.
+
+    Lê as transações lote a lote (``conversion_transactions``), grava só os
+    lotes que mudam e marca ``categorization_version`` em cada conversão, por
+    isso pode ser interrompido e retomado. As conversões antigas com as
+    transações ainda em ``extracted_data.transacoes`` ficam de fora (e por
+    marcar) até ``migrate_legacy_conversions`` as mover; ``legacy`` diz
+    quantas faltam.
+    """
+    started = time.perf_counter()
+    totals = {"conversions": 0, "transactions": 0, "changed": 0}
+    pending = {"status": "completed", "categorization_version": {"$ne": RULES_VERSION}}
+    query = {**pending, "extracted_data.transacoes": {"$exists": False}}
+    while True:
+        batch = await conversions.find(
+            query, {"_id": 0, "id": 1, "batch_id": 1, "transactions_generation": 1}
+        ).to_list(batch_size)
+        if not batch:
+            break
+        for conversion in batch:
+            updates = []
+            changed = 0
+            stored = {"conversion_id": conversion["id"], "generation": conversion.get("transactions_generation")}
+            async for doc in transactions.find(stored, {"_id": 1, "rows": 1}):
+                rows, count = categorize_transactions(doc["rows"])
+                totals["transactions"] += len(rows)
+                if count:
+                    changed += count
+                    updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"rows": rows}}))
+            if updates:
+                await transactions.bulk_write(updates, ordered=False)
+            await conversions.update_one(
+                {"id": conversion["id"]}, {"$set": {"categorization_version": RULES_VERSION}}
+            )
+            if changed and on_changed is not None:
+                await on_changed(conversion)
+            totals["conversions"] += 1
+            totals["changed"] += changed
+        logger.info(f"Categorias: {totals['conversions']} conversões, {totals['transactions']} transações")
+    totals["legacy"] = await conversions.count_documents({**pending, "extracted_data.transacoes": {"$exists": True}})
+    totals["seconds"] = round(time.perf_counter() - started, 2)
+    return totals
@@ -0,0 +1,152 @@
+"""Índices do MongoDB e diagnóstico dos planos das queries principais.
+
+``ensure_indexes`` corre no arranque da app e é idempotente (``create_indexes``
+não faz nada se o índice já existir). Para verificar os planos:
+
+    cd backend && python db_indexes.py            # só cria os índices
+    cd backend && python db_indexes.py --check    # cria e verifica os planos
+
+Executa ``explain()`` em cada query quente e termina com código 1 se alguma
+fizer COLLSCAN.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from retention import purge_query
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "subscriptions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Uma única subscrição ativa por utilizador (também protege o upsert da quota);
+        # a mudança de plano altera o documento ativo em vez de criar outro (quota.switch_plan)
+        IndexModel(
+            [("user_id", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"status": "active"},
+            name="user_active_unique",
+        ),
+    ],
+    "conversions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Listagem paginada por (created_at, id) descendentes
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_created_at_id",
+        ),
+        IndexModel([("batch_id", ASCENDING)], sparse=True, name="batch_id"),
+        # Limpeza dos ficheiros expirados (retention.py)
+        IndexModel([("expires_at", ASCENDING)], name="expires_at"),
+    ],
+    "conversion_batches": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+    ],
+}
+
+# (coleção, filtro, ordenação) das queries de server.py e retention.py, com valores de exemplo
+HOT_QUERIES: List[Tuple[str, Dict[str, Any], List[Tuple[str, int]]]] = [
+    ("users", {"email": "diagnostico@example.com"}, []),
+    ("users", {"id": "diagnostico"}, []),
+    ("subscriptions", {"user_id": "diagnostico", "status": "active"}, []),
+    ("subscriptions", {"id": "diagnostico"}, []),
+    ("conversions", {"user_id": "diagnostico"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("conversions", {"id": "diagnostico", "user_id": "diagnostico"}, []),
+    ("conversions", {"batch_id": "diagnostico", "user_id": "diagnostico"}, []),
+    ("conversion_batches", {"id": "diagnostico", "user_id": "diagnostico"}, []),
+    # RetentionSweeper: backfill, planos dos utilizadores e conversões a limpar
+    ("conversions", {"expires_at": {"$exists": False}}, []),
+    ("subscriptions", {"user_id": {"$in": ["diagnostico"]}, "status": "active"}, []),
+    ("conversions", purge_query(datetime(2000, 1, 1, tzinfo=timezone.utc)), []),
+    ("conversion_transactions", {"conversion_id": "diagnostico", "generation": 0}, [("seq", ASCENDING)]),
+    ("payment_transactions", {"session_id": "diagnostico"}, []),
+    ("payment_transactions", {"session_id": "diagnostico", "user_id": "diagnostico"}, []),
+]
+
+
+async def ensure_indexes(db):
+    """Cria os índices em falta. Um índice que falhe (ex.: duplicados antigos) não impede o arranque."""
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                logger.error(f"Não foi possível criar o índice {model.document['name']} em {collection}: {str(e)}")
+
+
+def _stages(plan: Dict[str, Any]):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def check_query_plans(db) -> List[Dict[str, Any]]:
+    """Executa explain() em cada query de HOT_QUERIES e devolve o resumo."""
+    report = []
+    for collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning = explain["queryPlanner"]["winningPlan"]
+        stages = [s for s in _stages(winning) if s]
+        report.append({
+            "collection": collection,
+            "query": query,
+            "sort": sort,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    try:
+        if not args.no_create:
+            await ensure_indexes(db)
+            print("Índices verificados.")
+        report = await check_query_plans(db) if args.check else []
+    finally:
+        client.close()
+
+    failed = False
+    for entry in report:
+        status = "COLLSCAN" if entry["collscan"] else "ok"
+        failed = failed or entry["collscan"]
+        print(f"[{status:8}] {entry['collection']}.find({entry['query']}) sort={entry['sort']} -> {' <- '.join(entry['stages'])}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índices e planos das queries do MongoDB")
+    parser.add_argument("--check", action="store_true", help="executa explain() nas queries principais")
+    parser.add_argument("--no-create", action="store_true", help="não cria índices antes de verificar")
+    args = parser.parse_args()
+    if not args.check and args.no_create:
+        parser.error("--no-create só faz sentido com --check")
+    sys.exit(asyncio.run(_main(args)))
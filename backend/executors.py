@@ -0,0 +1,193 @@
+"""Executores para tirar trabalho bloqueante do event loop.
+
+- ``io``: pool de threads para I/O bloqueante (escrita de uploads, disco,
+  S3). É também instalado como executor por omissão do loop, por isso os
+  ``asyncio.to_thread`` dos outros módulos ficam limitados ao mesmo pool.
+- ``cpu``: pool de processos para trabalho CPU (gerar XLSX/CSV, ler PDFs,
+  interpretar respostas grandes do LLM). Numa thread este trabalho segura o
+  GIL e atrasa o event loop na mesma; num processo não. Os processos são
+  criados com ``spawn`` (o pai tem threads do Motor) e só no primeiro uso,
+  para não pesar no arranque. Com ``cpu_workers=0`` o trabalho CPU vai para
+  o pool de threads.
+
+As funções enviadas para o pool de processos têm de ser de módulos
+importáveis sem efeitos laterais (``exports``, ``pdf_tools``, ``llm_json``,
+...), nunca de ``server``; argumentos e resultados são serializados. Com
+``spawn`` cada processo reimporta o script principal, por isso os scripts
+que usam estes executores precisam de ``if __name__ == "__main__"``.
+
+``stats()`` expõe, por pool, trabalhos em curso, fila (em curso acima do
+número de workers) e tempos; ``LoopLagMonitor`` mede o atraso do event
+loop, que é o que estes pools existem para manter baixo.
+"""
+import asyncio
+import functools
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+
+class _Tracker:
+    """Contagens de um executor; os callbacks correm nas threads do pool, daí o lock."""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def track(self, future: Future):
+        submitted = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        def done(f: Future):
+            elapsed_ms = (time.perf_counter() - submitted) * 1000
+            with self._lock:
+                self.in_flight -= 1
+                if f.cancelled() or f.exception() is not None:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self.total_ms += elapsed_ms
+                self.max_ms = max(self.max_ms, elapsed_ms)
+
+        future.add_done_callback(done)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.max_workers,
+                "in_flight": self.in_flight,
+                # Pools FIFO: tudo o que está em curso acima do número de workers está à espera
+                "queue_depth": max(0, self.in_flight - self.max_workers),
+                "max_in_flight": self.max_in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                # Da submissão ao fim (espera na fila + execução)
+                "avg_ms": round(self.total_ms / finished, 2) if finished else 0.0,
+                "max_ms": round(self.max_ms, 2),
+            }
+
+
+class _TrackedThreadPool(ThreadPoolExecutor):
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.tracker = _Tracker(max_workers)
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        self.tracker.track(future)
+        return future
+
+
+class _TrackedProcessPool(ProcessPoolExecutor):
+    def __init__(self, max_workers: int):
+        super().__init__(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.tracker = _Tracker(max_workers)
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        self.tracker.track(future)
+        return future
+
+
+class LoopLagMonitor:
+    """Acorda a cada ``interval`` segundos e mede quanto o event loop atrasou o despertar."""
+
+    def __init__(self, interval: float = 0.25, window: int = 240):
+        self.interval = interval
+        self._samples: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0.0, loop.time() - expected) * 1000)
+
+    def stats(self) -> Dict:
+        samples = list(self._samples)
+        if not samples:
+            return {"last_ms": 0.0, "max_ms": 0.0}
+        # Máximo da janela recente (por omissão ~1 minuto), não desde o arranque
+        return {"last_ms": round(samples[-1], 2), "max_ms": round(max(samples), 2)}
+
+
+class Executors:
+    def __init__(self, io_workers: int = 16, cpu_workers: int = 2, lag_interval: float = 0.25):
+        self.io = _TrackedThreadPool(max_workers=io_workers, thread_name_prefix="io")
+        self.cpu_workers = cpu_workers
+        self._cpu: Optional[_TrackedProcessPool] = None
+        self._cpu_lock = threading.Lock()
+        self.cpu_restarts = 0
+        self.loop_lag = LoopLagMonitor(lag_interval)
+
+    def _cpu_pool(self) -> Executor:
+        if self.cpu_workers <= 0:
+            return self.io
+        with self._cpu_lock:
+            if self._cpu is None:
+                self._cpu = _TrackedProcessPool(self.cpu_workers)
+            return self._cpu
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        """Usa o pool de I/O como executor por omissão do loop e começa a medir o atraso."""
+        loop.set_default_executor(self.io)
+        self.loop_lag.start()
+
+    async def run_io(self, fn: Callable, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.io, functools.partial(fn, *args, **kwargs))
+
+    async def run_cpu(self, fn: Callable, *args, **kwargs) -> Any:
+        pool = self._cpu_pool()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        except BrokenProcessPool:
+            # Um processo morreu (ex.: OOM): o pool fica inutilizável, o próximo pedido cria outro
+            with self._cpu_lock:
+                if self._cpu is pool:
+                    self._cpu = None
+                    self.cpu_restarts += 1
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    async def shutdown(self):
+        """Deixa terminar o trabalho já submetido e fecha os pools."""
+        await self.loop_lag.stop()
+        with self._cpu_lock:
+            cpu, self._cpu = self._cpu, None
+        if cpu is not None:
+            cpu.shutdown(wait=True)
+        self.io.shutdown(wait=True)
+
+    def stats(self) -> Dict:
+        cpu = self._cpu
+        if self.cpu_workers <= 0:
+            cpu_stats = {"mode": "threads"}
+        elif cpu is None:
+            cpu_stats = {"mode": "processes", "workers": self.cpu_workers, "started": False}
+        else:
+            cpu_stats = {"mode": "processes", "started": True, **cpu.tracker.stats()}
+        cpu_stats["restarts"] = self.cpu_restarts
+        return {"io": self.io.tracker.stats(), "cpu": cpu_stats, "loop_lag": self.loop_lag.stats()}
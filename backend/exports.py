@@ -0,0 +1,292 @@
+"""Exportação CSV/XLSX gerada a pedido, com cache em disco limitado por tamanho.
+
+Os ficheiros só são gerados no primeiro download de cada formato e ficam em
+``<UPLOAD_DIR>/exports``. Quando o total ultrapassa ``max_bytes`` são
+apagados os menos usados recentemente (o mtime é atualizado a cada acesso).
+
+A geração nunca materializa o extrato inteiro: o CSV é produzido linha a
+linha (e pode ser enviado em streaming) e o XLSX usa o modo write-only do
+openpyxl, que escreve as linhas para disco à medida que são adicionadas.
+Quando as linhas vêm do MongoDB e o XLSX é gerado noutro processo, passam
+antes por um spool JSON Lines em disco (``write_spool``/``write_xlsx_spool``).
+O openpyxl só é importado no primeiro XLSX, para não pesar no arranque.
+"""
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+EXPORT_FORMATS: Dict[str, Dict[str, str]] = {
+    "csv": {"suffix": ".csv", "media_type": "text/csv"},
+    "excel": {
+        "suffix": ".xlsx",
+        "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    },
+}
+
+# "pt": separador ";" e vírgula decimal, como o Excel em português espera
+EXPORT_LOCALES: Dict[str, Dict[str, str]] = {
+    "default": {"delimiter": ",", "decimal": "."},
+    "pt": {"delimiter": ";", "decimal": ","},
+}
+
+EXPORT_COLUMNS = ["data", "descricao", "valor", "tipo", "categoria_fiscal"]
+CSV_FLUSH_BYTES = 64 * 1024
+# Caracteres proibidos pelo Excel nos nomes das folhas (máx. 31 caracteres)
+SHEET_INVALID_CHARS = re.compile(r"[\[\]:*?/\\]")
+SHEET_TITLE_MAX = 31
+
+
+def export_columns(first_row: Dict) -> List[str]:
+    columns = list(first_row.keys()) if first_row else []
+    return columns + [c for c in EXPORT_COLUMNS if c not in columns]
+
+
+def _format_cell(value, decimal: str):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        text = repr(value)
+        return text.replace(".", decimal) if decimal != "." else text
+    return value
+
+
+class _CsvBlocks:
+    """Escreve linhas CSV num buffer e entrega-o em blocos de ~64 KB.
+
+    As colunas são definidas pela primeira linha recebida.
+    """
+
+    def __init__(self, locale: str):
+        options = EXPORT_LOCALES[locale]
+        self.locale = locale
+        self.decimal = options["decimal"]
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, delimiter=options["delimiter"], lineterminator="\n")
+        self.columns: Optional[List[str]] = None
+
+    def _header(self, first_row: Optional[Dict]):
+        self.columns = export_columns(first_row)
+        if self.locale == "pt":
+            # BOM para o Excel reconhecer UTF-8 (acentos nas descrições)
+            self.buffer.write("\ufeff")
+        self.writer.writerow(self.columns)
+
+    def _drain(self) -> bytes:
+        block = self.buffer.getvalue().encode("utf-8")
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return block
+
+    def add(self, row: Dict) -> Optional[bytes]:
+        if self.columns is None:
+            self._header(row)
+        self.writer.writerow([_format_cell(row.get(c), self.decimal) for c in self.columns])
+        return self._drain() if self.buffer.tell() >= CSV_FLUSH_BYTES else None
+
+    def finish(self) -> Optional[bytes]:
+        if self.columns is None:
+            self._header(None)
+        return self._drain() if self.buffer.tell() else None
+
+
+def iter_csv(transactions: Iterable[Dict], locale: str = "default") -> Iterator[bytes]:
+    """Gera o CSV em blocos de ~64 KB, sem construir o ficheiro em memória."""
+    blocks = _CsvBlocks(locale)
+    for row in transactions:
+        block = blocks.add(row)
+        if block:
+            yield block
+    block = blocks.finish()
+    if block:
+        yield block
+
+
+async def aiter_csv(batches: AsyncIterable[List[Dict]], locale: str = "default") -> AsyncIterator[bytes]:
+    """Como ``iter_csv``, mas a partir de lotes lidos de forma assíncrona."""
+    blocks = _CsvBlocks(locale)
+    async for rows in batches:
+        for row in rows:
+            block = blocks.add(row)
+            if block:
+                yield block
+    block = blocks.finish()
+    if block:
+        yield block
+
+
+def write_csv(transactions: Iterable[Dict], path: Path, locale: str = "default"):
+    with open(path, "wb") as f:
+        for chunk in iter_csv(transactions, locale):
+            f.write(chunk)
+
+
+def sheet_title(name: str, used: Set[str]) -> str:
+    """Nome de folha válido e único (o Excel não distingue maiúsculas)."""
+    base = SHEET_INVALID_CHARS.sub("_", name).strip("' ") or "Extrato"
+    title = base[:SHEET_TITLE_MAX]
+    n = 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title = base[:SHEET_TITLE_MAX - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+
+def _append_rows(ws, transactions: Iterable[Dict]):
+    rows = iter(transactions)
+    first = next(rows, None)
+    columns = export_columns(first)
+    ws.append(columns)
+    if first is not None:
+        ws.append([first.get(c) for c in columns])
+    for row in rows:
+        ws.append([row.get(c) for c in columns])
+
+
+def write_xlsx(transactions: Iterable[Dict], path: Path):
+    """XLSX em modo write-only: a memória não cresce com o número de linhas.
+
+    Os valores vão como números, por isso o separador decimal fica a cargo do Excel.
+    """
+    write_xlsx_sheets([("Transações", transactions)], path)
+
+
+def write_xlsx_sheets(sheets: Iterable[Tuple[str, Iterable[Dict]]], path: Path):
+    """Uma folha por ``(nome, transações)``, ex.: um extrato por folha num lote."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    used: Set[str] = set()
+    for name, transactions in sheets:
+        _append_rows(wb.create_sheet(sheet_title(name, used)), transactions)
+    wb.save(path)
+
+
+def write_spool_sheet(out, sheet: int, name: str):
+    """Início de uma folha no spool; as linhas seguintes com o mesmo ``sheet`` pertencem-lhe."""
+    out.write(json.dumps([sheet, name], ensure_ascii=False) + "\n")
+
+
+def write_spool(out, sheet: int, rows: Iterable[Dict]):
+    """Acrescenta ``rows`` à folha ``sheet`` do spool (uma linha JSON por transação)."""
+    out.write("".join(json.dumps([sheet, row], ensure_ascii=False, default=str) + "\n" for row in rows))
+
+
+def _read_spool(spool: Path) -> Iterator[Tuple[str, Iterator[Dict]]]:
+    with open(spool, encoding="utf-8") as f:
+        for _, lines in itertools.groupby(map(json.loads, f), key=lambda line: line[0]):
+            _, name = next(lines)
+            yield name, (row for _, row in lines)
+
+
+def write_xlsx_spool(spool: Path, path: Path):
+    """XLSX a partir de um spool (``write_spool_sheet``/``write_spool``), lido linha a linha."""
+    write_xlsx_sheets(_read_spool(spool), path)
+
+
+def render_export(fmt: str, transactions: Iterable[Dict], path: Path, locale: str = "default"):
+    if fmt == "csv":
+        write_csv(transactions, path, locale)
+    else:
+        write_xlsx(transactions, path)
+
+
+class ExportCache:
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str, fmt: str, locale: str = "default") -> Path:
+        variant = "" if locale == "default" else f"-{locale}"
+        return self.directory / f"{key}{variant}{EXPORT_FORMATS[fmt]['suffix']}"
+
+    def lookup(self, key: str, fmt: str, locale: str = "default") -> Optional[Path]:
+        """Ficheiro já gerado (e marcado como usado), ou None."""
+        path = self.path_for(key, fmt, locale)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    async def build(
+        self, key: str, fmt: str, render: Callable[[Path], Awaitable[None]], locale: str = "default"
+    ) -> Path:
+        """Devolve o ficheiro em cache; se não existir, ``await render(path)`` escreve-o.
+
+        Permite gerar num executor (ex.: pool de processos) sem ocupar o event loop.
+        """
+        cached = self.lookup(key, fmt, locale)
+        if cached is not None:
+            return cached
+        path = self.path_for(key, fmt, locale)
+        # Escreve para um temporário e troca de forma atómica: downloads
+        # simultâneos nunca veem um ficheiro a meio
+        tmp_path = self.directory / f".{uuid.uuid4()}{path.suffix}"
+        try:
+            await render(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        await asyncio.to_thread(self.evict, path)
+        return path
+
+    async def store_stream(
+        self, key: str, fmt: str, blocks: Union[Iterable[bytes], AsyncIterable[bytes]], locale: str = "default"
+    ) -> Path:
+        """Grava em cache um ficheiro gerado em blocos (``iter_csv``/``aiter_csv``)."""
+        path = self.path_for(key, fmt, locale)
+        tmp_path = self.directory / f".{uuid.uuid4()}{path.suffix}"
+        try:
+            with open(tmp_path, "wb") as f:
+                if hasattr(blocks, "__aiter__"):
+                    async for block in blocks:
+                        await asyncio.to_thread(f.write, block)
+                else:
+                    await asyncio.to_thread(f.writelines, blocks)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        await asyncio.to_thread(self.evict, path)
+        return path
+
+    def variant_names(self, key: str) -> List[str]:
+        """Nomes de todos os ficheiros (formatos e variantes regionais) de ``key``."""
+        return [self.path_for(key, fmt, locale).name for fmt in EXPORT_FORMATS for locale in EXPORT_LOCALES]
+
+    def invalidate(self, key: str):
+        for name in self.variant_names(key):
+            (self.directory / name).unlink(missing_ok=True)
+
+    def evict(self, keep: Path = None):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            entries.sort()
+            for _, size, entry_path in entries:
+                if total <= self.max_bytes:
+                    break
+                if keep is not None and entry_path == str(keep):
+                    continue
+                try:
+                    os.unlink(entry_path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,60 @@
+"""Cache dos resultados de extração, indexado pelo conteúdo do PDF.
+
+A chave é um SHA-256 de (hash do conteúdo, banco, versão do prompt), por isso
+o mesmo extrato re-enviado nunca volta a pagar uma chamada ao LLM. Há dois
+níveis: um LRU em memória por processo e a coleção ``extraction_cache`` no
+MongoDB, com índice TTL para expirar entradas antigas.
+"""
+import copy
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from cachetools import LRUCache
+from pymongo.errors import DocumentTooLarge
+
+
+def extraction_cache_key(content_sha256: str, bank_name: str, prompt_version: str) -> str:
+    raw = f"{content_sha256}\x00{bank_name.strip().lower()}\x00{prompt_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, collection, ttl_seconds: int = 30 * 24 * 3600, lru_size: int = 256):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._lru: LRUCache = LRUCache(maxsize=lru_size)
+        self.stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("key", unique=True)
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self._lru.get(key)
+        if data is not None:
+            self.stats["memory_hits"] += 1
+            return copy.deepcopy(data)
+
+        entry = await self.collection.find_one({"key": key}, {"_id": 0, "data": 1})
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["mongo_hits"] += 1
+        self._lru[key] = entry["data"]
+        return copy.deepcopy(entry["data"])
+
+    async def set(self, key: str, data: Dict[str, Any]):
+        # Respostas com erro de parsing ou incompletas não são guardadas para permitir nova tentativa
+        if data.get("erro") or data.get("parcial"):
+            return
+        self._lru[key] = copy.deepcopy(data)
+        try:
+            await self.collection.update_one(
+                {"key": key},
+                {"$set": {"key": key, "data": data, "created_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+        except DocumentTooLarge:
+            # Extratos acima de 16 MB ficam só no LRU do processo
+            pass
@@ -0,0 +1,223 @@
+"""Fila de conversões persistida em MongoDB.
+
+Cada job fica na coleção ``conversion_jobs``. Os workers reclamam jobs com um
+``find_one_and_update`` atómico que lhes atribui um *lease*; se o processo
+morrer a meio, o lease expira e o job volta a poder ser reclamado por outro
+worker (até ``max_attempts`` tentativas).
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    """Erro que não vale a pena repetir (ex.: LLM não configurado)."""
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ConversionJobQueue:
+    def __init__(self, collection, lease_seconds: int = 300, max_attempts: int = 3):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("status", ASCENDING), ("available_at", ASCENDING)])
+        await self.collection.create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+
+    async def enqueue(self, conversion_id: str, payload: Dict[str, Any]) -> str:
+        now = _utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "conversion_id": conversion_id,
+            "payload": payload,
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "worker_id": None,
+            "lease_expires_at": None,
+            "available_at": now,
+            "created_at": now,
+            "last_error": None,
+        }
+        await self.collection.insert_one(job)
+        return job["id"]
+
+    async def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Reclama o job disponível mais antigo (ou um cujo lease expirou)."""
+        now = _utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "attempts": {"$lt": self.max_attempts},
+                "$or": [
+                    {"status": JOB_QUEUED, "available_at": {"$lte": now}},
+                    {"status": JOB_LEASED, "lease_expires_at": {"$lte": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": JOB_LEASED,
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", ASCENDING)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def extend_lease(self, job_id: str, worker_id: str) -> bool:
+        result = await self.collection.update_one(
+            {"id": job_id, "worker_id": worker_id, "status": JOB_LEASED},
+            {"$set": {"lease_expires_at": _utcnow() + timedelta(seconds=self.lease_seconds)}},
+        )
+        return result.modified_count == 1
+
+    async def complete(self, job_id: str, worker_id: str):
+        await self.collection.update_one(
+            {"id": job_id, "worker_id": worker_id},
+            {"$set": {"status": JOB_DONE, "lease_expires_at": None, "finished_at": _utcnow()}},
+        )
+
+    async def fail(self, job: Dict[str, Any], worker_id: str, error: str, retry: bool = True) -> bool:
+        """Devolve o job à fila com backoff, ou marca-o como falhado.
+
+        Retorna True se o job falhou definitivamente.
+        """
+        final = not retry or job.get("attempts", 0) >= self.max_attempts
+        if final:
+            updates = {"status": JOB_FAILED, "lease_expires_at": None, "finished_at": _utcnow()}
+        else:
+            backoff = min(300, 5 * 2 ** job.get("attempts", 0))
+            updates = {
+                "status": JOB_QUEUED,
+                "lease_expires_at": None,
+                "available_at": _utcnow() + timedelta(seconds=backoff),
+            }
+        updates["last_error"] = error[:1000]
+        await self.collection.update_one({"id": job["id"], "worker_id": worker_id}, {"$set": updates})
+        return final
+
+    async def reap_expired(self) -> List[Dict[str, Any]]:
+        """Marca como falhados os jobs cujo lease expirou sem tentativas restantes."""
+        now = _utcnow()
+        query = {
+            "status": JOB_LEASED,
+            "lease_expires_at": {"$lte": now},
+            "attempts": {"$gte": self.max_attempts},
+        }
+        dead = await self.collection.find(query, {"_id": 0}).to_list(100)
+        if dead:
+            await self.collection.update_many(
+                {"id": {"$in": [j["id"] for j in dead]}, **query},
+                {"$set": {"status": JOB_FAILED, "last_error": "lease expired", "finished_at": now}},
+            )
+        return dead
+
+    async def depth(self) -> int:
+        return await self.collection.count_documents({"status": {"$in": [JOB_QUEUED, JOB_LEASED]}})
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+DeadJobHandler = Callable[[Dict[str, Any], str], Awaitable[None]]
+
+
+class ConversionWorkerPool:
+    """Conjunto de N workers assíncronos a consumir a fila (concorrência limitada a N)."""
+
+    def __init__(
+        self,
+        queue: ConversionJobQueue,
+        handler: JobHandler,
+        on_dead: DeadJobHandler,
+        concurrency: int = 2,
+        poll_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.on_dead = on_dead
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        self._stopping.clear()
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._run(f"{self.worker_prefix}:{i}")))
+        if self.concurrency:
+            self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info("Conversion worker pool started with %d workers", self.concurrency)
+
+    async def stop(self):
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _heartbeat(self, job_id: str, worker_id: str):
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            await self.queue.extend_lease(job_id, worker_id)
+
+    async def _run(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(worker_id)
+            except Exception as e:
+                logger.error(f"Erro ao reclamar job: {str(e)}")
+                await self._sleep(self.poll_interval * 5)
+                continue
+            if not job:
+                await self._sleep(self.poll_interval)
+                continue
+
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"], worker_id))
+            try:
+                await self.handler(job)
+                await self.queue.complete(job["id"], worker_id)
+            except asyncio.CancelledError:
+                # O lease expira e outro worker retoma o job
+                raise
+            except Exception as e:
+                retry = not isinstance(e, PermanentJobError)
+                logger.error(f"Job {job['id']} falhou (tentativa {job.get('attempts')}): {str(e)}")
+                if await self.queue.fail(job, worker_id, str(e), retry=retry):
+                    await self.on_dead(job, str(e))
+            finally:
+                heartbeat.cancel()
+
+    async def _reaper(self):
+        while not self._stopping.is_set():
+            try:
+                for job in await self.queue.reap_expired():
+                    await self.on_dead(job, "lease expired")
+            except Exception as e:
+                logger.error(f"Erro no reaper da fila: {str(e)}")
+            await self._sleep(max(self.poll_interval, 30.0))
@@ -0,0 +1,359 @@
+"""Cliente partilhado para as chamadas ao LLM de extração.
+
+Todas as chamadas passam por ``LLMClient.complete``, que aplica por ordem:
+
+- limite de chamadas simultâneas por utilizador e global;
+- token bucket com o ritmo permitido pelo fornecedor (pedidos por minuto);
+- timeout por chamada;
+- novas tentativas com backoff exponencial e jitter para erros transitórios
+  (429, 5xx, timeouts, falhas de ligação);
+- circuit breaker: depois de ``failure_threshold`` falhas transitórias
+  seguidas deixa de chamar o fornecedor durante ``reset_seconds`` e falha
+  logo com ``LLMUnavailable``; depois deixa passar uma chamada de teste.
+
+O backend é configurável (``LLM_BACKEND``): ``emergent`` usa o
+``emergentintegrations``; ``stub`` devolve um extrato vazio, útil para
+desenvolvimento local sem chave. Os testes podem passar qualquer subclasse
+de ``LLMBackend`` e substituir o relógio (``clock``/``sleep``) e o gerador
+do jitter (``rng``).
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+Clock = Callable[[], float]
+Sleep = Callable[[float], Awaitable[None]]
+
+SYSTEM_MESSAGE = (
+    "És um assistente especializado em análise de extratos bancários portugueses. "
+    "Retorna APENAS JSON válido, sem texto adicional."
+)
+
+TRANSIENT_MARKERS = (
+    "429", "500", "502", "503", "504", "rate limit", "resource exhausted", "resource_exhausted",
+    "overloaded", "unavailable", "timeout", "timed out", "connection",
+)
+
+
+class LLMError(Exception):
+    """A chamada falhou (erro definitivo ou tentativas esgotadas)."""
+
+
+class LLMUnavailable(LLMError):
+    """Circuit breaker aberto: o fornecedor está a falhar e não é chamado."""
+
+
+class TransientLLMError(LLMError):
+    """Erro que um backend sabe ser transitório (vale a pena tentar de novo)."""
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, TransientLLMError)):
+        return True
+    message = str(exc).lower()
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+
+class LLMBackend:
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    async def send(self, prompt: str, file_path: Optional[str] = None, mime_type: str = "application/pdf") -> str:
+        raise NotImplementedError
+
+    async def stream(
+        self, prompt: str, file_path: Optional[str] = None, mime_type: str = "application/pdf"
+    ) -> AsyncIterator[str]:
+        """Backends sem streaming entregam a resposta inteira num só pedaço."""
+        yield await self.send(prompt, file_path, mime_type)
+
+
+class EmergentLLMBackend(LLMBackend):
+    name = "emergent"
+
+    def __init__(self, api_key: str, provider: str = "gemini", model: str = "gemini-2.0-flash"):
+        self.api_key = api_key
+        self.provider = provider
+        self.model = model
+        try:
+            from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType  # type: ignore
+            self._llm = (LlmChat, UserMessage, FileContentWithMimeType)
+        except Exception:
+            self._llm = None
+
+    @property
+    def available(self) -> bool:
+        return self._llm is not None and bool(self.api_key)
+
+    async def send(self, prompt: str, file_path: Optional[str] = None, mime_type: str = "application/pdf") -> str:
+        LlmChat, UserMessage, FileContentWithMimeType = self._llm
+        # O LlmChat guarda o histórico da sessão; cada extração é independente,
+        # por isso usa sempre uma sessão nova
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=str(uuid.uuid4()),
+            system_message=SYSTEM_MESSAGE,
+        ).with_model(self.provider, self.model)
+        file_contents = [FileContentWithMimeType(file_path=file_path, mime_type=mime_type)] if file_path else None
+        return await chat.send_message(UserMessage(text=prompt, file_contents=file_contents))
+
+
+class StubLLMBackend(LLMBackend):
+    """Resposta fixa após ``latency`` segundos, sem rede (em streaming, repartida em ``chunks`` pedaços)."""
+
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, response: Optional[Dict] = None, chunks: int = 8):
+        self.latency = latency
+        self.chunks = max(1, chunks)
+        self.response = response or {
+            "banco": "Desconhecido",
+            "periodo": "Não identificado",
+            "saldo_inicial": 0.0,
+            "saldo_final": 0.0,
+            "transacoes": [],
+        }
+
+    async def send(self, prompt: str, file_path: Optional[str] = None, mime_type: str = "application/pdf") -> str:
+        await asyncio.sleep(self.latency)
+        return json.dumps(self.response, ensure_ascii=False)
+
+    async def stream(
+        self, prompt: str, file_path: Optional[str] = None, mime_type: str = "application/pdf"
+    ) -> AsyncIterator[str]:
+        text = json.dumps(self.response, ensure_ascii=False)
+        size = -(-len(text) // self.chunks)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield text[start:start + size]
+
+
+def build_backend(name: str, api_key: str) -> LLMBackend:
+    if name == "stub":
+        return StubLLMBackend()
+    return EmergentLLMBackend(api_key)
+
+
+class TokenBucket:
+    """``rate`` pedidos por segundo com rajadas até ``capacity``; ``rate <= 0`` desativa."""
+
+    def __init__(self, rate: float, capacity: float, clock: Clock = time.monotonic, sleep: Sleep = asyncio.sleep):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Espera por um token; devolve o tempo de espera em segundos."""
+        if self.rate <= 0:
+            return 0.0
+        start = self.clock()
+        # O lock mantém a ordem de chegada entre quem está à espera
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await self.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+        return self.clock() - start
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0, clock: Clock = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = self.clock()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """A chamada de teste terminou sem veredicto (ex.: erro definitivo do pedido)."""
+        self._trial_in_flight = False
+
+
+class LLMClient:
+    def __init__(
+        self,
+        backend: LLMBackend,
+        max_concurrency: int = 4,
+        max_concurrency_per_user: int = 2,
+        requests_per_minute: float = 60,
+        timeout_seconds: float = 120,
+        max_retries: int = 3,
+        retry_base_seconds: float = 1.0,
+        retry_max_seconds: float = 30.0,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        clock: Clock = time.monotonic,
+        sleep: Sleep = asyncio.sleep,
+        rng: Optional[random.Random] = None,
+    ):
+        self.backend = backend
+        self.max_concurrency_per_user = max_concurrency_per_user
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.sleep = sleep
+        self.rng = rng or random
+        self._global = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        # user_id -> [semáforo, chamadas a usá-lo]; removido quando deixa de ser usado
+        self._per_user: Dict[str, list] = {}
+        self.bucket = TokenBucket(
+            requests_per_minute / 60.0, capacity=max(1.0, requests_per_minute / 60.0 * 5), clock=clock, sleep=sleep
+        )
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds, clock=clock)
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self.in_flight = 0
+        self.counters = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "circuit_rejected": 0,
+            "rate_limit_wait_seconds": 0.0,
+        }
+
+    @asynccontextmanager
+    async def _user_slot(self, user_id: Optional[str]):
+        if not user_id or self.max_concurrency_per_user <= 0:
+            yield
+            return
+        entry = self._per_user.setdefault(user_id, [asyncio.Semaphore(self.max_concurrency_per_user), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._per_user.pop(user_id, None)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": espalha as novas tentativas de pedidos que falharam juntos
+        return self.rng.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+
+    def _reject(self):
+        self.counters["circuit_rejected"] += 1
+        raise LLMUnavailable("Serviço de IA temporariamente indisponível")
+
+    async def complete(self, prompt: str, file_path: Optional[str] = None, user_id: Optional[str] = None) -> str:
+        return "".join([chunk async for chunk in self.stream(prompt, file_path, user_id)])
+
+    async def stream(
+        self, prompt: str, file_path: Optional[str] = None, user_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Resposta em pedaços à medida que chega.
+
+        O timeout é por pedaço (tempo sem receber nada). Só há novas tentativas
+        enquanto nada foi entregue; uma falha a meio da resposta é propagada,
+        para quem consome nunca receber texto repetido.
+        """
+        async with self._user_slot(user_id):
+            for attempt in range(self.max_retries + 1):
+                if not self.breaker.allow():
+                    self._reject()
+                delivered = False
+                async with self._global:
+                    self.counters["rate_limit_wait_seconds"] += await self.bucket.acquire()
+                    self.counters["calls"] += 1
+                    self.in_flight += 1
+                    start = time.perf_counter()
+                    chunks = self.backend.stream(prompt, file_path).__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout_seconds)
+                            except StopAsyncIteration:
+                                break
+                            delivered = True
+                            yield chunk
+                    except Exception as e:
+                        error = e
+                    else:
+                        self.breaker.record_success()
+                        self.counters["succeeded"] += 1
+                        return
+                    finally:
+                        self.in_flight -= 1
+                        self._latencies.append(time.perf_counter() - start)
+                        if hasattr(chunks, "aclose"):
+                            await chunks.aclose()
+
+                if isinstance(error, asyncio.TimeoutError):
+                    self.counters["timeouts"] += 1
+                if not is_transient(error):
+                    self.breaker.release_trial()
+                    self.counters["failed"] += 1
+                    raise LLMError(str(error)) from error
+                self.breaker.record_failure()
+                if delivered or attempt == self.max_retries:
+                    self.counters["failed"] += 1
+                    raise LLMError(f"{type(error).__name__}: {error}") from error
+                self.counters["retries"] += 1
+                await self.sleep(self._backoff(attempt))
+
+    def stats(self) -> Dict:
+        latencies: List[float] = sorted(self._latencies)
+
+        def pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        return {
+            "backend": self.backend.name,
+            "circuit": self.breaker.state,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "users_waiting_or_active": len(self._per_user),
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.counters.items()},
+            "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+        }
@@ -0,0 +1,299 @@
+"""Leitura incremental e recuperação da resposta JSON do LLM.
+
+``TransactionStreamParser`` recebe a resposta aos pedaços e devolve cada
+elemento de ``transacoes`` assim que o respetivo objeto fecha, sem esperar
+pelo fim da resposta. Cada caráter é visto uma única vez, por isso o custo
+total é linear no tamanho da resposta.
+
+Texto antes do primeiro ``{`` (ex.: a cerca ```json) é ignorado. A resposta
+completa fica em ``text`` para o parsing final (saldos, período, etc.).
+
+``salvage_extraction`` é usado quando ``json.loads`` falha: corrige os
+defeitos habituais (vírgulas finais, vírgula decimal, aspas tipográficas,
+quebras de linha dentro de strings) e, se a resposta vier truncada, recupera
+todas as transações completas e marca o resultado com ``parcial``.
+
+``parse_extraction_response`` junta as duas coisas para a resposta final e
+não depende de ``server``, por isso pode correr no pool de processos.
+``merge_continuation`` junta a uma resposta truncada a continuação pedida
+a seguir; ``skip_boundary`` aplica a mesma regra às transações publicadas
+enquanto a continuação chega.
+"""
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+
+class TransactionStreamParser:
+    def __init__(self, array_key: str = "transacoes"):
+        self.array_key = array_key
+        self._parts: List[str] = []
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key: Optional[str] = None
+        # Profundidade dentro do array de transações (None fora dele)
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._done = False
+        self._remainder: List[str] = []
+        self.emitted = 0
+        self.skipped = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def array_closed(self) -> bool:
+        return self._done
+
+    @property
+    def remainder(self) -> str:
+        """Texto depois do fecho do array (restantes campos do objeto)."""
+        return "".join(self._remainder)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Acrescenta ``chunk`` e devolve as transações completadas por ele."""
+        self._parts.append(chunk)
+        if self._done:
+            self._remainder.append(chunk)
+            return []
+        self._buffer += chunk
+        items: List[Dict[str, Any]] = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = buffer[self._string_start + 1:i]
+            elif not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if self._array_depth is not None and self._depth == self._array_depth and ch == "{":
+                    self._item_start = i
+                if self._array_depth is None and ch == "[" and self._depth == 1 and self._last_key == self.array_key:
+                    self._array_depth = 2
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if ch == "}" and self._depth == self._array_depth and self._item_start is not None:
+                        item = self._decode(buffer[self._item_start:i + 1])
+                        if item is not None:
+                            items.append(item)
+                        self._item_start = None
+                    elif ch == "]" and self._depth == self._array_depth - 1:
+                        self._array_depth = None
+                        self._done = True
+                        self._remainder.append(buffer[i + 1:])
+                        break
+            i += 1
+
+        # Só é preciso guardar a partir do objeto em curso (ou de uma chave a meio)
+        keep_from = i
+        if self._item_start is not None:
+            keep_from = self._item_start
+        elif self._in_string:
+            keep_from = self._string_start
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._item_start is not None:
+            self._item_start -= keep_from
+        if self._in_string:
+            self._string_start -= keep_from
+        return items
+
+    def _decode(self, raw: str) -> Optional[Dict[str, Any]]:
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError:
+            # Fica para o parsing final da resposta completa
+            self.skipped += 1
+            return None
+        if not isinstance(item, dict):
+            self.skipped += 1
+            return None
+        self.emitted += 1
+        return item
+
+
+# Aspas tipográficas usadas como delimitadores de strings
+SMART_DOUBLE_QUOTES = "\u201c\u201d\u201e\u201f"
+# Número com vírgula decimal logo a seguir a ":" (ex.: "valor": 1.234,56)
+DECIMAL_COMMA = re.compile(r"(\s*)(-?(?:\d{1,3}(?:\.\d{3})+|\d+),\d{1,2})(?=\s*[,}\]])")
+
+
+def repair_json(text: str) -> str:
+    """Corrige defeitos comuns de JSON gerado por LLM, sem tocar no conteúdo das strings."""
+    out: List[str] = []
+    in_string = smart = escape = False
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == "\\":
+                escape = True
+                out.append(ch)
+            elif (ch == '"' and not smart) or (smart and ch in SMART_DOUBLE_QUOTES):
+                in_string = False
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+        elif ch == '"' or ch in SMART_DOUBLE_QUOTES:
+            in_string = True
+            smart = ch != '"'
+            out.append('"')
+        elif ch == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            # Vírgula final antes de } ou ] é descartada
+            if j >= n or text[j] not in "}]":
+                out.append(ch)
+        elif ch == ":":
+            out.append(ch)
+            match = DECIMAL_COMMA.match(text, i + 1)
+            if match:
+                number = match.group(2).replace(".", "").replace(",", ".")
+                out.append(match.group(1) + number)
+                i = match.end()
+                continue
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def salvage_extraction(response: str, array_key: str = "transacoes") -> Optional[Dict[str, Any]]:
+    """Recupera o que for possível de uma resposta inválida ou truncada.
+
+    Devolve None se não houver nada aproveitável. Se faltarem transações (array
+    por fechar ou objetos ilegíveis) o resultado tem ``parcial: True``.
+    """
+    start = response.find("{")
+    if start == -1:
+        return None
+    repaired = repair_json(response[start:])
+
+    end = repaired.rfind("}")
+    data = _loads_object(repaired[:end + 1]) if end != -1 else None
+    if data is not None:
+        return data
+
+    parser = TransactionStreamParser(array_key)
+    items = parser.feed(repaired)
+
+    # Campos antes do array (banco, período, saldo inicial...)
+    key_at = repaired.find(f'"{array_key}"')
+    header = _loads_object(repaired[:key_at].rstrip().rstrip(",") + "}") if key_at != -1 else None
+    # Campos depois do array (ex.: saldo final), se a resposta lá chegou
+    trailer = None
+    if parser.array_closed:
+        tail = parser.remainder.strip().lstrip(",").strip()
+        tail_end = tail.rfind("}")
+        if tail and tail_end != -1:
+            trailer = _loads_object("{" + tail[:tail_end + 1])
+
+    if not items and header is None:
+        return None
+    data = {**(header or {}), **(trailer or {}), array_key: items}
+    if not parser.array_closed or parser.skipped:
+        data["parcial"] = True
+    return data
+
+
+def merge_continuation(data: Dict, continuation: Dict) -> Dict:
+    """Acrescenta as transações da continuação; a primeira pode repetir a última já recebida."""
+    rows = continuation.get("transacoes", [])
+    if rows and data["transacoes"] and rows[0] == data["transacoes"][-1]:
+        rows = rows[1:]
+    merged = {**data, "transacoes": data["transacoes"] + rows}
+    if continuation.get("saldo_final") is not None:
+        merged["saldo_final"] = continuation["saldo_final"]
+    if continuation.get("parcial") or continuation.get("erro"):
+        merged["parcial"] = True
+    else:
+        merged.pop("parcial", None)
+    return merged
+
+
+def skip_boundary(on_transaction: Callable[[Dict], None], boundary: Dict) -> Callable[[Dict], None]:
+    """Como ``on_transaction``, mas ignora a primeira transação se repetir ``boundary``."""
+    first = True
+
+    def callback(transaction: Dict):
+        nonlocal first
+        if first:
+            first = False
+            if transaction == boundary:
+                return
+        on_transaction(transaction)
+
+    return callback
+
+
+def parse_extraction_response(response: str, bank_name: str) -> Dict:
+    response_text = response.strip()
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+
+    start_idx = response_text.find("{")
+    end_idx = response_text.rfind("}")
+    if start_idx != -1 and end_idx != -1:
+        response_text = response_text[start_idx : end_idx + 1]
+
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError as je:
+        salvaged = salvage_extraction(response)
+        if salvaged is not None:
+            logging.warning(
+                f"Resposta do LLM reparada ({len(salvaged.get('transacoes', []))} transações, "
+                f"parcial={salvaged.get('parcial', False)}): {str(je)}"
+            )
+            return salvaged
+        logging.error(f"JSON parse error: {str(je)}")
+        logging.error(f"Response text: {response_text[:500]}")
+        return {
+            "banco": bank_name,
+            "periodo": "Não identificado",
+            "saldo_inicial": 0.0,
+            "saldo_final": 0.0,
+            "transacoes": [],
+            "erro": "Erro ao processar resposta da IA. Por favor, tente novamente.",
+        }
@@ -0,0 +1,310 @@
+"""Métricas no formato de texto do Prometheus (``GET /metrics``).
+
+Registo mínimo, sem dependências: contadores, gauges e histogramas com
+labels, mais "coletores" chamados no momento do scrape para expor as
+estatísticas que já existem noutros módulos (``user_cache``,
+``llm_client``, ...), sem duplicar contadores.
+
+As métricas são atualizadas tanto no event loop como nas threads do
+pymongo (``MongoCommandMetrics``), por isso cada uma tem o seu lock.
+Cada métrica aceita no máximo ``max_series`` combinações de labels; as
+seguintes são agregadas em ``"outro"`` para um label vindo do cliente (ex.:
+``bank_name``) não fazer crescer o registo sem limite.
+"""
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Segundos: de 5 ms (queries) a 2 min (extrações longas no LLM)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+OVERFLOW_LABEL = "outro"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+        return f"{name}{{{pairs}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), max_series: int = 200):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str], known) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: labels esperados {self.labelnames}, recebidos {tuple(labels)}")
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        if key not in known and len(known) >= self.max_series:
+            return (OVERFLOW_LABEL,) * len(key)
+        return key
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        with self._lock:
+            key = self._key(labels, self._values)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            return [_sample(self.name, self._labels(k), v) for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels, self._values)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        with self._lock:
+            key = self._key(labels, self._values)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            return [_sample(self.name, self._labels(k), v) for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Por série: contagens por bucket (não cumulativas), soma e total
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels, self._series)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    lines.append(_sample(f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+                lines.append(_sample(f"{self.name}_sum", labels, total[0]))
+                lines.append(_sample(f"{self.name}_count", labels, cumulative))
+        return lines
+
+
+# Devolve um dicionário de estatísticas (ex.: ``user_cache.stats``)
+StatsCollector = Callable[[], Dict]
+
+
+def _flatten_stats(prefix: str, stats: Dict) -> List[Tuple[str, Dict[str, str], float]]:
+    """``{"hits": 3, "latency_ms": {"p50": 1.2}, "circuit": "closed"}`` ->
+    ``prefix_hits 3``, ``prefix_latency_ms_p50 1.2``, ``prefix_circuit{value="closed"} 1``."""
+    samples = []
+    for key, value in stats.items():
+        name = _INVALID_NAME_CHARS.sub("_", f"{prefix}_{key}")
+        if isinstance(value, dict):
+            samples.extend(_flatten_stats(name, value))
+        elif isinstance(value, bool):
+            samples.append((name, {}, float(value)))
+        elif isinstance(value, (int, float)):
+            samples.append((name, {}, float(value)))
+        elif isinstance(value, str):
+            samples.append((name, {"value": value}, 1.0))
+    return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Tuple[str, StatsCollector]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, **kwargs))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, **kwargs))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def register_stats(self, prefix: str, collector: StatsCollector):
+        """Expõe ``collector()`` como gauges ``<prefix>_<chave>`` em cada scrape."""
+        self._collectors.append((prefix, collector))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        for prefix, collector in self._collectors:
+            seen = set()
+            for name, labels, value in _flatten_stats(prefix, collector()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(_sample(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Duração de cada comando do MongoDB, por comando e coleção.
+
+    Registado no cliente (``event_listeners=[...]``); o pymongo chama-o nas
+    suas threads, por isso o estado partilhado é protegido por um lock.
+    """
+
+    def __init__(self, duration: Histogram, failures: Counter):
+        self.duration = duration
+        self.failures = failures
+        self._pending: Dict[Tuple, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def _pop(self, event) -> Tuple[str, str]:
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), (event.command_name, ""))
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command_name, collection)
+
+    def succeeded(self, event):
+        command, collection = self._pop(event)
+        self.duration.observe(event.duration_micros / 1e6, command=command, collection=collection)
+
+    def failed(self, event):
+        command, collection = self._pop(event)
+        self.duration.observe(event.duration_micros / 1e6, command=command, collection=collection)
+        self.failures.inc(command=command, collection=collection)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: duração e contagem por endpoint e pedidos em curso.
+
+    O endpoint é o template da rota (``/api/conversions/{conversion_id}``),
+    não o caminho, para o número de séries não depender dos ids. A duração
+    vai até ao último byte da resposta (em SSE, até o cliente sair).
+    """
+
+    def __init__(self, app, requests: Counter, duration: Histogram, in_flight: Gauge,
+                 skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.requests = requests
+        self.duration = duration
+        self.in_flight = in_flight
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "desconhecido"
+            method = scope["method"]
+            self.duration.observe(time.perf_counter() - start, method=method, endpoint=endpoint)
+            self.requests.inc(method=method, endpoint=endpoint, status=str(status["code"]))
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Estimativa grosseira (~4 caracteres por token): o backend do LLM não devolve o uso real."""
+    return (len(text) + 3) // 4 if text else 0
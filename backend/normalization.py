@@ -0,0 +1,334 @@
+"""Normalização vetorizada das transações e reconciliação dos saldos.
+
+O LLM devolve ``data`` como texto (DD/MM/YYYY, por vezes YYYY-MM-DD),
+``valor`` como número ou como texto em formato português ("1.234,56",
+"25,30-") ou inglês ("1,234.56") e ``tipo`` como "débito"/"crédito".
+``normalize_transactions`` converte o extrato inteiro de uma vez para
+colunas NumPy: datas (``datetime64[D]``), valores com sinal em cêntimos
+(``int64``) e o indicador de crédito. Fora a leitura e a escrita dos
+dicionários e os valores que chegam em texto, não há ciclos Python por
+linha: um extrato de 100 mil linhas leva milissegundos.
+
+``reconcile`` faz a soma acumulada dos cêntimos a partir do
+``saldo_inicial`` e compara-a com o ``saldo_final``. Se as transações
+trouxerem ``saldo`` (saldo após o movimento) cada linha é verificada e são
+indicadas as linhas onde aparece cada diferença; se não, e o total não
+bater certo, são indicadas as linhas cujo valor explica a diferença (sinal
+trocado ou linha repetida).
+
+O NumPy só é importado na primeira normalização, para não pesar no arranque.
+"""
+import importlib.util
+import math
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Diferença aceite entre o saldo calculado e o declarado (arredondamentos do LLM)
+TOLERANCE_CENTS = 1
+# Máximo de linhas indicadas no resultado, para o documento não crescer sem limite
+MAX_REPORTED_ROWS = 50
+# Datas com 10 caracteres: DD/MM/YYYY (ou com "-" e ".") e YYYY-MM-DD
+_DATE_WIDTH = 10
+_DATE_SEPARATORS = (ord("/"), ord("-"), ord("."))
+# Dígitos com "." ou "," pelo meio; qual é o decimal decide ``parse_amount_text``
+_AMOUNT = re.compile(r"\d+(?:[.,]\d+)*")
+_GROUPED = {sep: re.compile(rf"\d{{1,3}}(?:\{sep}\d{{3}})+") for sep in ",."}
+
+
+class StatementColumns:
+    """Colunas de um extrato; todas com uma posição por transação, pela ordem original."""
+
+    def __init__(self, dates, cents, is_credit, balances, invalid_date, invalid_amount, canonical):
+        self.dates = dates                    # datetime64[D], NaT se inválida
+        self.cents = cents                    # int64, créditos positivos e débitos negativos
+        self.is_credit = is_credit            # bool
+        self.balances = balances              # int64 (saldo após o movimento) ou None
+        self.invalid_date = invalid_date      # bool
+        self.invalid_amount = invalid_amount  # bool
+        self.canonical = canonical            # bool: a linha já está no formato canónico
+
+    def __len__(self) -> int:
+        return len(self.cents)
+
+    def totals(self) -> Dict[str, float]:
+        credits = int(self.cents[self.is_credit].sum())
+        debits = int(-self.cents[~self.is_credit].sum())
+        return {"total_debits": debits / 100, "total_credits": credits / 100}
+
+
+def _texts(values: Sequence, width: Optional[int] = None) -> "np.ndarray":
+    """Array de texto; com ``width`` o texto é cortado (mais rápido e basta para validar)."""
+    import numpy as np
+
+    if width is not None:
+        # None passa a "None", que nunca é um valor válido
+        return np.array(values, dtype=f"<U{width}") if len(values) else np.zeros(0, dtype=f"<U{width}")
+    return np.array(["" if v is None else str(v) for v in values], dtype=str)
+
+
+def _first_char(texts: "np.ndarray") -> "np.ndarray":
+    """Código do primeiro caráter (ignorando espaços), em minúscula se for ASCII."""
+    import numpy as np
+
+    first = np.strings.lstrip(texts).astype("<U1").view(np.uint32)
+    return np.where((first >= ord("A")) & (first <= ord("Z")), first + 32, first)
+
+
+def parse_amount_text(value) -> float:
+    """Valor em texto PT ("1.234,56", "25,30-") ou EN ("1,234.56") -> float; NaN se ilegível ou ambíguo.
+
+    Com ``,`` e ``.`` o último é o separador decimal e o outro tem de agrupar
+    milhares. Com um só separador seguido de exatamente 3 dígitos ("1.234",
+    "1,234") não há forma de saber se são milhares ou decimais: o valor é
+    recusado em vez de adivinhado.
+    """
+    if value is None or isinstance(value, bool):
+        return math.nan
+    text = str(value).strip()
+    for noise in ("€", "EUR", " ", "\u00a0"):
+        text = text.replace(noise, "")
+    negative = text.startswith("-") or text.endswith("-")
+    text = text.strip("+-")
+    if not _AMOUNT.fullmatch(text):
+        return math.nan
+    last = max(text.rfind(","), text.rfind("."))
+    if last < 0:
+        return -float(text) if negative else float(text)
+    mark = text[last]
+    other = "." if mark == "," else ","
+    integer, fraction = text[:last], text[last + 1:]
+    if other in integer:
+        # Os dois separadores: o último é o decimal e o outro agrupa milhares
+        if mark in integer or not _GROUPED[other].fullmatch(integer):
+            return math.nan
+        number = float(f"{integer.replace(other, '')}.{fraction}")
+    elif mark in integer:
+        # O mesmo separador várias vezes só pode agrupar milhares ("1.234.567")
+        if not _GROUPED[mark].fullmatch(text):
+            return math.nan
+        number = float(text.replace(mark, ""))
+    elif len(fraction) == 3 and integer.lstrip("0"):
+        # "1.234" / "1,234": milhares (PT/EN) ou três casas decimais
+        return math.nan
+    else:
+        number = float(f"{integer}.{fraction}")
+    return -number if negative else number
+
+
+def parse_amounts(values: Sequence) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """Valores (números ou texto PT/EN) -> ``(cêntimos int64, válido, já era número)``; inválidos ficam a 0.
+
+    Os números (o caso normal) são convertidos de uma vez; só os valores em
+    texto passam por ``parse_amount_text``.
+    """
+    import numpy as np
+
+    # Só números (o caso normal): conversão direta; só o texto passa pelo parsing
+    numbers = np.array(values) if len(values) else np.zeros(0)
+    if numbers.dtype.kind in "iuf":
+        numbers = numbers.astype(np.float64)
+    else:
+        numbers = np.fromiter(
+            (v if type(v) in (int, float) else np.nan for v in values), dtype=np.float64, count=len(values)
+        )
+    valid = np.isfinite(numbers)
+    numeric = valid.copy()
+    pending = np.flatnonzero(~valid)
+    if len(pending):
+        # Texto: o separador decimal é decidido valor a valor (ver ``parse_amount_text``)
+        parsed = np.fromiter(
+            (parse_amount_text(values[i]) for i in pending), dtype=np.float64, count=len(pending)
+        )
+        numbers[pending] = parsed
+        valid[pending] = np.isfinite(parsed)
+    numbers[~valid] = 0.0
+    return np.rint(numbers * 100).astype(np.int64), valid, numeric
+
+
+def parse_dates(values: Sequence) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """Datas DD/MM/YYYY (também com "-" ou ".") ou YYYY-MM-DD -> ``(datetime64[D], válida, já em DD/MM/YYYY)``.
+
+    Os caracteres são lidos como inteiros (vista ``uint32`` do texto UCS-4),
+    sem ``strptime`` por linha.
+    """
+    import numpy as np
+
+    # Largura 12: datas mais compridas ficam com mais de 10 caracteres e são recusadas
+    s = _texts(values, _DATE_WIDTH + 2)
+    exact = np.strings.str_len(s) == _DATE_WIDTH
+    if not exact.all():
+        s = np.strings.strip(s)
+    lengths = np.strings.str_len(s)
+    codes = s.astype(f"<U{_DATE_WIDTH}").view(np.uint32).reshape(len(s), _DATE_WIDTH).astype(np.int32)
+    digit = (codes >= ord("0")) & (codes <= ord("9"))
+    sep = np.zeros(codes.shape, dtype=bool)
+    for separator in _DATE_SEPARATORS:
+        sep |= codes == separator
+    values_ = codes - ord("0")
+
+    def number(*cols):
+        out = np.zeros(len(s), dtype=np.int32)
+        for col in cols:
+            out = out * 10 + values_[:, col]
+        return out
+
+    full = lengths == _DATE_WIDTH
+    dmy = full & digit[:, [0, 1, 3, 4, 6, 7, 8, 9]].all(axis=1) & sep[:, 2] & sep[:, 5]
+    iso = full & ~dmy & digit[:, [0, 1, 2, 3, 5, 6, 8, 9]].all(axis=1) & sep[:, 4] & sep[:, 7]
+    day = np.where(dmy, number(0, 1), number(8, 9))
+    month = np.where(dmy, number(3, 4), number(5, 6))
+    year = np.where(dmy, number(6, 7, 8, 9), number(0, 1, 2, 3))
+
+    ok = (dmy | iso) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (year >= 1900) & (year <= 2100)
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + np.where(ok, day - 1, 0)
+    # 31/04 passa para maio: o mês deixa de bater certo
+    ok &= dates.astype("datetime64[M]") == months
+    dates[~ok] = np.datetime64("NaT")
+    # Canónica: DD/MM/YYYY sem espaços à volta
+    return dates, ok, ok & dmy & exact & (codes[:, 2] == ord("/")) & (codes[:, 5] == ord("/"))
+
+
+def normalize_transactions(transactions: List[Dict]) -> StatementColumns:
+    """Converte as transações do extrato (como vêm do LLM) para colunas tipadas."""
+    import numpy as np
+
+    dates, valid_date, canonical_date = parse_dates([t.get("data") for t in transactions])
+    cents, valid_amount, numeric = parse_amounts([t.get("valor") for t in transactions])
+
+    tipo_texts = _texts([t.get("tipo") for t in transactions], 8)
+    tipo = _first_char(tipo_texts)
+    credit = tipo == ord("c")
+    debit = tipo == ord("d")
+    # Sem tipo reconhecível vale o sinal do valor (negativo = débito)
+    is_credit = credit | (~debit & (cents > 0))
+    magnitude = np.abs(cents)
+    signed = np.where(is_credit, magnitude, -magnitude)
+
+    balances = None
+    raw_balances = [t.get("saldo") for t in transactions]
+    if raw_balances.count(None) != len(raw_balances):
+        balance_cents, valid_balance, _ = parse_amounts(raw_balances)
+        balances = np.where(valid_balance, balance_cents, np.iinfo(np.int64).min)
+
+    # Só as linhas fora do formato canónico são reescritas (ver ``apply_normalization``)
+    canonical_tipo = tipo_texts == np.where(is_credit, "crédito", "débito")
+    canonical = (canonical_date | ~valid_date) & ((numeric & (cents >= 0) & canonical_tipo) | ~valid_amount)
+    return StatementColumns(dates, signed, is_credit, balances, ~valid_date, ~valid_amount, canonical)
+
+
+def _to_cents(value) -> Optional[int]:
+    if value is None or isinstance(value, bool):
+        return None
+    cents, valid, _ = parse_amounts([value])
+    return int(cents[0]) if valid[0] else None
+
+
+def _rows(indices) -> List[int]:
+    return [int(i) for i in indices[:MAX_REPORTED_ROWS]]
+
+
+def reconcile(columns: StatementColumns, saldo_inicial, saldo_final) -> Dict:
+    """Compara o saldo acumulado com os saldos declarados.
+
+    Devolve ``ok``, o saldo calculado, a diferença e, se houver, as linhas
+    (índices em ``transacoes``) onde o saldo diverge ou que explicam a
+    diferença, mais as linhas com data ou valor ilegíveis.
+    """
+    import numpy as np
+
+    start = _to_cents(saldo_inicial)
+    end = _to_cents(saldo_final)
+    result: Dict = {
+        "ok": True,
+        "linhas_invalidas": _rows(np.flatnonzero(columns.invalid_date | columns.invalid_amount)),
+    }
+    if start is None:
+        result["verificado"] = False
+        return result
+
+    running = start + np.cumsum(columns.cents)
+    # Sem transações o saldo final tem de ser igual ao inicial
+    computed = int(running[-1]) if len(running) else start
+    result.update({"verificado": end is not None, "saldo_calculado": computed / 100})
+    divergent = np.zeros(0, dtype=np.int64)
+
+    if columns.balances is not None:
+        known = columns.balances != np.iinfo(np.int64).min
+        error = np.where(known, running - columns.balances, 0)
+        # Cada erro arrasta-se às linhas seguintes: só interessa onde a diferença muda
+        previous = np.concatenate(([0], error[known][:-1]))
+        changed = np.zeros(len(error), dtype=bool)
+        changed[known] = np.abs(error[known] - previous) > TOLERANCE_CENTS
+        divergent = np.flatnonzero(changed)
+        result["verificado"] = True
+        result["ok"] = not divergent.size
+
+    if end is not None:
+        diff = computed - end
+        result["diferenca"] = diff / 100
+        if abs(diff) > TOLERANCE_CENTS:
+            result["ok"] = False
+            if not divergent.size:
+                # Sinal trocado conta a dobrar; linha repetida (ou a mais) conta uma vez
+                flipped = 2 * columns.cents == diff
+                extra = columns.cents == diff
+                divergent = np.flatnonzero(flipped | extra)
+
+    if divergent.size:
+        result["linhas_divergentes"] = _rows(divergent)
+    return result
+
+
+def apply_normalization(transactions: List[Dict], columns: StatementColumns) -> List[Dict]:
+    """Transações com ``data``/``valor``/``tipo`` no formato canónico; as ilegíveis ficam como estão.
+
+    As linhas já canónicas (o caso normal) são devolvidas sem cópia.
+    """
+    import numpy as np
+
+    rewrite = np.flatnonzero(~columns.canonical)
+    if not rewrite.size:
+        return list(transactions)
+    formatted = np.datetime_as_string(columns.dates[rewrite], unit="D")
+    # YYYY-MM-DD -> DD/MM/YYYY
+    formatted = np.strings.add(
+        np.strings.add(np.strings.add(np.strings.slice(formatted, 8, 10), "/"), np.strings.slice(formatted, 5, 7)),
+        np.strings.add("/", np.strings.slice(formatted, 0, 4)),
+    )
+    amounts = (np.abs(columns.cents[rewrite]) / 100).tolist()
+    credit = columns.is_credit[rewrite].tolist()
+    bad_date = columns.invalid_date[rewrite].tolist()
+    bad_amount = columns.invalid_amount[rewrite].tolist()
+
+    normalized = list(transactions)
+    for i, data, valor, is_credit, no_date, no_amount in zip(
+        rewrite.tolist(), formatted.tolist(), amounts, credit, bad_date, bad_amount
+    ):
+        row = dict(normalized[i])
+        if not no_date:
+            row["data"] = data
+        if not no_amount:
+            row["valor"] = valor
+            row["tipo"] = "crédito" if is_credit else "débito"
+        normalized[i] = row
+    return normalized
+
+
+def normalize_transaction(transaction: Dict) -> Dict:
+    """Uma transação no formato canónico (ex.: para a mostrar enquanto o extrato ainda chega)."""
+    return apply_normalization([transaction], normalize_transactions([transaction]))[0]
+
+
+def normalize_statement(extracted_data: Dict) -> Tuple[Dict, Dict[str, float], Dict]:
+    """Normaliza e reconcilia um extrato: ``(extrato normalizado, totais, reconciliação)``.
+
+    Síncrona (NumPy); chamar fora do event loop.
+    """
+    transactions = extracted_data.get("transacoes") or []
+    columns = normalize_transactions(transactions)
+    reconciliation = reconcile(columns, extracted_data.get("saldo_inicial"), extracted_data.get("saldo_final"))
+    normalized = {**extracted_data, "transacoes": apply_normalization(transactions, columns)}
+    return normalized, columns.totals(), reconciliation
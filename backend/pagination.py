@@ -0,0 +1,37 @@
+"""Paginação por cursor (keyset) sobre (created_at, id), ambos descendentes."""
+import base64
+import binascii
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    raw = json.dumps([doc["created_at"], doc["id"]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(created_at, str) or not isinstance(doc_id, str):
+            raise ValueError("invalid cursor")
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return {"created_at": created_at, "id": doc_id}
+
+
+def keyset_filter(base: Dict[str, Any], cursor: Optional[str]) -> Dict[str, Any]:
+    """Filtro para os documentos estritamente a seguir ao cursor."""
+    if not cursor:
+        return base
+    after = decode_cursor(cursor)
+    return {
+        **base,
+        "$or": [
+            {"created_at": {"$lt": after["created_at"]}},
+            {"created_at": after["created_at"], "id": {"$lt": after["id"]}},
+        ],
+    }
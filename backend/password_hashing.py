@@ -0,0 +1,121 @@
+"""Hash de passwords (bcrypt) fora do event loop.
+
+Cada chamada ao bcrypt demora 100-300 ms; feita diretamente num handler
+async bloqueia todos os pedidos do worker. Aqui as chamadas correm num
+``ThreadPoolExecutor`` dedicado e limitado (o bcrypt liberta o GIL), e o
+número de pedidos em espera também é limitado: acima de ``max_pending`` a
+resposta é 429 em vez de acumular logins que já não chegariam a tempo.
+
+O custo (``rounds``) é configurável. Hashes com outro custo continuam a ser
+aceites e são refeitos de forma transparente no login seguinte
+(``verify_and_update``).
+
+O passlib/bcrypt só é carregado no primeiro hash, para não pesar no arranque.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_pending: int = 32):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self._context = None
+        self._context_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.max_workers = max_workers
+        # Só é alterado no event loop, por isso não precisa de lock
+        self._pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def _get_context(self):
+        # Chamado nas threads do pool; o lock evita criar dois contextos
+        with self._context_lock:
+            if self._context is None:
+                from passlib.context import CryptContext
+
+                self._context = CryptContext(
+                    schemes=["bcrypt"],
+                    deprecated="auto",
+                    bcrypt__default_rounds=self.rounds,
+                    bcrypt__min_rounds=self.rounds,
+                    bcrypt__max_rounds=self.rounds,
+                )
+            return self._context
+
+    def _hash(self, password: str) -> str:
+        return self._get_context().hash(password)
+
+    def _verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        return self._get_context().verify_and_update(password, password_hash)
+
+    def _record(self, op: str, wait_ms: float, run_ms: float):
+        t = self._timings.setdefault(op, {"count": 0, "wait_ms_total": 0.0, "run_ms_total": 0.0, "run_ms_max": 0.0})
+        t["count"] += 1
+        t["wait_ms_total"] += wait_ms
+        t["run_ms_total"] += run_ms
+        t["run_ms_max"] = max(t["run_ms_max"], run_ms)
+
+    async def _run(self, op: str, fn, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiados pedidos de autenticação. Tente novamente dentro de instantes.",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        submitted = time.perf_counter()
+        started = submitted
+
+        def timed():
+            nonlocal started
+            started = time.perf_counter()
+            return fn(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+            finished = time.perf_counter()
+            self._record(op, (started - submitted) * 1000, (finished - started) * 1000)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self._hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """Devolve ``(válida, novo_hash)``; ``novo_hash`` só vem preenchido se o custo mudou."""
+        valid, new_hash = await self._run("verify", self._verify_and_update, password, password_hash)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        timings = {
+            op: {
+                "count": int(t["count"]),
+                "avg_wait_ms": round(t["wait_ms_total"] / t["count"], 2),
+                "avg_run_ms": round(t["run_ms_total"] / t["count"], 2),
+                "max_run_ms": round(t["run_ms_max"], 2),
+            }
+            for op, t in self._timings.items()
+        }
+        return {
+            "rounds": self.rounds,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "timings": timings,
+        }
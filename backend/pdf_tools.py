@@ -0,0 +1,252 @@
+"""Utilitários de PDF usados no pipeline de extração.
+
+O pypdf só é importado quando é preciso (dividir PDFs ou contar páginas de
+PDFs atípicos), para não pesar no arranque.
+"""
+import importlib.util
+import mmap
+import re
+import uuid
+import zlib
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+HAS_PYPDF = importlib.util.find_spec("pypdf") is not None
+
+
+def plan_page_ranges(page_count: int, pages_per_shard: int) -> List[Tuple[int, int]]:
+    """Divide ``page_count`` páginas em intervalos [início, fim) de ``pages_per_shard``."""
+    pages_per_shard = max(1, pages_per_shard)
+    return [(start, min(start + pages_per_shard, page_count)) for start in range(0, page_count, pages_per_shard)]
+
+
+def split_pdf(file_path: str, page_ranges: List[Tuple[int, int]], out_dir: Path) -> List[str]:
+    """Escreve um PDF por intervalo de páginas e devolve os caminhos (pela mesma ordem)."""
+    from pypdf import PdfReader, PdfWriter  # type: ignore
+
+    reader = PdfReader(file_path)
+    paths = []
+    for start, end in page_ranges:
+        writer = PdfWriter()
+        for index in range(start, end):
+            writer.add_page(reader.pages[index])
+        shard_path = out_dir / f"shard-{uuid.uuid4()}.pdf"
+        with open(shard_path, "wb") as f:
+            writer.write(f)
+        paths.append(str(shard_path))
+    return paths
+
+
+def read_page_count(file_path: str) -> int:
+    from pypdf import PdfReader  # type: ignore
+
+    return len(PdfReader(file_path).pages)
+
+
+# --- Contagem rápida de páginas -------------------------------------------
+# Lê só o trailer/xref, o catálogo e a raiz da árvore de páginas (/Count),
+# sobre um mmap do ficheiro: não descodifica conteúdo nem rasteriza nada.
+# O /Count só é aceite se couber no xref (cada página é um objeto próprio);
+# caso contrário devolve None e a contagem fica a cargo do pypdf.
+
+_STARTXREF_RE = re.compile(rb"startxref\s+(\d+)")
+_OBJ_HEADER_RE = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj\b")
+_XREF_SUBSECTION_RE = re.compile(rb"(\d+)\s+(\d+)\s*[\r\n]+")
+_REF_RE = r"/%s\s+(\d+)\s+\d+\s+R"
+_OBJ_WINDOW = 64 * 1024
+# Limite ao stream descodificado (xref/objetos), contra "zip bombs"
+_MAX_DECODED = 16 * 1024 * 1024
+
+
+class _PdfIndex:
+    def __init__(self, data):
+        self.data = data
+        self.offsets = {}          # obj -> offset no ficheiro
+        self.in_streams = {}       # obj -> (obj stream, índice)
+        self.trailer = b""
+
+    def _set(self, obj_num: int, value, compressed: bool = False):
+        # As secções mais recentes (lidas primeiro) têm prioridade
+        if obj_num in self.offsets or obj_num in self.in_streams:
+            return
+        if compressed:
+            self.in_streams[obj_num] = value
+        else:
+            self.offsets[obj_num] = value
+
+    def load(self):
+        tail = self.data[max(0, len(self.data) - 2048):]
+        matches = list(_STARTXREF_RE.finditer(tail))
+        if not matches:
+            raise ValueError("startxref not found")
+        offset = int(matches[-1].group(1))
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            offset = self._read_section(offset)
+
+    def _read_section(self, offset: int):
+        head = self.data[offset:offset + 4]
+        if head == b"xref":
+            trailer = self._read_xref_table(offset + 4)
+        else:
+            trailer = self._read_xref_stream(offset)
+        if not self.trailer:
+            self.trailer = trailer
+        xref_stm = re.search(rb"/XRefStm\s+(\d+)", trailer)
+        if xref_stm:
+            self._read_xref_stream(int(xref_stm.group(1)))
+        prev = re.search(rb"/Prev\s+(\d+)", trailer)
+        return int(prev.group(1)) if prev else None
+
+    def _read_xref_table(self, pos: int) -> bytes:
+        data = self.data
+        while True:
+            while data[pos:pos + 1] in (b" ", b"\r", b"\n"):
+                pos += 1
+            if data[pos:pos + 7] == b"trailer":
+                end = data.find(b"startxref", pos)
+                return bytes(data[pos:end if end != -1 else pos + 4096])
+            match = _XREF_SUBSECTION_RE.match(data, pos)
+            if not match:
+                raise ValueError("bad xref table")
+            first, count = int(match.group(1)), int(match.group(2))
+            pos = match.end()
+            if pos + 20 * count > len(data):
+                raise ValueError("truncated xref table")
+            for i in range(count):
+                entry = data[pos:pos + 20]
+                if entry[17:18] == b"n":
+                    self._set(first + i, int(entry[0:10]))
+                pos += 20
+
+    def _stream(self, offset: int):
+        """Devolve (dicionário, dados descodificados) do stream em ``offset``."""
+        data = self.data
+        start = data.find(b"<<", offset)
+        stream_kw = data.find(b"stream", start)
+        if start == -1 or stream_kw == -1:
+            raise ValueError("stream not found")
+        dictionary = bytes(data[start:stream_kw])
+        pos = stream_kw + 6
+        if data[pos:pos + 2] == b"\r\n":
+            pos += 2
+        elif data[pos:pos + 1] in (b"\r", b"\n"):
+            pos += 1
+        length = re.search(rb"/Length\s+(\d+)(\s+\d+\s+R)?", dictionary)
+        if length and not length.group(2):
+            raw = data[pos:pos + int(length.group(1))]
+        else:
+            raw = data[pos:data.find(b"endstream", pos)]
+        if b"/FlateDecode" in dictionary:
+            raw = zlib.decompressobj().decompress(bytes(raw), _MAX_DECODED)
+        elif b"/Filter" in dictionary:
+            raise ValueError("unsupported filter")
+        return dictionary, bytes(raw)
+
+    def _read_xref_stream(self, offset: int) -> bytes:
+        dictionary, raw = self._stream(offset)
+        widths = [int(w) for w in re.search(rb"/W\s*\[([\d\s]+)\]", dictionary).group(1).split()]
+        row = sum(widths)
+        predictor = re.search(rb"/Predictor\s+(\d+)", dictionary)
+        if predictor and int(predictor.group(1)) >= 10:
+            raw = _png_unpredict(raw, row)
+        size = int(re.search(rb"/Size\s+(\d+)", dictionary).group(1))
+        index = re.search(rb"/Index\s*\[([\d\s]+)\]", dictionary)
+        ranges = [int(v) for v in index.group(1).split()] if index else [0, size]
+
+        if row * sum(ranges[1::2]) > len(raw):
+            raise ValueError("truncated xref stream")
+        pos = 0
+        for first, count in zip(ranges[0::2], ranges[1::2]):
+            for i in range(count):
+                fields, f_pos = [], pos
+                for width in widths:
+                    fields.append(int.from_bytes(raw[f_pos:f_pos + width], "big") if width else None)
+                    f_pos += width
+                pos += row
+                kind = 1 if fields[0] is None else fields[0]
+                if kind == 1:
+                    self._set(first + i, fields[1])
+                elif kind == 2:
+                    self._set(first + i, (fields[1], fields[2]), compressed=True)
+        return dictionary
+
+    def object_body(self, obj_num: int) -> bytes:
+        if obj_num in self.offsets:
+            offset = self.offsets[obj_num]
+            header = _OBJ_HEADER_RE.match(self.data, offset)
+            if not header or int(header.group(1)) != obj_num:
+                raise ValueError(f"object {obj_num} not at xref offset")
+            window = self.data[header.end():header.end() + _OBJ_WINDOW]
+            end = window.find(b"endobj")
+            return bytes(window[:end if end != -1 else len(window)])
+        if obj_num in self.in_streams:
+            stream_num, _ = self.in_streams[obj_num]
+            dictionary, raw = self._stream(self.offsets[stream_num])
+            first = int(re.search(rb"/First\s+(\d+)", dictionary).group(1))
+            pairs = [int(v) for v in raw[:first].split()]
+            for i in range(0, len(pairs), 2):
+                if pairs[i] == obj_num:
+                    start = first + pairs[i + 1]
+                    end = first + pairs[i + 3] if i + 3 < len(pairs) else len(raw)
+                    return raw[start:end]
+        raise ValueError(f"object {obj_num} not found")
+
+    def object_count(self) -> int:
+        return len(self.offsets) + len(self.in_streams)
+
+    def ref(self, body: bytes, key: str) -> int:
+        match = re.search((_REF_RE % key).encode(), body)
+        if not match:
+            raise ValueError(f"/{key} reference not found")
+        return int(match.group(1))
+
+
+def _png_unpredict(raw: bytes, columns: int) -> bytes:
+    """Reverte o predictor PNG (usado quase sempre com /Predictor 12 = Up)."""
+    out = bytearray()
+    previous = bytearray(columns)
+    stride = columns + 1
+    for pos in range(0, len(raw) - columns, stride):
+        filter_type = raw[pos]
+        line = bytearray(raw[pos + 1:pos + stride])
+        if filter_type == 2:
+            line = bytearray((a + b) & 0xFF for a, b in zip(line, previous))
+        elif filter_type != 0:
+            raise ValueError("unsupported PNG predictor")
+        out += line
+        previous = line
+    return bytes(out)
+
+
+def _count_pages_in(data) -> Optional[int]:
+    """/Count da raiz da árvore de páginas, ou None se o xref não o suportar."""
+    index = _PdfIndex(data)
+    index.load()
+    catalog = index.object_body(index.ref(index.trailer, "Root"))
+    pages = index.object_body(index.ref(catalog, "Pages"))
+    count = re.search(rb"/Count\s+(\d+)(\s+\d+\s+R)?", pages)
+    if not count:
+        raise ValueError("/Count not found")
+    if count.group(2):
+        value = int(index.object_body(int(count.group(1))).split()[0])
+    else:
+        value = int(count.group(1))
+    return value if value <= index.object_count() else None
+
+
+def count_pdf_pages(file_path: str) -> Optional[int]:
+    """Número de páginas do PDF, ou None se não for possível determiná-lo assim."""
+    try:
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                count = _count_pages_in(data)
+                if count is None:
+                    return None
+            except (ValueError, AttributeError, IndexError, KeyError, zlib.error):
+                # Xref danificado: conta os objetos /Type /Page não comprimidos
+                count = len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", data))
+        return count or None
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,123 @@
+"""Profiler por amostragem, ativado pedido a pedido.
+
+Com ``PROFILING_ENABLED=true``, um pedido com o cabeçalho
+``X-Profile: <METRICS_TOKEN>`` é amostrado (o ``Authorization`` continua a
+ser o do utilizador, por isso o token vai no próprio cabeçalho; sem
+``METRICS_TOKEN`` definido o profiling fica desligado): uma thread lê a stack da thread do event loop a cada
+``interval`` segundos e, no fim do pedido, grava as stacks em formato
+"folded" (uma linha ``f1;f2;f3 N`` por stack), pronto para
+``flamegraph.pl`` ou speedscope. O nome do ficheiro vem no cabeçalho
+``X-Profile`` da resposta.
+
+O event loop é partilhado, por isso as amostras incluem o trabalho de
+outros pedidos concorrentes; para resultados limpos, usar com pouco
+tráfego. O custo fora dos pedidos amostrados é zero.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+
+def _folded_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_folded_stack(frame)] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que amostra os pedidos com ``X-Profile: <token>``.
+
+    Mantém no máximo ``keep`` perfis em ``directory`` (apaga os mais antigos).
+    """
+
+    def __init__(
+        self, app, directory: Path, enabled: bool = False, interval: float = 0.005, keep: int = 50, token: str = ""
+    ):
+        self.app = app
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.token = token.encode()
+        if enabled and not token:
+            logger.warning("PROFILING_ENABLED sem METRICS_TOKEN: profiling desligado")
+        self.enabled = enabled and bool(token)
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _authorized(self, scope) -> bool:
+        value = dict(scope["headers"]).get(PROFILE_HEADER)
+        return value is not None and hmac.compare_digest(value, self.token)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not self._authorized(scope):
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{scope['path'].strip('/').replace('/', '_')}"
+        filename = f"{name[:120]}-{os.getpid()}-{time.monotonic_ns()}.folded"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(PROFILE_HEADER, filename.encode())]
+            await send(message)
+
+        profiler = SamplingProfiler(threading.get_ident(), self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            # Escrita e limpeza do diretório fora do event loop
+            await asyncio.to_thread(self._save, filename, profiler.folded())
+            logger.info(f"Perfil gravado em {self.directory / filename} ({sum(profiler.samples.values())} amostras)")
+
+    def _save(self, filename: str, folded: str):
+        (self.directory / filename).write_text(folded)
+        self._prune()
+
+    def _prune(self):
+        profiles = sorted(self.directory.glob("*.folded"), key=lambda p: p.stat().st_mtime)
+        for path in profiles[:-self.keep]:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,103 @@
+"""Pub/sub em memória para o progresso das conversões (Server-Sent Events).
+
+Cada conversão em curso tem um canal com o histórico recente de eventos, por
+isso quem se liga a meio recebe primeiro o que já aconteceu. O canal fecha
+com ``complete`` ou ``error`` e é descartado ``retention_seconds`` depois.
+
+Os canais são locais ao processo. Quem subscreve uma conversão que está a
+ser processada noutro worker não encontra canal e deve recorrer ao estado
+guardado no MongoDB (ver ``conversion_events`` em server.py).
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set, Tuple
+
+FINAL_EVENTS = ("complete", "error")
+STALE_CHANNEL_SECONDS = 3600
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+SSE_KEEPALIVE = b": keepalive\n\n"
+
+
+class _Channel:
+    def __init__(self, history_limit: int):
+        self.history: Deque[Event] = deque(maxlen=history_limit)
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.closed_at: Optional[float] = None
+        self.updated_at = time.monotonic()
+
+
+class ProgressBroker:
+    def __init__(self, history_limit: int = 1000, retention_seconds: float = 300.0):
+        self.history_limit = history_limit
+        self.retention_seconds = retention_seconds
+        self._channels: Dict[str, _Channel] = {}
+
+    def has_channel(self, conversion_id: str) -> bool:
+        return conversion_id in self._channels
+
+    def publish(self, conversion_id: str, event: str, data: Dict[str, Any]):
+        self._expire()
+        channel = self._channels.get(conversion_id)
+        if channel is None or (event == "started" and channel.closed_at is not None):
+            channel = self._channels[conversion_id] = _Channel(self.history_limit)
+        if event == "started":
+            # Nova tentativa: o que foi enviado antes deixa de valer
+            channel.history.clear()
+        channel.history.append((event, data))
+        channel.updated_at = time.monotonic()
+        if event in FINAL_EVENTS:
+            channel.closed_at = time.monotonic()
+        for queue in channel.subscribers:
+            queue.put_nowait((event, data))
+
+    async def subscribe(self, conversion_id: str, heartbeat_seconds: float = 15.0) -> AsyncIterator[Optional[Event]]:
+        """Histórico e depois eventos novos até ao evento final; ``None`` é um keepalive."""
+        channel = self._channels.get(conversion_id)
+        if channel is None:
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        history = list(channel.history)
+        if channel.closed_at is None:
+            channel.subscribers.add(queue)
+        try:
+            for event, data in history:
+                yield event, data
+                if event in FINAL_EVENTS:
+                    return
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event, data
+                if event in FINAL_EVENTS:
+                    return
+        finally:
+            channel.subscribers.discard(queue)
+
+    def _expire(self):
+        now = time.monotonic()
+        # Canais sem evento final (ex.: worker reiniciado a meio) expiram por inatividade
+        expired = [
+            cid for cid, channel in self._channels.items()
+            if (channel.closed_at is not None and now - channel.closed_at > self.retention_seconds)
+            or now - channel.updated_at > STALE_CHANNEL_SECONDS
+        ]
+        for cid in expired:
+            del self._channels[cid]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "channels": len(self._channels),
+            "subscribers": sum(len(c.subscribers) for c in self._channels.values()),
+        }
@@ -0,0 +1,171 @@
+"""Reserva atómica de quota nas subscrições.
+
+Tudo o que antes eram até quatro operações (find, insert da subscrição
+gratuita, reset mensal, backfill de campos) mais a verificação do limite em
+Python passa a ser um único ``find_one_and_update`` com um pipeline de
+agregação. Com ``upsert`` cria a subscrição gratuita, faz o rollover do
+período e o backfill, e só incrementa os contadores se a reserva couber no
+limite do plano. Assim, uploads concorrentes já não passam o limite.
+
+As datas do período são strings ISO-8601 em UTC (``datetime.isoformat()``),
+por isso a comparação lexicográfica no pipeline equivale à cronológica.
+"""
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+PERIOD_DAYS = 30
+FREE_CONVERSIONS_LIMIT = 5
+# Campos internos que não saem de ``load_subscription``/``switch_plan`` (vão para a API)
+PUBLIC_PROJECTION = {"_id": 0, "last_reservation_id": 0}
+
+
+def _base_pipeline(now: datetime) -> List[Dict[str, Any]]:
+    now_iso = now.isoformat()
+    next_end_iso = (now + timedelta(days=PERIOD_DAYS)).isoformat()
+    is_new = {"$eq": [{"$ifNull": ["$id", None]}, None]}
+    expired = {"$gt": [now_iso, {"$ifNull": ["$current_period_end", ""]}]}
+    return [
+        # Subscrição gratuita criada pelo upsert
+        {"$set": {
+            "id": {"$cond": [is_new, str(uuid.uuid4()), "$id"]},
+            "plan_type": {"$cond": [is_new, "free", "$plan_type"]},
+            "pages_limit": {"$cond": [is_new, None, "$pages_limit"]},
+            "pages_used_this_month": {"$ifNull": ["$pages_used_this_month", 0]},
+            "current_period_start": {"$cond": [is_new, now_iso, "$current_period_start"]},
+            "current_period_end": {"$cond": [is_new, next_end_iso, "$current_period_end"]},
+        }},
+        # Reset mensal se terminou o período
+        {"$set": {
+            "pages_used_this_month": {"$cond": [expired, 0, "$pages_used_this_month"]},
+            "conversions_used_this_month": {"$cond": [expired, 0, "$conversions_used_this_month"]},
+            "current_period_start": {"$cond": [expired, now_iso, "$current_period_start"]},
+            "current_period_end": {"$cond": [expired, next_end_iso, "$current_period_end"]},
+        }},
+        # Backfill de campos novos
+        {"$set": {
+            "conversions_limit": {"$cond": [
+                {"$eq": ["$plan_type", "free"]},
+                {"$ifNull": ["$conversions_limit", FREE_CONVERSIONS_LIMIT]},
+                {"$ifNull": ["$conversions_limit", None]},
+            ]},
+            "conversions_used_this_month": {"$ifNull": ["$conversions_used_this_month", 0]},
+        }},
+    ]
+
+
+def _reservation_stage(reservation_id: str, pages: int, conversions: int = 1) -> Dict[str, Any]:
+    pages_ok = {"$or": [
+        {"$eq": [{"$ifNull": ["$pages_limit", None]}, None]},
+        {"$lte": [{"$add": ["$pages_used_this_month", pages]}, "$pages_limit"]},
+    ]}
+    conversions_ok = {"$or": [
+        {"$eq": [{"$ifNull": ["$conversions_limit", None]}, None]},
+        {"$lte": [{"$add": ["$conversions_used_this_month", conversions]}, "$conversions_limit"]},
+    ]}
+    # Plano gratuito conta conversões; planos pagos contam páginas
+    allowed = {"$cond": [{"$eq": ["$plan_type", "free"]}, conversions_ok, pages_ok]}
+    return {"$set": {
+        "pages_used_this_month": {"$cond": [
+            allowed, {"$add": ["$pages_used_this_month", pages]}, "$pages_used_this_month",
+        ]},
+        "conversions_used_this_month": {"$cond": [
+            allowed, {"$add": ["$conversions_used_this_month", conversions]}, "$conversions_used_this_month",
+        ]},
+        "last_reservation_id": {"$cond": [allowed, reservation_id, "$last_reservation_id"]},
+    }}
+
+
+async def _apply(collection, user_id: str, update, projection: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """``find_one_and_update`` com upsert na subscrição ativa (pipeline ou documento de update)."""
+    for attempt in range(2):
+        try:
+            return await collection.find_one_and_update(
+                {"user_id": user_id, "status": "active"},
+                update,
+                upsert=True,
+                projection=projection or {"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Dois upserts simultâneos para um utilizador novo: o índice único
+            # deixa passar um, e a segunda tentativa atualiza o documento criado
+            if attempt:
+                raise
+
+
+async def switch_plan(
+    collection, user_id: str, plan_type: str, pages_limit: Optional[int], conversions_limit: Optional[int] = None
+) -> Dict[str, Any]:
+    """Muda o plano da subscrição ativa no próprio documento, com novo período e contadores a zero.
+
+    Uma só escrita: nunca há um instante sem subscrição ativa em que o
+    upsert de ``load_subscription``/``reserve_quota`` criasse outra gratuita.
+    Reservas do período anterior deixam de ser libertadas (ver ``release_quota``).
+    """
+    now = datetime.now(timezone.utc)
+    update = {
+        "$set": {
+            "plan_type": plan_type,
+            "pages_limit": pages_limit,
+            "conversions_limit": conversions_limit,
+            "pages_used_this_month": 0,
+            "conversions_used_this_month": 0,
+            "current_period_start": now.isoformat(),
+            "current_period_end": (now + timedelta(days=PERIOD_DAYS)).isoformat(),
+        },
+        "$setOnInsert": {"id": str(uuid.uuid4())},
+    }
+    return await _apply(collection, user_id, update, PUBLIC_PROJECTION)
+
+
+async def load_subscription(collection, user_id: str) -> Dict[str, Any]:
+    """Subscrição ativa já com rollover/backfill aplicados, numa só ida à base de dados."""
+    return await _apply(collection, user_id, _base_pipeline(datetime.now(timezone.utc)), PUBLIC_PROJECTION)
+
+
+async def reserve_quota(
+    collection, user_id: str, pages: int, conversions: int = 1
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Reserva ``conversions`` conversões com ``pages`` páginas no total (tudo ou nada).
+
+    Devolve ``(subscrição, reserva)``; a reserva é None se o limite do plano
+    não o permitir (nesse caso nada foi incrementado).
+    """
+    reservation_id = str(uuid.uuid4())
+    pipeline = _base_pipeline(datetime.now(timezone.utc)) + [
+        _reservation_stage(reservation_id, pages, conversions)
+    ]
+    subscription = await _apply(collection, user_id, pipeline)
+    if subscription.get("last_reservation_id") != reservation_id:
+        return subscription, None
+    return subscription, {
+        "id": reservation_id,
+        "subscription_id": subscription["id"],
+        "pages": pages,
+        "conversions": conversions,
+        "period_start": subscription["current_period_start"],
+    }
+
+
+def split_reservation(reservation: Dict[str, Any], pages: List[int]) -> List[Dict[str, Any]]:
+    """Divide uma reserva de lote numa reserva por conversão, libertáveis uma a uma."""
+    return [{**reservation, "pages": p, "conversions": 1} for p in pages]
+
+
+async def release_quota(collection, reservation: Dict[str, Any]):
+    """Devolve uma reserva (ex.: a extração falhou).
+
+    Se entretanto o período mudou, os contadores já foram repostos e não há
+    nada a devolver.
+    """
+    await collection.update_one(
+        {"id": reservation["subscription_id"], "current_period_start": reservation["period_start"]},
+        {"$inc": {
+            "pages_used_this_month": -reservation["pages"],
+            "conversions_used_this_month": -reservation.get("conversions", 1),
+        }},
+    )
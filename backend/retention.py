@@ -0,0 +1,154 @@
+"""Retenção dos ficheiros das conversões (PDF original e exportações).
+
+Cada conversão recebe ``expires_at`` na criação, conforme o plano do
+utilizador nesse momento (``retention_days``). O ``RetentionSweeper`` corre
+em segundo plano e, para as conversões expiradas, apaga os ficheiros do
+storage e marca ``artifacts_purged_at``. Os metadados e as transações
+ficam no MongoDB, por isso o histórico continua visível e as exportações
+podem ser geradas de novo.
+
+Se apagar falhar (ex.: erro do S3), a conversão não é marcada: conta
+``purge_attempts`` e só volta a ser tentada depois de ``purge_retry_at``,
+com espera a dobrar a cada falha (até ``max_retry_seconds``).
+
+Conversões antigas sem ``expires_at`` recebem-no no primeiro ciclo, a
+partir de ``created_at`` e do plano atual do utilizador.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Apaga os ficheiros de uma conversão (recebe o documento da conversão)
+PurgeHandler = Callable[[Dict], Awaitable[None]]
+
+
+def expires_at(created_at: str, plan_type: str, retention_days: Dict[str, int]) -> Optional[str]:
+    """``created_at`` + dias do plano, em ISO (comparável como string); None = sem expiração."""
+    days = retention_days.get(plan_type, retention_days.get("free"))
+    if not days:
+        return None
+    return (datetime.fromisoformat(created_at) + timedelta(days=days)).isoformat()
+
+
+def purge_query(now: datetime) -> Dict:
+    """Conversões com ficheiros por apagar em ``now`` (também usada no diagnóstico de ``db_indexes``)."""
+    return {
+        "expires_at": {"$ne": None, "$lt": now.isoformat()},
+        "artifacts_purged_at": {"$exists": False},
+        # Não mexe em conversões ainda em processamento
+        "status": {"$ne": "processing"},
+        # As que falharam esperam pelo fim do backoff
+        "$or": [{"purge_retry_at": {"$exists": False}}, {"purge_retry_at": {"$lte": now.isoformat()}}],
+    }
+
+
+class RetentionSweeper:
+    def __init__(
+        self,
+        conversions,
+        subscriptions,
+        purge: PurgeHandler,
+        retention_days: Dict[str, int],
+        interval_seconds: float = 3600.0,
+        batch_size: int = 500,
+        retry_seconds: float = 300.0,
+        max_retry_seconds: float = 86400.0,
+    ):
+        self.conversions = conversions
+        self.subscriptions = subscriptions
+        self.purge = purge
+        self.retention_days = retention_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.purged = 0
+        self.errors = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Erro na limpeza de ficheiros expirados: {str(e)}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _plans(self, user_ids: List[str]) -> Dict[str, str]:
+        cursor = self.subscriptions.find(
+            {"user_id": {"$in": user_ids}, "status": "active"}, {"_id": 0, "user_id": 1, "plan_type": 1}
+        )
+        return {s["user_id"]: s.get("plan_type", "free") async for s in cursor}
+
+    async def backfill(self) -> int:
+        """Define ``expires_at`` num lote de conversões antigas que ainda não o têm."""
+        legacy = await self.conversions.find(
+            {"expires_at": {"$exists": False}}, {"_id": 0, "id": 1, "user_id": 1, "created_at": 1}
+        ).to_list(self.batch_size)
+        if not legacy:
+            return 0
+        plans = await self._plans(list({c["user_id"] for c in legacy}))
+        for conversion in legacy:
+            value = expires_at(conversion["created_at"], plans.get(conversion["user_id"], "free"), self.retention_days)
+            await self.conversions.update_one({"id": conversion["id"]}, {"$set": {"expires_at": value}})
+        return len(legacy)
+
+    async def sweep(self, now: Optional[datetime] = None) -> int:
+        """Um ciclo: backfill e depois remoção dos ficheiros expirados. Devolve quantas conversões limpou."""
+        await self.backfill()
+        now = now or datetime.now(timezone.utc)
+        query = purge_query(now)
+        purged = 0
+        while True:
+            batch = await self.conversions.find(query, {"_id": 0}).to_list(self.batch_size)
+            if not batch:
+                break
+            for conversion in batch:
+                try:
+                    await self.purge(conversion)
+                except Exception as e:
+                    # Não marca: volta a tentar depois do backoff, que também a tira deste ciclo
+                    self.errors += 1
+                    attempts = conversion.get("purge_attempts", 0) + 1
+                    delay = min(self.retry_seconds * 2 ** (attempts - 1), self.max_retry_seconds)
+                    logger.error(
+                        f"Não foi possível apagar os ficheiros da conversão {conversion['id']} "
+                        f"(tentativa {attempts}, nova tentativa em {delay:.0f}s): {str(e)}"
+                    )
+                    await self.conversions.update_one({"id": conversion["id"]}, {
+                        "$set": {"purge_attempts": attempts, "purge_retry_at": (now + timedelta(seconds=delay)).isoformat()},
+                    })
+                    continue
+                await self.conversions.update_one(
+                    {"id": conversion["id"]},
+                    {
+                        "$set": {"artifacts_purged_at": now.isoformat()},
+                        "$unset": {"purge_attempts": "", "purge_retry_at": ""},
+                    },
+                )
+                purged += 1
+            if len(batch) < self.batch_size:
+                break
+        self.purged += purged
+        return purged
+
+    def stats(self) -> Dict:
+        return {"purged": self.purged, "errors": self.errors, "retention_days": self.retention_days}
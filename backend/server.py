@@ -1,32 +1,55 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, ConfigDict, EmailStr
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Tuple
 import uuid
+import hmac
 from datetime import datetime, timezone, timedelta
 import jwt
-from passlib.context import CryptContext
 import json
-import pandas as pd
+import tempfile
+from db_indexes import ensure_indexes
+from exports import (
+    EXPORT_FORMATS, EXPORT_LOCALES, ExportCache, aiter_csv, iter_csv, render_export, write_spool, write_spool_sheet,
+    write_xlsx_spool,
+)
+from executors import Executors
+from pagination import encode_cursor, keyset_filter
+from jobs import ConversionJobQueue, ConversionWorkerPool, PermanentJobError
+from extraction_cache import ExtractionCache, extraction_cache_key
+from user_cache import UserCache
+from llm_client import LLMClient, LLMUnavailable, build_backend
+from llm_json import TransactionStreamParser, merge_continuation, parse_extraction_response, skip_boundary
+from progress import SSE_KEEPALIVE, ProgressBroker, format_sse
+from password_hashing import PasswordHasher
+from normalization import HAS_NUMPY, normalize_statement, normalize_transaction
+from categorization import (
+    RULES_VERSION as CATEGORIZATION_VERSION, categorize_transactions, stats as categorization_stats,
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MongoCommandMetrics, Registry, estimate_tokens
+from profiling import ProfilingMiddleware
+from retention import RetentionSweeper, expires_at
+from storage import build_storage, export_key, upload_key
+from transaction_store import TransactionStore
+from uploads import (
+    UploadLimitMiddleware, extract_pdfs_from_zip, is_zip_file, stream_upload_to_disk, too_large_message
+)
+from quota import load_subscription, release_quota, reserve_quota, split_reservation, switch_plan
+from text_extractor import extract_from_text_layer, parse_pt_amount
+from pdf_tools import HAS_PYPDF, count_pdf_pages, plan_page_ranges, read_page_count, split_pdf
 
-# --- Optional integrations (LLM & Payments) ---
-HAS_LLM = False
+# --- Optional integrations (Payments; o LLM é tratado em llm_client) ---
 HAS_STRIPE = False
 
-try:
-    # Só ficará True se o pacote existir (não existe no PyPI por agora)
-    from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType  # type: ignore
-    HAS_LLM = True
-except Exception:
-    HAS_LLM = False
-
 try:
     # Só ficará True se o pacote existir (não existe no PyPI por agora)
     from emergentintegrations.payments.stripe.checkout import (  # type: ignore
@@ -39,17 +62,81 @@ except Exception:
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env")
 
+# Métricas (GET /metrics, formato Prometheus)
+metrics_registry = Registry()
+http_requests_total = metrics_registry.counter(
+    "http_requests_total", "Pedidos HTTP por endpoint e estado", ["method", "endpoint", "status"]
+)
+http_request_duration = metrics_registry.histogram(
+    "http_request_duration_seconds", "Duração dos pedidos HTTP por endpoint", ["method", "endpoint"]
+)
+http_requests_in_flight = metrics_registry.gauge("http_requests_in_flight", "Pedidos HTTP em curso")
+pipeline_stage_duration = metrics_registry.histogram(
+    "pipeline_stage_duration_seconds", "Duração de cada etapa do upload/conversão/exportação", ["stage"]
+)
+conversions_in_flight = metrics_registry.gauge("conversions_in_flight", "Conversões a ser extraídas neste processo")
+mongo_command_duration = metrics_registry.histogram(
+    "mongo_command_duration_seconds", "Duração dos comandos MongoDB", ["command", "collection"]
+)
+mongo_command_failures = metrics_registry.counter(
+    "mongo_command_failures_total", "Comandos MongoDB falhados", ["command", "collection"]
+)
+llm_requests_total = metrics_registry.counter(
+    "llm_requests_total", "Pedidos ao LLM por banco e resultado", ["bank_name", "outcome"]
+)
+llm_request_duration = metrics_registry.histogram(
+    "llm_request_duration_seconds", "Duração dos pedidos ao LLM (com esperas e novas tentativas)", ["bank_name"]
+)
+llm_prompt_tokens = metrics_registry.counter(
+    "llm_prompt_tokens_total", "Tokens enviados ao LLM (estimativa)", ["bank_name"]
+)
+llm_completion_tokens = metrics_registry.counter(
+    "llm_completion_tokens_total", "Tokens recebidos do LLM (estimativa)", ["bank_name"]
+)
+conversion_job_queue_depth = metrics_registry.gauge(
+    "conversion_job_queue_depth", "Jobs de conversão em fila ou em curso (todos os workers)"
+)
+
+def stage(name: str):
+    """``with stage("..."):`` regista a duração da etapa em ``pipeline_stage_duration_seconds``."""
+    return pipeline_stage_duration.time(stage=name)
+
+def bank_label(bank_name: str) -> str:
+    return bank_name.strip().lower()[:32] or "desconhecido"
+
 # MongoDB connection
 mongo_url = os.environ["MONGO_URL"]
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url, event_listeners=[MongoCommandMetrics(mongo_command_duration, mongo_command_failures)]
+)
 db = client[os.environ["DB_NAME"]]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt num pool dedicado; 429 quando a fila enche
+password_hasher = PasswordHasher(
+    rounds=int(os.environ.get("PASSWORD_HASH_ROUNDS", "12")),
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", "2")),
+    max_pending=int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32")),
+)
+
+# Threads para I/O bloqueante; processos para trabalho CPU (exportações, PDFs, JSON grande)
+executors = Executors(
+    io_workers=int(os.environ.get("IO_THREADS", "16")),
+    cpu_workers=int(os.environ.get("CPU_PROCESSES", "2")),
+)
+# Respostas do LLM abaixo disto são interpretadas no event loop (mais barato que enviar para um processo)
+LLM_PARSE_OFFLOAD_BYTES = int(os.environ.get("LLM_PARSE_OFFLOAD_BYTES", str(256 * 1024)))
+
 security = HTTPBearer()
 JWT_SECRET = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
 
+# Cache dos utilizadores autenticados (evita um find_one por pedido)
+user_cache = UserCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60")),
+)
+
 # LLM and Payment Keys
 EMERGENT_LLM_KEY = os.environ.get("EMERGENT_LLM_KEY", "")
 STRIPE_API_KEY = os.environ.get("STRIPE_API_KEY", "")
@@ -58,6 +145,47 @@ STRIPE_API_KEY = os.environ.get("STRIPE_API_KEY", "")
 DEFAULT_UPLOAD_BASE = Path(os.getenv("UPLOAD_DIR", "/tmp/bank-converter-pt/uploads"))
 UPLOAD_DIR = DEFAULT_UPLOAD_BASE
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(30 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Lotes (vários PDFs ou um ZIP num só pedido)
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "24"))
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+
+# CSV/XLSX gerados a pedido e guardados em cache LRU limitada por tamanho
+export_cache = ExportCache(
+    UPLOAD_DIR / "exports",
+    max_bytes=int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+)
+EXPORT_STREAM_MIN_ROWS = int(os.environ.get("EXPORT_STREAM_MIN_ROWS", "5000"))
+
+# PDFs e exportações: disco local (uma instância) ou S3 partilhado, com
+# downloads por URL pré-assinado. UPLOAD_DIR fica só como espaço temporário.
+storage = build_storage(os.environ.get("STORAGE_BACKEND", "local"), UPLOAD_DIR / "artifacts", scratch_dir=UPLOAD_DIR)
+
+# Listagem de conversões
+CONVERSIONS_PAGE_SIZE = int(os.environ.get("CONVERSIONS_PAGE_SIZE", "20"))
+CONVERSIONS_MAX_PAGE_SIZE = 100
+
+# Conversion job queue (upload com async_mode=true)
+CONVERSION_WORKERS = int(os.environ.get("CONVERSION_WORKERS", "2"))
+job_queue = ConversionJobQueue(
+    db.conversion_jobs,
+    lease_seconds=int(os.environ.get("CONVERSION_JOB_LEASE_SECONDS", "300")),
+    max_attempts=int(os.environ.get("CONVERSION_JOB_MAX_ATTEMPTS", "3")),
+)
+
+# Cache de extrações (mesmo PDF + banco + versão do prompt => sem nova chamada ao LLM)
+extraction_cache = ExtractionCache(
+    db.extraction_cache,
+    ttl_seconds=int(os.environ.get("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    lru_size=int(os.environ.get("EXTRACTION_CACHE_LRU_SIZE", "256")),
+)
+
+# Transações de cada conversão, em lotes fora do documento da conversão
+transaction_store = TransactionStore(
+    db.conversion_transactions,
+    batch_size=int(os.environ.get("TRANSACTION_BATCH_SIZE", "1000")),
+)
 
 # Create the main app
 app = FastAPI()
@@ -76,15 +204,14 @@ SUBSCRIPTION_PLANS = {
     "starter":   {"name": "Inicial",      "pages_limit": 400,  "price": 30.0, "currency": "eur"},
     "pro":       {"name": "Profissional", "pages_limit": 1000, "price": 60.0, "currency": "eur"},
     "business":  {"name": "Business",     "pages_limit": 4000, "price": 99.0, "currency": "eur"},
-},
-    "starter": {"name": "Inicial", "pages_limit": 400, "price": 30.0, "currency": "eur"},
-    "pro": {"name": "Profissional", "pages_limit": 1000, "price": 60.0, "currency": "eur"},
-    "business": {"name": "Business", "pages_limit": 4000, "price": 99.0, "currency": "eur"},
 }
-,
-    "starter": {"name": "Inicial", "pages_limit": 400, "price": 30.0, "currency": "eur"},
-    "pro": {"name": "Profissional", "pages_limit": 4000, "price": 99.0, "currency": "eur"},
+
+# Dias que o PDF e as exportações ficam guardados, por plano (0 = sem limite)
+RETENTION_DAYS = {
+    plan: int(os.environ.get(f"RETENTION_DAYS_{plan.upper()}", default))
+    for plan, default in (("free", "7"), ("starter", "30"), ("pro", "90"), ("business", "365"))
 }
+RETENTION_SWEEP_INTERVAL_SECONDS = float(os.environ.get("RETENTION_SWEEP_INTERVAL_SECONDS", "3600"))
 
 # Models
 class UserRegister(BaseModel):
@@ -142,6 +269,10 @@ class PaymentTransaction(BaseModel):
     created_at: str
 
 # Helper functions
+def invalidate_user(user_id: str):
+    """Chamar sempre que o utilizador mudar (``db.users`` ou plano), para o próximo pedido o reler."""
+    user_cache.invalidate(user_id)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(days=7)
@@ -156,9 +287,12 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user_id, user)
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -167,106 +301,63 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 
 async def get_user_subscription(user_id: str):
     """Obtém a subscrição ativa; cria gratuita se não existir; faz reset mensal e backfill."""
-    subscription = await db.subscriptions.find_one({"user_id": user_id, "status": "active"}, {"_id": 0})
-    if not subscription:
-        now = datetime.now(timezone.utc)
-        subscription = {
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "plan_type": "free",
-            "status": "active",
-            "pages_limit": None,
-            "pages_used_this_month": 0,
-            "conversions_limit": 5,
-            "conversions_used_this_month": 0,
-            "current_period_start": now.isoformat(),
-            "current_period_end": (now + timedelta(days=30)).isoformat()
-        }
-        await db.subscriptions.insert_one(subscription)
-        return subscription
-
-    # Reset mensal se terminou o período
-    try:
-        period_end = datetime.fromisoformat(subscription.get("current_period_end"))
-    except Exception:
-        period_end = datetime.now(timezone.utc)
-    now = datetime.now(timezone.utc)
-    if now > period_end:
-        updates = {
-            "pages_used_this_month": 0,
-            "conversions_used_this_month": 0,
-            "current_period_start": now.isoformat(),
-            "current_period_end": (now + timedelta(days=30)).isoformat(),
-        }
-        await db.subscriptions.update_one({"id": subscription["id"]}, {"$set": updates})
-        subscription.update(updates)
-
-    # Backfill de campos novos
-    changed = False
-    if "conversions_limit" not in subscription:
-        subscription["conversions_limit"] = 5 if subscription.get("plan_type") == "free" else None
-        changed = True
-    if "conversions_used_this_month" not in subscription:
-        subscription["conversions_used_this_month"] = 0
-        changed = True
-    if changed:
-        await db.subscriptions.update_one(
-            {"id": subscription["id"]},
-            {"$set": {
-                "conversions_limit": subscription["conversions_limit"],
-                "conversions_used_this_month": subscription["conversions_used_this_month"],
-            }}
-        )
-    return subscription
+    with stage("subscription_load"):
+        return await load_subscription(db.subscriptions, user_id)
+
+# Extração paralela por intervalos de páginas
+EXTRACTION_PAGES_PER_SHARD = int(os.environ.get("EXTRACTION_PAGES_PER_SHARD", "8"))
+# Pedidos de continuação quando a resposta do LLM vem truncada
+EXTRACTION_MAX_CONTINUATIONS = int(os.environ.get("EXTRACTION_MAX_CONTINUATIONS", "2"))
+
+# Progresso das conversões em tempo real (SSE), por processo
+progress_broker = ProgressBroker()
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_POLL_SECONDS = float(os.environ.get("SSE_POLL_SECONDS", "2"))
+
+# Cliente partilhado do LLM: concorrência global e por utilizador, ritmo do
+# fornecedor, timeout, novas tentativas e circuit breaker
+llm_client = LLMClient(
+    build_backend(os.environ.get("LLM_BACKEND", "emergent"), EMERGENT_LLM_KEY),
+    max_concurrency=int(os.environ.get("EXTRACTION_MAX_CONCURRENCY", "4")),
+    max_concurrency_per_user=int(os.environ.get("LLM_MAX_CONCURRENCY_PER_USER", "2")),
+    requests_per_minute=float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "60")),
+    timeout_seconds=float(os.environ.get("LLM_TIMEOUT_SECONDS", "120")),
+    max_retries=int(os.environ.get("LLM_MAX_RETRIES", "3")),
+    failure_threshold=int(os.environ.get("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+    reset_seconds=float(os.environ.get("LLM_CIRCUIT_RESET_SECONDS", "30")),
+)
 
-    # Reset mensal se terminou o período atual
-    try:
-        period_end = datetime.fromisoformat(subscription["current_period_end"])
-    except Exception:
-        period_end = datetime.now(timezone.utc)
-    now = datetime.now(timezone.utc)
-    if now > period_end:
-        updates = {
-            "pages_used_this_month": 0,
-            "conversions_used_this_month": 0,
-            "current_period_start": now.isoformat(),
-            "current_period_end": (now + timedelta(days=30)).isoformat(),
-        }
-        await db.subscriptions.update_one({"id": subscription["id"]}, {"$set": updates})
-        subscription.update(updates)
-
-    # Backfill de campos novos
-    changed = False
-    if "conversions_limit" not in subscription:
-        subscription["conversions_limit"] = 5 if subscription.get("plan_type") == "free" else None
-        changed = True
-    if "conversions_used_this_month" not in subscription:
-        subscription["conversions_used_this_month"] = 0
-        changed = True
-    if changed:
-        await db.subscriptions.update_one(
-            {"id": subscription["id"]},
-            {"$set": {
-                "conversions_limit": subscription["conversions_limit"],
-                "conversions_used_this_month": subscription["conversions_used_this_month"],
-            }}
+async def get_pdf_page_count(file_path: str) -> Optional[int]:
+    """Conta páginas pelo xref/árvore de páginas; recorre ao pypdf se o PDF for atípico."""
+    pages = await executors.run_io(count_pdf_pages, file_path)
+    if pages is None and HAS_PYPDF:
+        try:
+            pages = await executors.run_cpu(read_page_count, file_path)
+        except Exception as e:
+            logging.warning(f"Não foi possível contar páginas de {file_path}: {str(e)}")
+    return pages
+
+# Caminho rápido sem LLM para PDFs com texto de bancos com layout conhecido
+TEXT_EXTRACTION_ENABLED = os.environ.get("TEXT_EXTRACTION_ENABLED", "true").lower() == "true"
+
+# Incrementar sempre que o prompt mudar, para invalidar o cache de extrações
+PROMPT_VERSION = "2"
+
+def build_extraction_prompt(bank_name: str, page_range: Optional[tuple] = None, total_pages: Optional[int] = None) -> str:
+    scope = ""
+    if page_range is not None:
+        scope = (
+            f"\nEste ficheiro contém apenas as páginas {page_range[0] + 1} a {page_range[1]} de um extrato com "
+            f"{total_pages} páginas. Extraia só as transações destas páginas; o saldo inicial é o saldo no início "
+            f"destas páginas e o saldo final o saldo no fim delas."
         )
-
-    return subscription
-async def extract_transactions_from_pdf(file_path: str, bank_name: str) -> Dict:
-    """Extract transactions from PDF using Gemini AI (opcional)"""
-    # Guard: se não estiver configurado, devolve 503
-    if not HAS_LLM or not EMERGENT_LLM_KEY:
-        raise HTTPException(status_code=503, detail="LLM extraction is not configured on this deployment.")
-
-    prompt = f"""
-Analise este extrato bancário do banco {bank_name} (Portugal) e extraia TODAS as transações visíveis.
+    return f"""
+Analise este extrato bancário do banco {bank_name} (Portugal) e extraia TODAS as transações visíveis.{scope}
 
 INSTRUÇÕES IMPORTANTES:
 1. Extraia TODAS as transações que encontrar no documento
 2. Para cada transação, identifique: data, descrição completa, valor (débito ou crédito)
 3. Identifique o saldo inicial e final se visível
-4. Se possível, identifique categorias fiscais portuguesas (IRS, Segurança Social)
 
 Retorne APENAS um objeto JSON válido, sem texto adicional, neste formato exato:
 {{
@@ -280,63 +371,214 @@ Retorne APENAS um objeto JSON válido, sem texto adicional, neste formato exato:
       "data": "DD/MM/YYYY",
       "descricao": "descrição completa da transação",
       "valor": 0.00,
-      "tipo": "débito",
-      "categoria_fiscal": null
+      "tipo": "débito"
     }},
     {{
       "data": "DD/MM/YYYY", 
       "descricao": "descrição completa",
       "valor": 0.00,
-      "tipo": "crédito",
-      "categoria_fiscal": null
+      "tipo": "crédito"
     }}
   ]
 }}
 IMPORTANTE: Retorne APENAS o JSON, sem explicações ou texto adicional.
 """
+
+
+def build_continuation_prompt(
+    bank_name: str,
+    last_transaction: Dict,
+    received: int,
+    page_range: Optional[tuple] = None,
+    total_pages: Optional[int] = None,
+) -> str:
+    """Pede só as transações a seguir à última recebida numa resposta truncada."""
+    scope = ""
+    if page_range is not None:
+        scope = f" Considere apenas as páginas {page_range[0] + 1} a {page_range[1]} (de {total_pages})."
+    return f"""
+Continuação da extração do extrato bancário do banco {bank_name} (Portugal).{scope}
+
+A resposta anterior foi interrompida depois de {received} transações. A última transação recebida foi:
+{json.dumps(last_transaction, ensure_ascii=False)}
+
+Extraia APENAS as transações que aparecem DEPOIS desta no documento, pela mesma ordem, até ao fim.
+Retorne APENAS um objeto JSON válido, sem texto adicional, neste formato exato:
+{{
+  "saldo_final": 0.00,
+  "transacoes": [
+    {{
+      "data": "DD/MM/YYYY",
+      "descricao": "descrição completa da transação",
+      "valor": 0.00,
+      "tipo": "débito"
+    }}
+  ]
+}}
+IMPORTANTE: Retorne APENAS o JSON, sem explicações ou texto adicional.
+"""
+
+async def parse_llm_response(response: str, bank_name: str) -> Dict:
+    if len(response) >= LLM_PARSE_OFFLOAD_BYTES:
+        return await executors.run_cpu(parse_extraction_response, response, bank_name)
+    return parse_extraction_response(response, bank_name)
+
+# Chamado com cada transação assim que o LLM a termina de escrever
+OnTransaction = Callable[[Dict], None]
+
+async def _llm_response(
+    prompt: str,
+    file_path: str,
+    bank_name: str,
+    user_id: Optional[str],
+    on_transaction: Optional[OnTransaction],
+) -> str:
+    label = bank_label(bank_name)
+    llm_prompt_tokens.inc(estimate_tokens(prompt), bank_name=label)
+    outcome = "error"
+    response = ""
     try:
-        # Estes imports só existem se HAS_LLM == True
-        from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType  # type: ignore
-
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message="És um assistente especializado em análise de extratos bancários portugueses. Retorna APENAS JSON válido, sem texto adicional.",
-        ).with_model("gemini", "gemini-2.0-flash")
-
-        pdf_file = FileContentWithMimeType(file_path=file_path, mime_type="application/pdf")
-        user_message = UserMessage(text=prompt, file_contents=[pdf_file])
-        response = await chat.send_message(user_message)
-
-        response_text = response.strip()
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-
-        start_idx = response_text.find("{")
-        end_idx = response_text.rfind("}")
-        if start_idx != -1 and end_idx != -1:
-            response_text = response_text[start_idx : end_idx + 1]
+        with llm_request_duration.time(bank_name=label):
+            if on_transaction is None:
+                response = await llm_client.complete(prompt, file_path=file_path, user_id=user_id)
+            else:
+                parser = TransactionStreamParser()
+                try:
+                    async for chunk in llm_client.stream(prompt, file_path=file_path, user_id=user_id):
+                        for transaction in parser.feed(chunk):
+                            on_transaction(transaction)
+                finally:
+                    response = parser.text
+        outcome = "success"
+        return response
+    except LLMUnavailable:
+        outcome = "unavailable"
+        raise
+    finally:
+        llm_completion_tokens.inc(estimate_tokens(response), bank_name=label)
+        llm_requests_total.inc(bank_name=label, outcome=outcome)
+
+async def _extract_with_llm(
+    file_path: str,
+    bank_name: str,
+    prompt: str,
+    user_id: Optional[str] = None,
+    on_transaction: Optional[OnTransaction] = None,
+    page_range: Optional[tuple] = None,
+    total_pages: Optional[int] = None,
+) -> Dict:
+    """Uma extração; se a resposta vier truncada pede só o resto (até EXTRACTION_MAX_CONTINUATIONS vezes)."""
+    data = await parse_llm_response(
+        await _llm_response(prompt, file_path, bank_name, user_id, on_transaction), bank_name
+    )
+    for _ in range(EXTRACTION_MAX_CONTINUATIONS):
+        if not data.get("parcial") or not data.get("transacoes"):
+            break
+        continuation_prompt = build_continuation_prompt(
+            bank_name, data["transacoes"][-1], len(data["transacoes"]), page_range, total_pages
+        )
+        # A linha de fronteira já foi publicada; não a enviar outra vez pelo SSE
+        callback = skip_boundary(on_transaction, data["transacoes"][-1]) if on_transaction else None
+        continuation = await parse_llm_response(
+            await _llm_response(continuation_prompt, file_path, bank_name, user_id, callback), bank_name
+        )
+        data = merge_continuation(data, continuation)
+    return data
+
+def merge_extraction_shards(bank_name: str, shards: list) -> Dict:
+    """Junta os resultados parciais por ordem de páginas."""
+    first, last = shards[0], shards[-1]
+    merged = {
+        "banco": first.get("banco") or bank_name,
+        "conta": next((s["conta"] for s in shards if s.get("conta")), None),
+        "periodo": first.get("periodo", "Não identificado"),
+        "saldo_inicial": first.get("saldo_inicial", 0.0),
+        "saldo_final": last.get("saldo_final", 0.0),
+        "transacoes": [t for s in shards for t in s.get("transacoes", [])],
+    }
+    periodo_inicio = str(first.get("periodo", "")).split(" - ")[0]
+    periodo_fim = str(last.get("periodo", "")).split(" - ")[-1]
+    if periodo_inicio and periodo_fim and " - " in str(first.get("periodo", "")):
+        merged["periodo"] = f"{periodo_inicio} - {periodo_fim}"
+    if any(s.get("parcial") for s in shards):
+        merged["parcial"] = True
+    failed = [i + 1 for i, s in enumerate(shards) if s.get("erro")]
+    if failed:
+        merged["erro"] = f"Erro ao processar resposta da IA nas partes {failed}. Por favor, tente novamente."
+    return merged
+
+async def _extract_shard(
+    file_path: str,
+    bank_name: str,
+    page_range: tuple,
+    total_pages: int,
+    user_id: Optional[str] = None,
+    on_transaction: Optional[OnTransaction] = None,
+) -> Dict:
+    prompt = build_extraction_prompt(bank_name, page_range, total_pages)
+    return await _extract_with_llm(
+        file_path, bank_name, prompt, user_id, on_transaction, page_range, total_pages
+    )
 
-        try:
-            extracted_data = json.loads(response_text)
-        except json.JSONDecodeError as je:
-            logging.error(f"JSON parse error: {str(je)}")
-            logging.error(f"Response text: {response_text[:500]}")
-            extracted_data = {
-                "banco": bank_name,
-                "periodo": "Não identificado",
-                "saldo_inicial": 0.0,
-                "saldo_final": 0.0,
-                "transacoes": [],
-                "erro": "Erro ao processar resposta da IA. Por favor, tente novamente.",
-            }
+async def extract_transactions_from_pdf(
+    file_path: str,
+    bank_name: str,
+    user_id: Optional[str] = None,
+    on_transaction: Optional[Callable[[int, Dict], None]] = None,
+) -> Dict:
+    """Extract transactions from PDF using Gemini AI (opcional).
+
+    Extratos com camada de texto de bancos com layout conhecido são lidos
+    localmente, sem LLM. Os restantes, se longos, são divididos em intervalos de
+    páginas extraídos em paralelo e depois juntos por ordem. Os limites de
+    concorrência e ritmo das chamadas ficam no ``llm_client``.
+
+    Com ``on_transaction(parte, transação)`` a resposta do LLM é lida em
+    streaming e cada transação é entregue logo que fica completa.
+    """
+    if TEXT_EXTRACTION_ENABLED:
+        with stage("text_layer"):
+            local_data = await executors.run_cpu(extract_from_text_layer, file_path, bank_name)
+        if local_data is not None:
+            return local_data
 
-        return extracted_data
+    # Guard: se não estiver configurado, devolve 503
+    if not llm_client.backend.available:
+        raise HTTPException(status_code=503, detail="LLM extraction is not configured on this deployment.")
+
+    shard_paths = []
+    try:
+        page_count = await get_pdf_page_count(file_path) or 0
+        if page_count <= EXTRACTION_PAGES_PER_SHARD:
+            callback = (lambda t: on_transaction(0, t)) if on_transaction else None
+            with stage("llm_extraction"):
+                return await _extract_with_llm(
+                    file_path, bank_name, build_extraction_prompt(bank_name), user_id, callback
+                )
+
+        page_ranges = plan_page_ranges(page_count, EXTRACTION_PAGES_PER_SHARD)
+        with stage("pdf_split"):
+            shard_paths = await executors.run_cpu(split_pdf, file_path, page_ranges, UPLOAD_DIR)
+        with stage("llm_extraction"):
+            shards = await asyncio.gather(*[
+                _extract_shard(
+                    path, bank_name, page_range, page_count, user_id,
+                    (lambda t, shard=i: on_transaction(shard, t)) if on_transaction else None,
+                )
+                for i, (path, page_range) in enumerate(zip(shard_paths, page_ranges))
+            ])
+        return merge_extraction_shards(bank_name, list(shards))
+    except LLMUnavailable:
+        raise HTTPException(
+            status_code=503,
+            detail="Serviço de extração temporariamente indisponível. Tente novamente dentro de alguns minutos.",
+        )
     except Exception as e:
         logging.error(f"Error extracting PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro ao processar PDF: {str(e)}")
+    finally:
+        for path in shard_paths:
+            Path(path).unlink(missing_ok=True)
 
 # Auth Routes
 @api_router.post("/auth/register")
@@ -349,7 +591,7 @@ async def register(user_data: UserRegister):
     user = {
         "id": user_id,
         "email": user_data.email,
-        "password_hash": pwd_context.hash(user_data.password),
+        "password_hash": await password_hasher.hash(user_data.password),
         "name": user_data.name,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
@@ -373,8 +615,15 @@ async def register(user_data: UserRegister):
 @api_router.post("/auth/login")
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not pwd_context.verify(user_data.password, user["password_hash"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Email ou senha inválidos")
+    valid, new_hash = await password_hasher.verify_and_update(user_data.password, user["password_hash"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Email ou senha inválidos")
+    if new_hash:
+        # Custo do bcrypt mudou desde o registo: guarda o hash refeito
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password_hash": new_hash}})
+        invalidate_user(user["id"])
 
     token = create_access_token({"sub": user["id"]})
     return {"token": token, "user": {"id": user["id"], "email": user["email"], "name": user["name"]}}
@@ -438,6 +687,26 @@ async def create_checkout_session(checkout_req: CheckoutRequest, current_user: d
     await db.payment_transactions.insert_one(transaction)
     return {"url": session.url, "session_id": session.session_id}
 
+async def activate_paid_plan(session_id: str):
+    """Marca o pagamento como pago e muda o plano, uma só vez por sessão.
+
+    O webhook e a página de sucesso podem chegar os dois (e ao mesmo tempo):
+    só quem passa a transação para ``paid`` muda o plano.
+    """
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+        {"$set": {"payment_status": "paid", "status": "completed"}},
+        projection={"_id": 0},
+    )
+    if transaction is None:
+        return
+    plan_type = transaction["metadata"]["plan_type"]
+    plan = SUBSCRIPTION_PLANS[plan_type]
+    await switch_plan(
+        db.subscriptions, transaction["user_id"], plan_type, plan["pages_limit"], plan.get("conversions_limit")
+    )
+    invalidate_user(transaction["user_id"])
+
 @api_router.get("/payments/checkout/status/{session_id}")
 async def get_checkout_status(session_id: str, current_user: dict = Depends(get_current_user)):
     if not HAS_STRIPE or not STRIPE_API_KEY:
@@ -454,31 +723,8 @@ async def get_checkout_status(session_id: str, current_user: dict = Depends(get_
     stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
     checkout_status = await stripe_checkout.get_checkout_status(session_id)
 
-    if checkout_status.payment_status == "paid" and transaction["payment_status"] != "paid":
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {"payment_status": "paid", "status": "completed"}},
-        )
-
-        plan_type = transaction["metadata"]["plan_type"]
-        plan = SUBSCRIPTION_PLANS[plan_type]
-
-        await db.subscriptions.update_many(
-            {"user_id": current_user["id"], "status": "active"},
-            {"$set": {"status": "cancelled"}},
-        )
-
-        new_subscription = {
-            "id": str(uuid.uuid4()),
-            "user_id": current_user["id"],
-            "plan_type": plan_type,
-            "status": "active",
-            "pages_limit": plan["pages_limit"],
-            "pages_used_this_month": 0,
-            "current_period_start": datetime.now(timezone.utc).isoformat(),
-            "current_period_end": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
-        }
-        await db.subscriptions.insert_one(new_subscription)
+    if checkout_status.payment_status == "paid":
+        await activate_paid_plan(session_id)
 
     updated_transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
     return updated_transaction
@@ -496,132 +742,801 @@ async def stripe_webhook(request: Request):
     webhook_response = await stripe_checkout.handle_webhook(body, signature)
 
     if webhook_response.payment_status == "paid":
-        await db.payment_transactions.update_one(
-            {"session_id": webhook_response.session_id},
-            {"$set": {"payment_status": "paid", "status": "completed"}},
-        )
+        await activate_paid_plan(webhook_response.session_id)
     return {"status": "ok"}
 
+def summarize_extraction(extracted_data: Dict) -> Dict:
+    """Resumo guardado na conversão para a listagem não precisar das transações."""
+    debits = credits = 0.0
+    transactions = extracted_data.get("transacoes", [])
+    for t in transactions:
+        try:
+            valor = abs(float(t.get("valor") or 0))
+        except (TypeError, ValueError):
+            try:
+                valor = abs(parse_pt_amount(str(t["valor"])))
+            except (ValueError, KeyError):
+                continue
+        if str(t.get("tipo", "")).lower().startswith("cr"):
+            credits += valor
+        else:
+            debits += valor
+    return {
+        "transactions_count": len(transactions),
+        "total_debits": round(debits, 2),
+        "total_credits": round(credits, 2),
+    }
+
+def split_extraction(extracted_data: Dict) -> Tuple[Dict, List[Dict]]:
+    """Separa os metadados do extrato (ficam na conversão) das transações."""
+    metadata = {k: v for k, v in extracted_data.items() if k != "transacoes"}
+    return metadata, extracted_data.get("transacoes") or []
+
+async def load_extracted_data(conversion: Dict) -> Optional[Dict]:
+    """``extracted_data`` completo, com as transações lidas do ``transaction_store``.
+
+    Conversões antigas ainda com ``transacoes`` no próprio documento são
+    devolvidas tal como estão.
+    """
+    extracted_data = conversion.get("extracted_data")
+    if extracted_data is None or "transacoes" in extracted_data:
+        return extracted_data
+    transactions = await transaction_store.load(conversion["id"], conversion.get("transactions_generation"))
+    return {**extracted_data, "transacoes": transactions}
+
+async def migrate_legacy_conversions():
+    """Move as transações das conversões antigas para o ``transaction_store``.
+
+    As transações são gravadas antes de sair do documento, por isso um
+    download a meio da migração lê sempre uma das duas versões completa.
+    """
+    query = {"status": "completed", "extracted_data.transacoes": {"$exists": True}}
+    async for conversion in db.conversions.find(query, {"_id": 0, "id": 1, "extracted_data": 1}):
+        metadata, transactions = split_extraction(conversion["extracted_data"])
+        generation = await transaction_store.save(conversion["id"], transactions)
+        await db.conversions.update_one(
+            {"id": conversion["id"]},
+            {"$set": {
+                "extracted_data": metadata,
+                "transactions_generation": generation,
+                **summarize_extraction(conversion["extracted_data"]),
+            }},
+        )
+        await transaction_store.prune(conversion["id"], generation)
+
+async def normalize_extraction(extracted_data: Dict) -> Tuple[Dict, Dict]:
+    """Datas, valores e tipos no formato canónico e saldos reconciliados.
+
+    Devolve o extrato normalizado e o resumo da conversão (totais e
+    ``reconciliacao``). Uma reconciliação falhada não falha a conversão:
+    fica registada para o utilizador rever as linhas indicadas.
+    """
+    if not HAS_NUMPY:
+        return extracted_data, summarize_extraction(extracted_data)
+    with stage("normalization"):
+        normalized, totals, reconciliation = await executors.run_io(normalize_statement, extracted_data)
+    if not reconciliation["ok"]:
+        logging.warning(
+            f"Saldos não reconciliam ({normalized.get('banco')}): diferença {reconciliation.get('diferenca')}, "
+            f"linhas {reconciliation.get('linhas_divergentes', [])}"
+        )
+    return normalized, {
+        "transactions_count": len(normalized["transacoes"]),
+        "total_debits": round(totals["total_debits"], 2),
+        "total_credits": round(totals["total_credits"], 2),
+        "reconciliacao": reconciliation,
+    }
+
+def canonical_transaction(transaction: Dict) -> Dict:
+    """Transação como fica no extrato guardado (``normalize_extraction`` + ``categorize_transactions``)."""
+    if HAS_NUMPY:
+        transaction = normalize_transaction(transaction)
+    return categorize_transactions([transaction])[0][0]
+
+async def run_conversion(
+    conversion_id: str,
+    file_path: str,
+    bank_name: str,
+    cache_key: Optional[str] = None,
+    extracted_data: Optional[Dict] = None,
+    user_id: Optional[str] = None,
+):
+    """Extrai as transações e marca a conversão como concluída.
+
+    CSV/XLSX só são gerados no primeiro download (ver ``export_cache``).
+
+    Se ``extracted_data`` vier do cache, o LLM não é chamado.
+
+    O progresso é publicado no ``progress_broker`` (ver ``/conversions/{id}/events``).
+    """
+    progress_broker.publish(conversion_id, "started", {"conversion_id": conversion_id, "status": "processing"})
+    streamed = 0
+
+    def publish_transaction(shard: int, transaction: Dict):
+        progress_broker.publish(conversion_id, "transaction", {"shard": shard, "transacao": transaction})
+
+    def on_transaction(shard: int, transaction: Dict):
+        # Linha tal como vem do LLM: mostrada já como fica guardada
+        nonlocal streamed
+        streamed += 1
+        publish_transaction(shard, canonical_transaction(transaction))
+
+    fresh = extracted_data is None
+    if fresh:
+        with conversions_in_flight.track_inprogress():
+            extracted_data = await extract_transactions_from_pdf(file_path, bank_name, user_id, on_transaction)
+    # Também nos resultados do cache, que podem ser anteriores à normalização
+    extracted_data, summary = await normalize_extraction(extracted_data)
+    if fresh and cache_key:
+        with stage("extraction_cache_set"):
+            await extraction_cache.set(cache_key, extracted_data)
+
+    metadata, transactions = split_extraction(extracted_data)
+    # Categorias fiscais por regras locais, não pelo LLM (ver ``categorization``)
+    with stage("categorization"):
+        transactions, _ = await executors.run_io(categorize_transactions, transactions)
+    if not streamed:
+        # Cache ou camada de texto: as transações chegam todas de uma vez
+        for transaction in transactions:
+            publish_transaction(0, transaction)
+    with stage("transaction_store_save"):
+        generation = await transaction_store.save(conversion_id, transactions)
+    with stage("conversion_update"):
+        # Troca atómica para a nova geração; a anterior só é apagada depois
+        await db.conversions.update_one(
+            {"id": conversion_id},
+            {"$set": {
+                "status": "completed",
+                "extracted_data": metadata,
+                "transactions_generation": generation,
+                "categorization_version": CATEGORIZATION_VERSION,
+                **summary,
+            }},
+        )
+    await transaction_store.prune(conversion_id, generation)
+    progress_broker.publish(conversion_id, "complete", completion_event(conversion_id, metadata, summary))
+
+def completion_event(conversion_id: str, metadata: Dict, summary: Dict) -> Dict:
+    """Evento final do SSE: saldos, totais e links de download."""
+    event = {
+        "conversion_id": conversion_id,
+        "status": "completed",
+        **{k: metadata.get(k) for k in ("banco", "conta", "periodo", "saldo_inicial", "saldo_final")},
+        **{k: summary.get(k) for k in ("transactions_count", "total_debits", "total_credits")},
+        "downloads": {
+            "csv": f"/api/conversions/{conversion_id}/download/csv",
+            "excel": f"/api/conversions/{conversion_id}/download/excel",
+        },
+    }
+    for key in ("parcial", "erro"):
+        if metadata.get(key):
+            event[key] = metadata[key]
+    if summary.get("reconciliacao"):
+        event["reconciliacao"] = summary["reconciliacao"]
+    return event
+
+def publish_failure(conversion_id: str, detail: str):
+    progress_broker.publish(conversion_id, "error", {"conversion_id": conversion_id, "status": "failed", "detail": detail})
+
+
+async def store_upload(conversion_id: str, file_path: Path, best_effort: bool = False):
+    """Move o PDF para o ``storage`` (fica lá até expirar, ver ``retention_sweeper``).
+
+    Com ``best_effort`` uma falha só fica no log (a conversão já terminou).
+    """
+    try:
+        with stage("storage_put"):
+            await storage.put_file(upload_key(conversion_id), file_path, move=True, content_type="application/pdf")
+    except Exception as e:
+        if not best_effort:
+            raise
+        logging.error(f"Não foi possível guardar o PDF da conversão {conversion_id}: {str(e)}")
+        file_path.unlink(missing_ok=True)
+
+@asynccontextmanager
+async def job_file(job: Dict[str, Any]):
+    """PDF do job num caminho local (jobs antigos ainda trazem ``file_path``)."""
+    payload = job["payload"]
+    if "file_key" not in payload:
+        yield Path(payload["file_path"])
+        return
+    if not await storage.exists(payload["file_key"]):
+        raise PermanentJobError("O PDF desta conversão já não existe no armazenamento.")
+    async with storage.local_copy(payload["file_key"]) as path:
+        yield path
+
+async def process_conversion_job(job: Dict[str, Any]):
+    payload = job["payload"]
+    try:
+        async with job_file(job) as file_path:
+            await run_conversion(
+                job["conversion_id"],
+                str(file_path),
+                payload["bank_name"],
+                cache_key=payload.get("cache_key"),
+                user_id=payload.get("user_id"),
+            )
+    except HTTPException as e:
+        # LLM não configurado não se resolve com novas tentativas (ao contrário
+        # do 503 do circuit breaker, que volta a ser tentado mais tarde)
+        if e.status_code == 503 and not llm_client.backend.available:
+            raise PermanentJobError(e.detail)
+        raise RuntimeError(e.detail)
+
+
+async def fail_conversion_job(job: Dict[str, Any], error: str):
+    await db.conversions.update_one(
+        {"id": job["conversion_id"]},
+        {"$set": {"status": "failed", "error": error}},
+    )
+    publish_failure(job["conversion_id"], error)
+    if job["payload"].get("reservation"):
+        await release_quota(db.subscriptions, job["payload"]["reservation"])
+
+
+def quota_exceeded(subscription: Dict, free_detail: str) -> HTTPException:
+    if subscription.get("plan_type") == "free":
+        return HTTPException(status_code=403, detail=free_detail)
+    return HTTPException(
+        status_code=403,
+        detail="Limite de páginas atingido para o seu plano. Faça upgrade para continuar."
+    )
+
 # Conversion Routes
 @api_router.post("/conversions/upload")
 async def upload_statement(
     file: UploadFile = File(...),
     bank_name: str = "Millennium",
+    async_mode: bool = False,
     current_user: dict = Depends(get_current_user),
 ):
-    subscription = await get_user_subscription(current_user["id"])
-
-    file_content = await file.read()
-from io import BytesIO
-buffer = BytesIO(file_content)
-estimated_pages = max(1, len(file_content) // (50 * 1024))
-
-    if subscription.get("plan_type") == "free":
-        limit = subscription.get("conversions_limit", 5)
-        used = subscription.get("conversions_used_this_month", 0)
-        if used >= limit:
-            raise HTTPException(
-                status_code=403,
-                detail="Atingiu o limite de 5 utilizações gratuitas este mês. Escolha um plano para continuar."
-            )
-    else:
-        if subscription.get("pages_limit") is not None and \
-           subscription["pages_used_this_month"] + estimated_pages > subscription["pages_limit"]:
-            raise HTTPException(
-                status_code=403,
-                detail="Limite de páginas atingido para o seu plano. Faça upgrade para continuar."
-            )
-file_id = str(uuid.uuid4())
+    # Escrita em blocos: a memória usada é um bloco, seja qual for o tamanho do PDF
+    file_id = str(uuid.uuid4())
     file_path = UPLOAD_DIR / f"{file_id}.pdf"
-    with open(file_path, "wb") as f:
-        f.write(buffer.getvalue())
+    with stage("upload_write"):
+        content_sha256, file_size = await stream_upload_to_disk(
+            file, file_path, MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE
+        )
+
+    # Contagem real de páginas (trailer/xref); a estimativa por tamanho fica como último recurso
+    with stage("page_count"):
+        pages_count = await get_pdf_page_count(str(file_path)) or max(1, file_size // (50 * 1024))
+
+    # Verifica e reserva a quota de uma só vez (atómico face a uploads concorrentes)
+    with stage("quota_reserve"):
+        subscription, reservation = await reserve_quota(db.subscriptions, current_user["id"], pages_count)
+    if reservation is None:
+        file_path.unlink(missing_ok=True)
+        raise quota_exceeded(
+            subscription,
+            "Atingiu o limite de 5 utilizações gratuitas este mês. Escolha um plano para continuar."
+        )
 
     conversion = {
         "id": file_id,
         "user_id": current_user["id"],
         "original_filename": file.filename,
         "bank_name": bank_name,
-        "pages_count": estimated_pages,
+        "pages_count": pages_count,
         "status": "processing",
+        "content_sha256": content_sha256,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    await db.conversions.insert_one(conversion)
-
-    try:
-        extracted_data = await extract_transactions_from_pdf(str(file_path), bank_name)
-
-        csv_path = UPLOAD_DIR / f"{file_id}.csv"
-        df = pd.DataFrame(extracted_data.get("transacoes", []))
-        df.to_csv(csv_path, index=False)
+    conversion["expires_at"] = expires_at(
+        conversion["created_at"], subscription.get("plan_type", "free"), RETENTION_DAYS
+    )
 
-        excel_path = UPLOAD_DIR / f"{file_id}.xlsx"
-        df.to_excel(excel_path, index=False, sheet_name="Transações")
+    cache_key = extraction_cache_key(content_sha256, bank_name, PROMPT_VERSION)
+    with stage("extraction_cache_get"):
+        cached_data = await extraction_cache.get(cache_key)
+    conversion["cache_hit"] = cached_data is not None
+    with stage("conversion_insert"):
+        await db.conversions.insert_one(conversion)
 
-        await db.conversions.update_one(
-            {"id": file_id},
-            {"$set": {"status": "completed", "extracted_data": extracted_data}},
+    if async_mode and cached_data is None:
+        # O worker pode estar noutra instância: o PDF vai primeiro para o storage
+        try:
+            await store_upload(file_id, file_path)
+        except Exception as e:
+            logging.error(f"Não foi possível guardar o PDF da conversão {file_id}: {str(e)}")
+            file_path.unlink(missing_ok=True)
+            await db.conversions.update_one({"id": file_id}, {"$set": {"status": "failed"}})
+            await release_quota(db.subscriptions, reservation)
+            raise HTTPException(status_code=500, detail="Não foi possível guardar o ficheiro. Tente novamente.")
+        # Devolve já o id; o estado "processing" passa a ser gerido pelos workers
+        job_id = await job_queue.enqueue(file_id, {
+            "file_key": upload_key(file_id),
+            "bank_name": bank_name,
+            "cache_key": cache_key,
+            "reservation": reservation,
+            "user_id": current_user["id"],
+        })
+        return JSONResponse(
+            status_code=202,
+            content={"conversion_id": file_id, "job_id": job_id, "status": "processing", "cache_hit": False},
         )
 
-        await db.subscriptions.update_one(
-            {"id": subscription["id"]},
-            {"$inc": {"pages_used_this_month": estimated_pages}},
+    try:
+        await run_conversion(
+            file_id, str(file_path), bank_name, cache_key=cache_key, extracted_data=cached_data,
+            user_id=current_user["id"],
         )
-
-        return {"conversion_id": file_id, "status": "completed"}
-    except HTTPException:
+        return {"conversion_id": file_id, "status": "completed", "cache_hit": cached_data is not None}
+    except HTTPException as e:
         # Repassa erros explícitos (ex.: 503 LLM não configurado)
         await db.conversions.update_one({"id": file_id}, {"$set": {"status": "failed"}})
+        await release_quota(db.subscriptions, reservation)
+        publish_failure(file_id, str(e.detail))
         raise
     except Exception as e:
         await db.conversions.update_one({"id": file_id}, {"$set": {"status": "failed"}})
+        await release_quota(db.subscriptions, reservation)
+        publish_failure(file_id, str(e))
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await store_upload(file_id, file_path, best_effort=True)
+
+async def receive_batch_files(files: List[UploadFile]) -> List[Tuple[str, Path, str, int]]:
+    """Grava e valida todos os ficheiros do lote: ``(nome, caminho, sha256, tamanho)`` por PDF.
+
+    ZIPs são abertos e cada PDF lá dentro conta como um extrato. Se algum
+    ficheiro for inválido o lote inteiro é recusado e nada fica em disco.
+    """
+    statements: List[Tuple[str, Path, str, int]] = []
+    received = 0
+    try:
+        for upload in files:
+            path = UPLOAD_DIR / f"{uuid.uuid4()}.upload"
+            try:
+                content_sha256, size = await stream_upload_to_disk(
+                    upload, path, MAX_BATCH_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE, allow_zip=True
+                )
+            except HTTPException as e:
+                raise HTTPException(status_code=e.status_code, detail=f"{upload.filename}: {e.detail}")
+            received += size
+            if received > MAX_BATCH_UPLOAD_BYTES:
+                path.unlink(missing_ok=True)
+                raise HTTPException(status_code=413, detail=too_large_message(MAX_BATCH_UPLOAD_BYTES))
+            if is_zip_file(path):
+                try:
+                    members = await executors.run_io(
+                        extract_pdfs_from_zip, path, UPLOAD_DIR, MAX_BATCH_FILES - len(statements),
+                        MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE,
+                    )
+                finally:
+                    path.unlink(missing_ok=True)
+                statements.extend(members)
+            elif size > MAX_UPLOAD_BYTES:
+                path.unlink(missing_ok=True)
+                raise HTTPException(status_code=413, detail=f"{upload.filename}: {too_large_message(MAX_UPLOAD_BYTES)}")
+            else:
+                pdf_path = path.with_suffix(".pdf")
+                path.rename(pdf_path)
+                statements.append((upload.filename, pdf_path, content_sha256, size))
+            if len(statements) > MAX_BATCH_FILES:
+                raise HTTPException(status_code=400, detail=f"Um lote pode ter no máximo {MAX_BATCH_FILES} extratos.")
+    except BaseException:
+        for _, path, _, _ in statements:
+            path.unlink(missing_ok=True)
+        raise
+    if not statements:
+        raise HTTPException(status_code=400, detail="O lote não contém nenhum PDF.")
+    return statements
+
+@api_router.post("/conversions/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    bank_name: str = "Millennium",
+    current_user: dict = Depends(get_current_user),
+):
+    """Vários extratos (PDFs e/ou ZIPs) num só pedido.
+
+    Tudo é validado e a quota é reservada de uma só vez, antes de começar a
+    extração: ou o lote inteiro é aceite, ou nenhum extrato é. A extração
+    corre nos workers da fila (``CONVERSION_WORKERS``), com os limites de
+    concorrência do ``llm_client``; o estado agregado fica em
+    ``GET /conversions/batch/{batch_id}``.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Um lote pode ter no máximo {MAX_BATCH_FILES} extratos.")
+
+    with stage("upload_write"):
+        statements = await receive_batch_files(files)
+    with stage("page_count"):
+        pages = [
+            await get_pdf_page_count(str(path)) or max(1, size // (50 * 1024))
+            for _, path, _, size in statements
+        ]
+    with stage("quota_reserve"):
+        subscription, reservation = await reserve_quota(
+            db.subscriptions, current_user["id"], sum(pages), conversions=len(statements)
+        )
+    if reservation is None:
+        for _, path, _, _ in statements:
+            path.unlink(missing_ok=True)
+        raise quota_exceeded(
+            subscription,
+            f"O lote tem {len(statements)} extratos e excede as utilizações gratuitas disponíveis este mês. "
+            "Escolha um plano para continuar."
+        )
+
+    batch_id = str(uuid.uuid4())
+    created_at = datetime.now(timezone.utc).isoformat()
+    conversions = []
+    for (filename, path, content_sha256, _), pages_count in zip(statements, pages):
+        conversions.append({
+            "id": path.stem,
+            "user_id": current_user["id"],
+            "batch_id": batch_id,
+            "original_filename": filename,
+            "bank_name": bank_name,
+            "pages_count": pages_count,
+            "status": "processing",
+            "content_sha256": content_sha256,
+            "created_at": created_at,
+            "expires_at": expires_at(created_at, subscription.get("plan_type", "free"), RETENTION_DAYS),
+        })
+    await db.conversion_batches.insert_one({
+        "id": batch_id,
+        "user_id": current_user["id"],
+        "bank_name": bank_name,
+        "conversion_ids": [c["id"] for c in conversions],
+        "created_at": created_at,
+    })
+
+    cache_keys = [extraction_cache_key(c["content_sha256"], bank_name, PROMPT_VERSION) for c in conversions]
+    cached = [await extraction_cache.get(key) for key in cache_keys]
+    for conversion, cached_data in zip(conversions, cached):
+        conversion["cache_hit"] = cached_data is not None
+    await db.conversions.insert_many(conversions)
+
+    items = []
+    for conversion, cache_key, cached_data, item_reservation, (_, path, _, _) in zip(
+        conversions, cache_keys, cached, split_reservation(reservation, pages), statements
+    ):
+        item = {"conversion_id": conversion["id"], "original_filename": conversion["original_filename"],
+                "cache_hit": cached_data is not None}
+        try:
+            if cached_data is None:
+                await store_upload(conversion["id"], path)
+                item["job_id"] = await job_queue.enqueue(conversion["id"], {
+                    "file_key": upload_key(conversion["id"]),
+                    "bank_name": bank_name,
+                    "cache_key": cache_key,
+                    "reservation": item_reservation,
+                    "user_id": current_user["id"],
+                })
+                item["status"] = "processing"
+            else:
+                # Do cache: não passa pelo LLM, fica já concluído
+                await run_conversion(conversion["id"], str(path), bank_name, extracted_data=cached_data)
+                await store_upload(conversion["id"], path, best_effort=True)
+                item["status"] = "completed"
+        except Exception as e:
+            path.unlink(missing_ok=True)
+            await db.conversions.update_one({"id": conversion["id"]}, {"$set": {"status": "failed", "error": str(e)}})
+            await release_quota(db.subscriptions, item_reservation)
+            publish_failure(conversion["id"], str(e))
+            item["status"] = "failed"
+        items.append(item)
+
+    return JSONResponse(
+        status_code=202,
+        content={"batch_id": batch_id, "status": "processing", "conversions": items},
+    )
+
+def batch_status(conversions: List[Dict]) -> str:
+    statuses = [c["status"] for c in conversions]
+    if "processing" in statuses:
+        return "processing"
+    failed = statuses.count("failed")
+    if failed == len(statuses):
+        return "failed"
+    return "partial" if failed else "completed"
+
+async def load_batch(batch_id: str, current_user: dict) -> Tuple[Dict, List[Dict]]:
+    batch = await db.conversion_batches.find_one({"id": batch_id, "user_id": current_user["id"]}, {"_id": 0})
+    if not batch:
+        raise HTTPException(status_code=404, detail="Lote não encontrado")
+    conversions = await db.conversions.find(
+        {"batch_id": batch_id, "user_id": current_user["id"]}, {"_id": 0}
+    ).to_list(len(batch["conversion_ids"]))
+    # Pela ordem de envio
+    order = {cid: i for i, cid in enumerate(batch["conversion_ids"])}
+    conversions.sort(key=lambda c: order.get(c["id"], len(order)))
+    return batch, conversions
+
+@api_router.get("/conversions/batch/{batch_id}")
+async def get_batch(batch_id: str, current_user: dict = Depends(get_current_user)):
+    batch, conversions = await load_batch(batch_id, current_user)
+    status = batch_status(conversions)
+    completed = [c for c in conversions if c["status"] == "completed"]
+    result = {
+        **batch,
+        "status": status,
+        "total": len(conversions),
+        "completed": len(completed),
+        "failed": sum(1 for c in conversions if c["status"] == "failed"),
+        "processing": sum(1 for c in conversions if c["status"] == "processing"),
+        "transactions_count": sum(c.get("transactions_count", 0) for c in completed),
+        "total_debits": round(sum(c.get("total_debits", 0.0) for c in completed), 2),
+        "total_credits": round(sum(c.get("total_credits", 0.0) for c in completed), 2),
+        "conversions": [
+            {k: c.get(k) for k in ("id", "original_filename", "status", "pages_count", "cache_hit",
+                                   "transactions_count", "error")}
+            for c in conversions
+        ],
+    }
+    if status in ("completed", "partial"):
+        result["downloads"] = {
+            "csv": f"/api/conversions/batch/{batch_id}/download/csv",
+            "excel": f"/api/conversions/batch/{batch_id}/download/excel",
+        }
+    return result
+
+async def iter_conversion_rows(conversion: Dict):
+    """Transações de uma conversão, em lotes (também as antigas, guardadas no próprio documento)."""
+    legacy = (conversion.get("extracted_data") or {}).get("transacoes")
+    if legacy is not None:
+        yield legacy
+        return
+    async for rows in transaction_store.iter_batches(conversion["id"], conversion.get("transactions_generation")):
+        yield rows
+
+async def iter_batch_rows(conversions: List[Dict]):
+    """Transações de todas as conversões, em lotes, com a coluna ``extrato`` à cabeça."""
+    for conversion in conversions:
+        extrato = conversion["original_filename"]
+        async for rows in iter_conversion_rows(conversion):
+            yield [{"extrato": extrato, **row} for row in rows]
+
+async def render_batch_xlsx(conversions: List[Dict], layout: str, path: Path):
+    """XLSX do lote sem juntar as transações em memória.
+
+    Os lotes de transações são escritos num spool em disco à medida que
+    chegam do MongoDB; o XLSX é depois gerado no pool de processos a ler o
+    spool linha a linha para o workbook write-only.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".jsonl", dir=UPLOAD_DIR)
+    os.close(fd)
+    spool = Path(tmp)
+    try:
+        with open(spool, "w", encoding="utf-8") as out:
+            if layout == "merged":
+                write_spool_sheet(out, 0, "Transações")
+                async for rows in iter_batch_rows(conversions):
+                    await executors.run_io(write_spool, out, 0, rows)
+            else:
+                for sheet, conversion in enumerate(conversions):
+                    write_spool_sheet(out, sheet, conversion["original_filename"])
+                    async for rows in iter_conversion_rows(conversion):
+                        await executors.run_io(write_spool, out, sheet, rows)
+        await executors.run_cpu(write_xlsx_spool, spool, path)
+    finally:
+        spool.unlink(missing_ok=True)
+
+@api_router.get("/conversions/batch/{batch_id}/download/{fmt}")
+async def download_batch(
+    batch_id: str,
+    fmt: str,
+    layout: str = "sheets",
+    locale: str = "default",
+    redirect: bool = True,
+    current_user: dict = Depends(get_current_user),
+):
+    """Exportação conjunta do lote.
+
+    CSV: um único ledger com a coluna ``extrato``. XLSX: uma folha por
+    extrato (``layout=sheets``) ou um ledger único (``layout=merged``).
+    Só entram as conversões concluídas.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=404, detail="Formato não suportado")
+    if layout not in ("sheets", "merged"):
+        raise HTTPException(status_code=400, detail="Layout inválido")
+    if locale not in EXPORT_LOCALES:
+        raise HTTPException(status_code=400, detail="Formato regional inválido")
+
+    _, conversions = await load_batch(batch_id, current_user)
+    if batch_status(conversions) == "processing":
+        raise HTTPException(status_code=409, detail="O lote ainda está a ser processado")
+    completed = [c for c in conversions if c["status"] == "completed"]
+    if not completed:
+        raise HTTPException(status_code=404, detail="O lote não tem conversões concluídas")
+
+    spec = EXPORT_FORMATS[fmt]
+    filename = f"lote-{batch_id[:8]}{spec['suffix']}"
+    # O CSV é sempre um ledger único
+    key = f"batch-{batch_id}-{'merged' if fmt == 'csv' else layout}"
+    export_locale = locale if fmt == "csv" else "default"
+    object_key = export_key(export_cache.path_for(key, fmt, export_locale).name)
+    if storage.presigned and await storage.exists(object_key):
+        return presigned_response(object_key, spec["media_type"], filename, redirect)
+
+    export_path = export_cache.lookup(key, fmt, export_locale)
+    if export_path is None and fmt == "csv":
+        body = aiter_csv(iter_batch_rows(completed), locale)
+        if not storage.presigned:
+            return StreamingResponse(
+                body,
+                media_type=spec["media_type"],
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            )
+        with stage("export_render"):
+            export_path = await export_cache.store_stream(key, fmt, body, export_locale)
+    if export_path is None:
+        with stage("export_render"):
+            export_path = await export_cache.build(key, fmt, lambda path: render_batch_xlsx(completed, layout, path))
+    return await export_response(object_key, export_path, spec["media_type"], filename, redirect)
 
 @api_router.get("/conversions")
-async def get_conversions(current_user: dict = Depends(get_current_user)):
+async def get_conversions(
+    cursor: Optional[str] = None,
+    limit: int = CONVERSIONS_PAGE_SIZE,
+    current_user: dict = Depends(get_current_user),
+):
+    """Lista resumida (sem ``extracted_data``), paginada por cursor.
+
+    O payload completo continua disponível em ``GET /conversions/{id}``.
+    """
+    limit = max(1, min(limit, CONVERSIONS_MAX_PAGE_SIZE))
+    query = keyset_filter({"user_id": current_user["id"]}, cursor)
     conversions = (
-        await db.conversions.find({"user_id": current_user["id"]}, {"_id": 0})
-        .sort("created_at", -1)
-        .to_list(100)
+        await db.conversions.find(query, {"_id": 0, "extracted_data": 0})
+        .sort([("created_at", -1), ("id", -1)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
     )
-    return conversions
+    next_cursor = encode_cursor(conversions[limit - 1]) if len(conversions) > limit else None
+    return {"items": conversions[:limit], "next_cursor": next_cursor}
 
 @api_router.get("/conversions/{conversion_id}")
 async def get_conversion(conversion_id: str, current_user: dict = Depends(get_current_user)):
     conversion = await db.conversions.find_one({"id": conversion_id, "user_id": current_user["id"]}, {"_id": 0})
     if not conversion:
         raise HTTPException(status_code=404, detail="Conversão não encontrada")
+    conversion["extracted_data"] = await load_extracted_data(conversion)
     return conversion
 
-@api_router.get("/conversions/{conversion_id}/download/csv")
-async def download_csv(conversion_id: str, current_user: dict = Depends(get_current_user)):
-    conversion = await db.conversions.find_one({"id": conversion_id, "user_id": current_user["id"]}, {"_id": 0})
-    if not conversion:
+@api_router.get("/conversions/{conversion_id}/events")
+async def conversion_events(conversion_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """Server-Sent Events com o progresso da conversão.
+
+    Eventos: ``started``, ``transaction`` (uma por transação, à medida que o
+    LLM as escreve), e no fim ``complete`` (saldos e links de download) ou
+    ``error``. Se a conversão estiver a correr noutro processo não há
+    transações intermédias: o estado é consultado no MongoDB até terminar.
+    """
+    projection = {"_id": 0, "id": 1, "status": 1, "error": 1, "extracted_data": 1,
+                  "transactions_count": 1, "total_debits": 1, "total_credits": 1, "reconciliacao": 1}
+    query = {"id": conversion_id, "user_id": current_user["id"]}
+    if not await db.conversions.find_one(query, {"_id": 0, "id": 1}):
         raise HTTPException(status_code=404, detail="Conversão não encontrada")
 
-    csv_path = UPLOAD_DIR / f"{conversion_id}.csv"
-    if not csv_path.exists():
-        raise HTTPException(status_code=404, detail="Arquivo CSV não encontrado")
+    def final_event(conversion: Dict) -> Optional[bytes]:
+        if conversion["status"] == "completed":
+            metadata = {k: v for k, v in (conversion.get("extracted_data") or {}).items() if k != "transacoes"}
+            return format_sse("complete", completion_event(conversion_id, metadata, conversion))
+        if conversion["status"] == "failed":
+            detail = conversion.get("error") or "Falha na conversão"
+            return format_sse("error", {"conversion_id": conversion_id, "status": "failed", "detail": detail})
+        return None
+
+    async def events():
+        while not await request.is_disconnected():
+            if progress_broker.has_channel(conversion_id):
+                async for item in progress_broker.subscribe(conversion_id, SSE_HEARTBEAT_SECONDS):
+                    if await request.is_disconnected():
+                        return
+                    yield SSE_KEEPALIVE if item is None else format_sse(*item)
+                return
+            conversion = await db.conversions.find_one(query, projection)
+            if conversion is None:
+                return
+            final = final_event(conversion)
+            if final is not None:
+                yield final
+                return
+            yield SSE_KEEPALIVE
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    return FileResponse(csv_path, media_type="text/csv", filename=f"{conversion['original_filename']}.csv")
+async def export_response(object_key: str, export_path: Path, media_type: str, filename: str, redirect: bool):
+    """Serve o ficheiro gerado: direto (storage local) ou pelo S3, com URL pré-assinado.
+
+    Com ``redirect=False`` devolve ``{"url": ...}`` em vez do redirect (o
+    frontend usa-o para não enviar o token de autenticação ao S3).
+    """
+    if not storage.presigned:
+        return FileResponse(export_path, media_type=media_type, filename=filename)
+    with stage("storage_put"):
+        await storage.put_file(object_key, export_path, content_type=media_type)
+    return presigned_response(object_key, media_type, filename, redirect)
+
+def presigned_response(object_key: str, media_type: str, filename: str, redirect: bool):
+    url = storage.presigned_url(object_key, filename, media_type)
+    if redirect:
+        return RedirectResponse(url, status_code=307)
+    return {"url": url}
+
+async def serve_export(
+    conversion_id: str, fmt: str, locale: str, current_user: dict, not_found_detail: str, redirect: bool = True
+):
+    if locale not in EXPORT_LOCALES:
+        raise HTTPException(status_code=400, detail="Formato regional inválido")
 
-@api_router.get("/conversions/{conversion_id}/download/excel")
-async def download_excel(conversion_id: str, current_user: dict = Depends(get_current_user)):
     conversion = await db.conversions.find_one({"id": conversion_id, "user_id": current_user["id"]}, {"_id": 0})
     if not conversion:
         raise HTTPException(status_code=404, detail="Conversão não encontrada")
 
-    excel_path = UPLOAD_DIR / f"{conversion_id}.xlsx"
-    if not excel_path.exists():
-        raise HTTPException(status_code=404, detail="Arquivo Excel não encontrado")
+    extracted_data = conversion.get("extracted_data")
+    if conversion.get("status") != "completed" or extracted_data is None:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+
+    legacy_transactions = extracted_data.get("transacoes")
+    spec = EXPORT_FORMATS[fmt]
+    filename = f"{conversion['original_filename']}{spec['suffix']}"
+    export_locale = locale if fmt == "csv" else "default"
+
+    object_key = export_key(export_cache.path_for(conversion_id, fmt, export_locale).name)
+    if storage.presigned and await storage.exists(object_key):
+        return presigned_response(object_key, spec["media_type"], filename, redirect)
+
+    export_path = export_cache.lookup(conversion_id, fmt, export_locale)
+    rows_count = conversion.get("transactions_count", len(legacy_transactions or []))
+    if export_path is None and fmt == "csv" and rows_count >= EXPORT_STREAM_MIN_ROWS:
+        # Extratos grandes: CSV gerado lote a lote diretamente para a resposta
+        if legacy_transactions is not None:
+            body = iter_csv(legacy_transactions, locale)
+        else:
+            body = aiter_csv(iter_conversion_rows(conversion), locale)
+        if not storage.presigned:
+            return StreamingResponse(
+                body,
+                media_type=spec["media_type"],
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            )
+        # Com S3 é gerado uma vez; os downloads seguintes vão direto ao bucket
+        with stage("export_render"):
+            export_path = await export_cache.store_stream(conversion_id, fmt, body, export_locale)
+
+    if export_path is None:
+        transactions = legacy_transactions
+        if transactions is None:
+            with stage("export_load"):
+                transactions = await transaction_store.load(conversion_id, conversion.get("transactions_generation"))
+        with stage("export_render"):
+            export_path = await export_cache.build(
+                conversion_id, fmt,
+                lambda path: executors.run_cpu(render_export, fmt, transactions, path, export_locale),
+                export_locale,
+            )
+    return await export_response(object_key, export_path, spec["media_type"], filename, redirect)
 
-    return FileResponse(
-        excel_path,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename=f"{conversion['original_filename']}.xlsx",
-    )
+@api_router.get("/conversions/{conversion_id}/download/csv")
+async def download_csv(
+    conversion_id: str, locale: str = "default", redirect: bool = True, current_user: dict = Depends(get_current_user)
+):
+    return await serve_export(conversion_id, "csv", locale, current_user, "Arquivo CSV não encontrado", redirect)
+
+@api_router.get("/conversions/{conversion_id}/download/excel")
+async def download_excel(conversion_id: str, redirect: bool = True, current_user: dict = Depends(get_current_user)):
+    return await serve_export(conversion_id, "excel", "default", current_user, "Arquivo Excel não encontrado", redirect)
+
+# Se definido, o scrape tem de enviar "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+def metrics_authorized(request: Request) -> bool:
+    return hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}")
 
 @app.get("/health")
-async def health():
+async def health(request: Request):
+    """Liveness pública; as estatísticas internas só com o ``METRICS_TOKEN`` (como em /metrics)."""
     db_ok = False
     err = None
     try:
@@ -631,7 +1546,40 @@ async def health():
             db_ok = True
     except Exception as e:
         err = str(e)
-    return {"ok": True, "db": db_ok, "error": err}
+    status = {"ok": True, "db": db_ok, "error": err}
+    if not METRICS_TOKEN or not metrics_authorized(request):
+        return status
+    return {
+        **status,
+        "user_cache": user_cache.stats(),
+        "password_hashing": password_hasher.stats(),
+        "llm": llm_client.stats(),
+        "progress": progress_broker.stats(),
+        "storage": storage.name,
+        "retention": retention_sweeper.stats(),
+        "executors": executors.stats(),
+        "categorization": categorization_stats(),
+    }
+
+# Estatísticas que já existem noutros módulos, expostas também em /metrics
+metrics_registry.register_stats("user_cache", user_cache.stats)
+metrics_registry.register_stats("extraction_cache", lambda: extraction_cache.stats)
+metrics_registry.register_stats("password_hashing", password_hasher.stats)
+metrics_registry.register_stats("llm_client", llm_client.stats)
+metrics_registry.register_stats("progress", progress_broker.stats)
+metrics_registry.register_stats("retention", lambda: retention_sweeper.stats())
+metrics_registry.register_stats("executors", executors.stats)
+metrics_registry.register_stats("categorization", categorization_stats)
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if METRICS_TOKEN and not metrics_authorized(request):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    try:
+        conversion_job_queue_depth.set(await job_queue.depth())
+    except Exception as e:
+        logging.warning(f"Não foi possível ler a profundidade da fila: {str(e)}")
+    return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 # Include router & middleware
 app.include_router(api_router)
@@ -644,6 +1592,14 @@ origins = [
     "http://localhost:3000",
 ]
 
+# Limite do corpo dos uploads à frente do FastAPI, que lê o multipart antes do handler
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/api/conversions/upload": MAX_UPLOAD_BYTES,
+        "/api/conversions/batch": MAX_BATCH_UPLOAD_BYTES,
+    },
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -651,10 +1607,74 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    ProfilingMiddleware,
+    directory=UPLOAD_DIR / "profiles",
+    enabled=os.environ.get("PROFILING_ENABLED", "false").lower() == "true",
+    interval=float(os.environ.get("PROFILING_INTERVAL_SECONDS", "0.005")),
+    token=METRICS_TOKEN,
+)
+app.add_middleware(
+    MetricsMiddleware,
+    requests=http_requests_total,
+    duration=http_request_duration,
+    in_flight=http_requests_in_flight,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+worker_pool: Optional[ConversionWorkerPool] = None
+
+async def invalidate_exports(conversion: Dict):
+    """Apaga as exportações de uma conversão (e do seu lote); são geradas de novo no próximo download."""
+    keys = [conversion["id"]]
+    if conversion.get("batch_id"):
+        keys += [f"batch-{conversion['batch_id']}-{layout}" for layout in ("sheets", "merged")]
+    for key in keys:
+        for name in export_cache.variant_names(key):
+            await storage.delete(export_key(name))
+        export_cache.invalidate(key)
+
+async def purge_conversion_files(conversion: Dict):
+    """Apaga o PDF e as exportações de uma conversão expirada (os dados ficam no MongoDB)."""
+    await storage.delete(upload_key(conversion["id"]))
+    # PDFs gravados diretamente em UPLOAD_DIR antes do storage
+    (UPLOAD_DIR / f"{conversion['id']}.pdf").unlink(missing_ok=True)
+    await invalidate_exports(conversion)
+
+# Apaga os ficheiros das conversões cujo prazo de retenção (por plano) terminou
+retention_sweeper = RetentionSweeper(
+    db.conversions,
+    db.subscriptions,
+    purge_conversion_files,
+    RETENTION_DAYS,
+    interval_seconds=RETENTION_SWEEP_INTERVAL_SECONDS,
+)
+
+@app.on_event("startup")
+async def start_conversion_workers():
+    global worker_pool
+    executors.install(asyncio.get_running_loop())
+    await ensure_indexes(db)
+    await job_queue.ensure_indexes()
+    await extraction_cache.ensure_indexes()
+    await transaction_store.ensure_indexes()
+    asyncio.create_task(migrate_legacy_conversions())
+    if RETENTION_SWEEP_INTERVAL_SECONDS > 0:
+        retention_sweeper.start()
+    if CONVERSION_WORKERS > 0:
+        worker_pool = ConversionWorkerPool(
+            job_queue, process_conversion_job, fail_conversion_job, concurrency=CONVERSION_WORKERS
+        )
+        worker_pool.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if worker_pool is not None:
+        await worker_pool.stop()
+    await retention_sweeper.stop()
+    # Depois dos workers: deixa terminar as exportações e escritas já submetidas
+    await executors.shutdown()
+    password_hasher.shutdown()
     client.close()
@@ -0,0 +1,135 @@
+"""Orçamento de arranque a frio: tempo de import, primeiro pedido e memória.
+
+    cd backend && python startup_budget.py
+    cd backend && python startup_budget.py --runs 5 --max-import-ms 800 --max-rss-mb 80
+    cd backend && python startup_budget.py --importtime 15    # módulos mais lentos a importar
+
+Cada medição corre num interpretador novo (como um worker acabado de
+arrancar): importa ``server``, faz o primeiro pedido em processo
+(``GET /api/subscriptions/plans``, que não usa o MongoDB) e mede a memória
+máxima (RSS). O ``startup`` da app (índices, workers) não entra, porque
+depende da latência do MongoDB.
+
+Termina com código 1 se algum limite for ultrapassado ou se um dos módulos
+de ``LAZY_MODULES`` for carregado logo no import.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+BACKEND_DIR = Path(__file__).parent
+
+# Só devem ser importados no primeiro uso (exportação, PDFs, passwords, S3).
+# O bcrypt não está na lista: o PyJWT importa o cryptography, cujo módulo
+# ssh carrega o bcrypt logo no import; o passlib (hashing) continua lazy.
+LAZY_MODULES = ("pandas", "numpy", "openpyxl", "pypdf", "passlib", "boto3")
+
+PROBE = """
+import asyncio, json, resource, sys, time
+t0 = time.perf_counter()
+import server
+t1 = time.perf_counter()
+lazy_loaded = [m for m in {lazy!r} if m in sys.modules]
+import httpx
+
+async def first_request():
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://budget") as client:
+        response = await client.get("/api/subscriptions/plans")
+        response.raise_for_status()
+
+asyncio.run(first_request())
+t2 = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (t1 - t0) * 1000,
+    "first_request_ms": (t2 - t0) * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "lazy_loaded": lazy_loaded,
+}}))
+"""
+
+
+def probe_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    # O cliente Motor não liga ao servidor no import, por isso basta um URL válido
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "startup_budget")
+    env.setdefault("CONVERSION_WORKERS", "0")
+    return env
+
+
+def run_probe() -> Dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(lazy=LAZY_MODULES)],
+        cwd=BACKEND_DIR, env=probe_env(), capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(limit: int) -> List[str]:
+    """Linhas de ``-X importtime`` com maior tempo acumulado."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=probe_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:      1234 |      5678 |   modulo"
+        self_us, cumulative_us, name = [part.strip() for part in line.split(":", 1)[1].split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    return [f"  {cum / 1000:8.1f} ms  {own / 1000:8.1f} ms  {name}" for cum, own, name in rows[:limit]]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Orçamento de arranque a frio do backend")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-first-request-ms", type=float, default=None)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="mostra os N módulos mais lentos a importar")
+    args = parser.parse_args(argv)
+
+    runs = [run_probe() for _ in range(max(1, args.runs))]
+    medians = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ("import_ms", "first_request_ms", "rss_mb")
+    }
+    lazy_loaded = sorted({m for run in runs for m in run["lazy_loaded"]})
+
+    print(f"Arranque a frio ({len(runs)} execuções, mediana)")
+    print(f"  import server            {medians['import_ms']:8.1f} ms")
+    print(f"  até ao primeiro pedido   {medians['first_request_ms']:8.1f} ms")
+    print(f"  RSS máximo               {medians['rss_mb']:8.1f} MB")
+    print(f"  módulos pesados no import: {', '.join(lazy_loaded) or 'nenhum'}")
+
+    if args.importtime:
+        print("\nMódulos mais lentos (acumulado, próprio)")
+        print("\n".join(slowest_imports(args.importtime)))
+
+    failures = []
+    limits = (
+        ("import_ms", args.max_import_ms, "ms"),
+        ("first_request_ms", args.max_first_request_ms, "ms"),
+        ("rss_mb", args.max_rss_mb, "MB"),
+    )
+    for key, limit, unit in limits:
+        if limit is not None and medians[key] > limit:
+            failures.append(f"{key} = {medians[key]:.1f} {unit} (limite {limit:g} {unit})")
+    if lazy_loaded:
+        failures.append(f"módulos que deviam ser lazy carregados no import: {', '.join(lazy_loaded)}")
+    for failure in failures:
+        print(f"FALHOU: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
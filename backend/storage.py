@@ -0,0 +1,190 @@
+"""Armazenamento dos ficheiros da aplicação (PDFs enviados e exportações).
+
+Dois backends com a mesma interface:
+
+- ``LocalStorage``: diretório local (por omissão ``UPLOAD_DIR/artifacts``).
+  Só serve uma instância; os downloads passam pela app.
+- ``S3Storage``: bucket S3 ou compatível (MinIO, R2...). Partilhado por
+  todas as instâncias; os downloads são feitos por URL pré-assinado, sem
+  passar pela app.
+
+As chaves são caminhos relativos (``uploads/<id>.pdf``,
+``exports/<id>.csv``). As chamadas ao boto3 são bloqueantes e correm em
+``asyncio.to_thread``.
+"""
+import asyncio
+import importlib.util
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+# O boto3 é pesado de importar: só é carregado quando se cria um S3Storage
+HAS_BOTO3 = importlib.util.find_spec("boto3") is not None
+
+
+def upload_key(conversion_id: str) -> str:
+    return f"uploads/{conversion_id}.pdf"
+
+
+def export_key(name: str) -> str:
+    """Chave de uma exportação a partir do nome do ficheiro na ``ExportCache``."""
+    return f"exports/{name}"
+
+
+class ArtifactStorage:
+    name = "base"
+    # True se ``presigned_url`` devolver URLs de download direto
+    presigned = False
+
+    async def put_file(self, key: str, path: Path, move: bool = False, content_type: Optional[str] = None):
+        """Guarda ``path`` em ``key``; com ``move`` o ficheiro local deixa de existir."""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        """Caminho local com o conteúdo de ``key``, válido dentro do bloco ``async with``."""
+        raise NotImplementedError
+        yield
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    def presigned_url(self, key: str, filename: str, content_type: str) -> Optional[str]:
+        return None
+
+
+class LocalStorage(ArtifactStorage):
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Chave inválida: {key}")
+        return path
+
+    async def put_file(self, key: str, path: Path, move: bool = False, content_type: Optional[str] = None):
+        dest = self.path_for(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            await asyncio.to_thread(shutil.move, str(path), dest)
+        else:
+            await asyncio.to_thread(shutil.copyfile, path, dest)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        path = self.path_for(key)
+        if not path.exists():
+            raise FileNotFoundError(key)
+        yield path
+
+    async def exists(self, key: str) -> bool:
+        return self.path_for(key).exists()
+
+    async def delete(self, key: str):
+        self.path_for(key).unlink(missing_ok=True)
+
+
+class S3Storage(ArtifactStorage):
+    name = "s3"
+    presigned = True
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        presign_seconds: int = 300,
+        scratch_dir: Optional[Path] = None,
+        client=None,
+    ):
+        if client is None and not HAS_BOTO3:
+            raise RuntimeError("STORAGE_BACKEND=s3 requer o pacote boto3")
+        from botocore.exceptions import ClientError  # type: ignore
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.presign_seconds = presign_seconds
+        self.scratch_dir = scratch_dir
+        self._client_error = ClientError
+        if client is None:
+            import boto3  # type: ignore
+
+            client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+        self._client = client
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    async def put_file(self, key: str, path: Path, move: bool = False, content_type: Optional[str] = None):
+        extra = {"ContentType": content_type} if content_type else None
+        await asyncio.to_thread(self._client.upload_file, str(path), self.bucket, self._key(key), ExtraArgs=extra)
+        if move:
+            Path(path).unlink(missing_ok=True)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        fd, tmp = tempfile.mkstemp(suffix=Path(key).suffix, dir=self.scratch_dir)
+        os.close(fd)
+        path = Path(tmp)
+        try:
+            try:
+                await asyncio.to_thread(self._client.download_file, self.bucket, self._key(key), tmp)
+            except self._client_error as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    raise FileNotFoundError(key) from e
+                raise
+            yield path
+        finally:
+            path.unlink(missing_ok=True)
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self._client.head_object, Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._client.delete_object, Bucket=self.bucket, Key=self._key(key))
+
+    def presigned_url(self, key: str, filename: str, content_type: str) -> Optional[str]:
+        # Só assina localmente (sem pedido à rede)
+        return self._client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._key(key),
+                "ResponseContentDisposition": f'attachment; filename="{filename}"',
+                "ResponseContentType": content_type,
+            },
+            ExpiresIn=self.presign_seconds,
+        )
+
+
+def build_storage(name: str, local_root: Path, scratch_dir: Optional[Path] = None) -> ArtifactStorage:
+    """Backend a partir de ``STORAGE_BACKEND`` (``local`` ou ``s3``) e das variáveis ``S3_*``."""
+    if name == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", ""),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+            region=os.environ.get("S3_REGION"),
+            presign_seconds=int(os.environ.get("S3_PRESIGN_SECONDS", "300")),
+            scratch_dir=scratch_dir,
+        )
+    if name == "local":
+        return LocalStorage(local_root)
+    raise ValueError(f"STORAGE_BACKEND desconhecido: {name}")
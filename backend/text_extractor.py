@@ -0,0 +1,194 @@
+"""Extração determinística a partir da camada de texto do PDF.
+
+Muitos extratos portugueses são PDFs gerados digitalmente, com texto
+selecionável. Para os bancos com layout conhecido lemos as linhas de
+movimento diretamente (data, descrição, valor, saldo) e devolvemos o mesmo
+JSON que o LLM (``banco``, ``periodo``, ``saldo_inicial``, ``saldo_final``,
+``transacoes``). O resultado só é aceite se os saldos reconciliarem linha a
+linha; caso contrário devolvemos ``None`` e o pipeline recorre ao LLM.
+"""
+import logging
+import re
+import unicodedata
+from datetime import date
+from typing import Dict, List, Optional
+
+from pdf_tools import HAS_PYPDF
+
+logger = logging.getLogger(__name__)
+
+_AMOUNT = r"-?\d{1,3}(?:[.\s]\d{3})*,\d{2}-?"
+_DMY = r"\d{2}[./-]\d{2}[./-]\d{4}"
+_DM = r"\d{2}[./-]\d{2}"
+_YMD = r"\d{4}-\d{2}-\d{2}"
+
+# Definição dos layouts por banco. ``movimento`` tem de ter os grupos
+# data/descricao/valor/saldo; o tipo (débito/crédito) deduz-se da variação
+# do saldo, porque a coluna do valor perde-se na camada de texto.
+BANK_LAYOUTS: Dict[str, Dict] = {
+    "millennium": {
+        "aliases": ("millennium", "millennium bcp", "bcp"),
+        "movimento": re.compile(
+            rf"^(?P<data>{_DM})\s+(?:{_DM}\s+)?(?P<descricao>.+?)\s+(?P<valor>{_AMOUNT})\s+(?P<saldo>{_AMOUNT})$"
+        ),
+        "saldo_inicial": re.compile(rf"SALDO\s+(?:INICIAL|ANTERIOR)\s+(?P<valor>{_AMOUNT})", re.I),
+        "saldo_final": re.compile(rf"SALDO\s+FINAL\s+(?P<valor>{_AMOUNT})", re.I),
+        "periodo": re.compile(rf"(?P<inicio>{_DMY}|{_YMD})\s+(?:A|ATÉ|-)\s+(?P<fim>{_DMY}|{_YMD})", re.I),
+        "conta": re.compile(r"CONTA\s+(?:N\.?º\s*)?(?P<conta>\d[\d ]{6,})", re.I),
+    },
+    "caixa geral": {
+        "aliases": ("caixa geral", "caixa geral de depositos", "cgd", "caixa"),
+        "movimento": re.compile(
+            rf"^(?P<data>{_DMY})\s+(?:{_DMY}\s+)?(?P<descricao>.+?)\s+(?P<valor>{_AMOUNT})\s+(?P<saldo>{_AMOUNT})$"
+        ),
+        "saldo_inicial": re.compile(rf"SALDO\s+(?:INICIAL|ANTERIOR|CONTABIL[IÍ]STICO\s+INICIAL)\s+(?P<valor>{_AMOUNT})", re.I),
+        "saldo_final": re.compile(rf"SALDO\s+(?:FINAL|CONTABIL[IÍ]STICO\s+FINAL)\s+(?P<valor>{_AMOUNT})", re.I),
+        "periodo": re.compile(rf"PER[IÍ]ODO\s*:?\s*(?P<inicio>{_DMY})\s+(?:A|-)\s+(?P<fim>{_DMY})", re.I),
+        "conta": re.compile(r"CONTA\s*:?\s*(?P<conta>\d[\d ]{6,})", re.I),
+    },
+    "novo banco": {
+        "aliases": ("novo banco", "novobanco", "nb"),
+        "movimento": re.compile(
+            rf"^(?P<data>{_DMY}|{_YMD})\s+(?:(?:{_DMY}|{_YMD})\s+)?(?P<descricao>.+?)\s+(?P<valor>{_AMOUNT})\s+(?P<saldo>{_AMOUNT})$"
+        ),
+        "saldo_inicial": re.compile(rf"SALDO\s+(?:INICIAL|ANTERIOR)\s+(?P<valor>{_AMOUNT})", re.I),
+        "saldo_final": re.compile(rf"SALDO\s+(?:FINAL|ATUAL)\s+(?P<valor>{_AMOUNT})", re.I),
+        "periodo": re.compile(rf"(?P<inicio>{_DMY}|{_YMD})\s+(?:A|ATÉ|-)\s+(?P<fim>{_DMY}|{_YMD})", re.I),
+        "conta": re.compile(r"(?:CONTA|N\.?º\s+CONTA)\s*:?\s*(?P<conta>\d[\d .]{6,})", re.I),
+    },
+    "santander": {
+        "aliases": ("santander", "santander totta"),
+        "movimento": re.compile(
+            rf"^(?P<data>{_DMY})\s+(?:{_DMY}\s+)?(?P<descricao>.+?)\s+(?P<valor>{_AMOUNT})\s+(?P<saldo>{_AMOUNT})$"
+        ),
+        "saldo_inicial": re.compile(rf"SALDO\s+(?:INICIAL|ANTERIOR)\s+(?P<valor>{_AMOUNT})", re.I),
+        "saldo_final": re.compile(rf"SALDO\s+FINAL\s+(?P<valor>{_AMOUNT})", re.I),
+        "periodo": re.compile(rf"(?P<inicio>{_DMY})\s+(?:A|ATÉ|-)\s+(?P<fim>{_DMY})", re.I),
+        "conta": re.compile(r"CONTA\s*:?\s*(?P<conta>\d[\d ]{6,})", re.I),
+    },
+}
+
+# Um extrato "digital" tem bastante texto por página; scans não têm nenhum
+MIN_TEXT_CHARS_PER_PAGE = 200
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).strip().lower()
+
+
+def resolve_layout(bank_name: str) -> Optional[Dict]:
+    name = _normalize(bank_name)
+    for layout in BANK_LAYOUTS.values():
+        if name in layout["aliases"]:
+            return layout
+    return None
+
+
+def parse_pt_amount(raw: str) -> float:
+    """'1.234,56' / '1 234,56' / '-25,30' / '25,30-' -> float."""
+    raw = raw.strip()
+    negative = raw.startswith("-") or raw.endswith("-")
+    value = float(raw.strip("-").replace(".", "").replace(" ", "").replace(",", "."))
+    return -value if negative else value
+
+
+def _parse_date(raw: str, default_year: Optional[int]) -> date:
+    parts = re.split(r"[./-]", raw)
+    if len(parts[0]) == 4:
+        return date(int(parts[0]), int(parts[1]), int(parts[2]))
+    if len(parts) == 3:
+        return date(int(parts[2]), int(parts[1]), int(parts[0]))
+    if default_year is None:
+        raise ValueError("date without year")
+    return date(default_year, int(parts[1]), int(parts[0]))
+
+
+def read_text_layer(file_path: str) -> Optional[str]:
+    """Texto do PDF, ou None se não houver camada de texto útil (ex.: scans)."""
+    if not HAS_PYPDF:
+        return None
+    from pypdf import PdfReader  # type: ignore
+
+    reader = PdfReader(file_path)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    text = "\n".join(pages)
+    if len(text.strip()) < MIN_TEXT_CHARS_PER_PAGE * max(1, len(pages)) // 2:
+        return None
+    return text
+
+
+def parse_statement(text: str, layout: Dict, bank_name: str) -> Optional[Dict]:
+    """Aplica o layout ao texto; devolve None se nada bater certo."""
+    periodo = layout["periodo"].search(text)
+    inicio = fim = None
+    if periodo:
+        inicio = _parse_date(periodo.group("inicio"), None)
+        fim = _parse_date(periodo.group("fim"), None)
+
+    saldo_inicial_match = layout["saldo_inicial"].search(text)
+    saldo_final_match = layout["saldo_final"].search(text)
+    if not saldo_inicial_match or not saldo_final_match:
+        return None
+    saldo_inicial = parse_pt_amount(saldo_inicial_match.group("valor"))
+    saldo_final = parse_pt_amount(saldo_final_match.group("valor"))
+
+    transacoes: List[Dict] = []
+    saldo = saldo_inicial
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        match = layout["movimento"].match(line)
+        if not match or re.match(r"SALDO\b", match.group("descricao"), re.I):
+            continue
+
+        data = _parse_date(match.group("data"), fim.year if fim else None)
+        if fim and data > fim:
+            # Extrato que atravessa o ano (ex.: dezembro em extrato de janeiro)
+            data = data.replace(year=data.year - 1)
+
+        valor = abs(parse_pt_amount(match.group("valor")))
+        novo_saldo = parse_pt_amount(match.group("saldo"))
+        delta = round(novo_saldo - saldo, 2)
+        if abs(abs(delta) - valor) > 0.005:
+            logger.info(f"Layout {bank_name}: saldo não reconcilia na linha '{line}'")
+            return None
+        saldo = novo_saldo
+        transacoes.append({
+            "data": data.strftime("%d/%m/%Y"),
+            "descricao": match.group("descricao").strip(),
+            "valor": valor,
+            "tipo": "crédito" if delta > 0 else "débito",
+            "categoria_fiscal": None,
+        })
+
+    if not transacoes or abs(saldo - saldo_final) > 0.005:
+        return None
+
+    if inicio is None:
+        inicio = _parse_date(transacoes[0]["data"], None)
+        fim = _parse_date(transacoes[-1]["data"], None)
+    conta = layout["conta"].search(text)
+    return {
+        "banco": bank_name,
+        "conta": "".join(conta.group("conta").split()) if conta else None,
+        "periodo": f"{inicio.strftime('%d/%m/%Y')} - {fim.strftime('%d/%m/%Y')}",
+        "saldo_inicial": saldo_inicial,
+        "saldo_final": saldo_final,
+        "transacoes": transacoes,
+        "origem": "texto",
+    }
+
+
+def extract_from_text_layer(file_path: str, bank_name: str) -> Optional[Dict]:
+    """Caminho rápido sem LLM. Função síncrona (pypdf); chamar fora do event loop."""
+    layout = resolve_layout(bank_name)
+    if layout is None:
+        return None
+    try:
+        text = read_text_layer(file_path)
+        if text is None:
+            return None
+        return parse_statement(text, layout, bank_name)
+    except Exception as e:
+        logger.warning(f"Extração local falhou para {bank_name}: {str(e)}")
+        return None
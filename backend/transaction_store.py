@@ -0,0 +1,74 @@
+"""Transações das conversões guardadas fora do documento da conversão.
+
+Cada conversão tem os movimentos repartidos em lotes de ``batch_size`` linhas
+na coleção ``conversion_transactions`` (um documento por lote, com ``seq``
+crescente). O documento da conversão fica só com metadados e resumo, por
+isso nunca se aproxima do limite de 16 MB do MongoDB, e ler uma conversão
+já não arrasta todas as transações.
+
+A leitura é feita lote a lote (``iter_batches``), o que permite exportar
+extratos de dezenas de milhares de linhas sem os carregar de uma vez.
+
+Gravar de novo (nova tentativa, migração) não apaga nada antes do tempo:
+``save`` escreve os lotes numa nova geração, com ``seq`` a seguir aos
+existentes, e devolve-a. Quem chama guarda a geração na conversão (é essa
+que as leituras usam) e só depois chama ``prune`` para apagar as
+anteriores. Até lá os leitores continuam a ver o extrato antigo completo, e
+se a escrita falhar a meio este fica intacto. Os lotes gravados antes das
+gerações não têm o campo e correspondem a ``generation=None``.
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING
+
+
+class TransactionStore:
+    def __init__(self, collection, batch_size: int = 1000):
+        self.collection = collection
+        self.batch_size = batch_size
+
+    async def ensure_indexes(self):
+        await self.collection.create_index(
+            [("conversion_id", ASCENDING), ("seq", ASCENDING)], unique=True, name="conversion_seq_unique"
+        )
+
+    async def save(self, conversion_id: str, transactions: List[Dict[str, Any]]) -> int:
+        """Grava as transações numa nova geração, sem tocar nas anteriores, e devolve-a."""
+        last = await self.collection.find_one(
+            {"conversion_id": conversion_id}, {"_id": 0, "seq": 1}, sort=[("seq", DESCENDING)]
+        )
+        generation = last["seq"] + 1 if last else 0
+        batches = [
+            {
+                "conversion_id": conversion_id,
+                "generation": generation,
+                "seq": generation + i,
+                "rows": transactions[start:start + self.batch_size],
+            }
+            for i, start in enumerate(range(0, len(transactions), self.batch_size))
+        ]
+        if batches:
+            await self.collection.insert_many(batches)
+        return generation
+
+    async def prune(self, conversion_id: str, generation: int):
+        """Apaga as gerações que não sejam ``generation`` (depois de a conversão passar a usá-la)."""
+        await self.collection.delete_many({"conversion_id": conversion_id, "generation": {"$ne": generation}})
+
+    async def iter_batches(
+        self, conversion_id: str, generation: Optional[int] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        cursor = self.collection.find(
+            {"conversion_id": conversion_id, "generation": generation}, {"_id": 0, "rows": 1}
+        ).sort("seq", ASCENDING)
+        async for batch in cursor:
+            yield batch["rows"]
+
+    async def load(self, conversion_id: str, generation: Optional[int] = None) -> List[Dict[str, Any]]:
+        transactions: List[Dict[str, Any]] = []
+        async for rows in self.iter_batches(conversion_id, generation):
+            transactions.extend(rows)
+        return transactions
+
+    async def delete(self, conversion_id: str):
+        await self.collection.delete_many({"conversion_id": conversion_id})
@@ -0,0 +1,210 @@
+"""Ingestão de uploads em streaming, com memória limitada a um bloco."""
+import asyncio
+import hashlib
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+PDF_MAGIC = b"%PDF-"
+# A especificação tolera lixo antes do cabeçalho, dentro dos primeiros 1024 bytes
+PDF_MAGIC_WINDOW = 1024
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+# Cabeçalhos e fronteiras do multipart, além do conteúdo dos ficheiros
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    """Middleware ASGI que limita o corpo dos pedidos de upload antes de o FastAPI o ler.
+
+    Com ``UploadFile = File(...)`` o FastAPI lê e guarda o multipart inteiro
+    antes de correr o handler e as dependências, por isso o limite tem de
+    ficar à frente da app. ``limits`` associa caminhos a tamanhos máximos:
+
+    - sem ``Authorization`` a resposta é 403 sem ler o corpo (é o que o
+      ``HTTPBearer`` responderia, mas só depois de receber o upload);
+    - com ``Content-Length`` acima do limite, 413 sem ler o corpo;
+    - sem ``Content-Length`` (chunked) ou com um valor falso, os bytes são
+      contados à medida que chegam e a leitura pára no limite com 413.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope.get("path", "")) if scope["type"] == "http" else None
+        if max_bytes is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not headers.get(b"authorization", b"").lower().startswith(b"bearer "):
+            await JSONResponse({"detail": "Not authenticated"}, status_code=403)(scope, receive, send)
+            return
+        limit = max_bytes + MULTIPART_OVERHEAD
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await _too_large(max_bytes)(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # A app vê um cliente desligado e o resto do corpo nunca é lido
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                # A resposta da app (400 de parsing) é trocada pelo 413
+                if not response_started:
+                    response_started = True
+                    await _too_large(max_bytes)(scope, receive, send)
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # ``ClientDisconnect`` de quem lê o corpo diretamente
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await _too_large(max_bytes)(scope, receive, send)
+
+
+def _too_large(max_bytes: int) -> JSONResponse:
+    return JSONResponse({"detail": too_large_message(max_bytes)}, status_code=413)
+
+
+def too_large_message(max_bytes: int) -> str:
+    return f"Ficheiro demasiado grande. O máximo permitido é {max_bytes // (1024 * 1024)} MB."
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def stream_upload_to_disk(
+    upload: UploadFile,
+    dest: Path,
+    max_bytes: int,
+    chunk_size: int = 64 * 1024,
+    allow_zip: bool = False,
+) -> Tuple[str, int]:
+    """Copia o upload para ``dest`` bloco a bloco, calculando SHA-256 e tamanho.
+
+    Lança 400 se não for um PDF (ou ZIP, com ``allow_zip``) e 413 se exceder
+    ``max_bytes``; em caso de erro o ficheiro parcial é apagado.
+    """
+    chunk_size = max(chunk_size, PDF_MAGIC_WINDOW)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest, "wb") as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                if size == 0 and PDF_MAGIC not in chunk[:PDF_MAGIC_WINDOW]:
+                    if not (allow_zip and chunk.startswith(ZIP_MAGIC)):
+                        detail = "não é um PDF nem um ZIP válido" if allow_zip else "não é um PDF válido"
+                        raise HTTPException(status_code=400, detail=f"O ficheiro enviado {detail}.")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=too_large_message(max_bytes))
+                # Hash e escrita numa thread: com blocos grandes não bloqueiam o event loop
+                await asyncio.to_thread(_write_chunk, out, digest, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="O ficheiro enviado está vazio.")
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return digest.hexdigest(), size
+
+
+def is_zip_file(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(ZIP_MAGIC)) == ZIP_MAGIC
+
+
+def extract_pdfs_from_zip(
+    zip_path: Path,
+    out_dir: Path,
+    max_files: int,
+    max_bytes: int,
+    max_total_bytes: Optional[int] = None,
+    chunk_size: int = 64 * 1024,
+) -> List[Tuple[str, Path, str, int]]:
+    """Extrai os PDFs de um ZIP para ``out_dir`` (bloqueante).
+
+    Devolve ``(nome, caminho, sha256, tamanho)`` por PDF, pela ordem do
+    arquivo. Outros ficheiros são ignorados. Os tamanhos são contados ao
+    extrair (não se confia no cabeçalho do ZIP), por isso um ZIP bomb pára
+    em ``max_bytes`` por PDF ou ``max_total_bytes`` no total. Em caso de
+    erro nada fica em disco.
+    """
+    extracted: List[Tuple[str, Path, str, int]] = []
+    total = 0
+    try:
+        try:
+            archive = zipfile.ZipFile(zip_path)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="O ficheiro ZIP está corrompido.")
+        with archive:
+            for info in archive.infolist():
+                name = info.filename.rsplit("/", 1)[-1]
+                if info.is_dir() or info.filename.startswith("__MACOSX/") or name.startswith("."):
+                    continue
+                if not name.lower().endswith(".pdf"):
+                    continue
+                if len(extracted) >= max_files:
+                    raise HTTPException(status_code=400, detail=f"O ZIP tem mais de {max_files} PDFs.")
+                if info.file_size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{name}: {too_large_message(max_bytes)}")
+
+                dest = out_dir / f"{uuid.uuid4()}.pdf"
+                digest = hashlib.sha256()
+                size = 0
+                extracted.append((name, dest, "", 0))
+                with archive.open(info) as src, open(dest, "wb") as out:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        if size == 0 and PDF_MAGIC not in chunk[:PDF_MAGIC_WINDOW]:
+                            raise HTTPException(status_code=400, detail=f"{name} não é um PDF válido.")
+                        size += len(chunk)
+                        total += len(chunk)
+                        if size > max_bytes:
+                            raise HTTPException(status_code=413, detail=f"{name}: {too_large_message(max_bytes)}")
+                        if max_total_bytes is not None and total > max_total_bytes:
+                            raise HTTPException(status_code=413, detail=too_large_message(max_total_bytes))
+                        digest.update(chunk)
+                        out.write(chunk)
+                if size == 0:
+                    raise HTTPException(status_code=400, detail=f"{name} está vazio.")
+                extracted[-1] = (name, dest, digest.hexdigest(), size)
+    except BaseException:
+        for _, path, _, _ in extracted:
+            path.unlink(missing_ok=True)
+        raise
+    return extracted
@@ -0,0 +1,44 @@
+"""Cache TTL dos utilizadores autenticados, à frente de ``db.users``.
+
+Evita um ``find_one`` por cada pedido autenticado. As entradas expiram ao fim
+de ``ttl_seconds``; quem alterar um utilizador deve chamar ``invalidate`` (a
+invalidação é local ao processo, por isso o TTL limita a desatualização nos
+restantes workers).
+"""
+import copy
+from typing import Dict, Optional
+
+from cachetools import TTLCache
+
+
+class UserCache:
+    def __init__(self, maxsize: int = 10000, ttl_seconds: float = 60.0):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        user = self._cache.get(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.copy(user)
+
+    def set(self, user_id: str, user: Dict):
+        self._cache[user_id] = copy.copy(user)
+
+    def invalidate(self, user_id: str):
+        self._cache.pop(user_id, None)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "ttl_seconds": self._cache.ttl,
+        }
@@ -0,0 +1,50 @@
+"""Processo dedicado a consumir a fila de conversões, sem servidor HTTP.
+
+Uso: ``cd backend && python worker.py --concurrency 4``
+
+Permite escalar a extração separadamente do serviço web; nesse caso o serviço
+web deve correr com ``CONVERSION_WORKERS=0``.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+
+import server
+from jobs import ConversionWorkerPool
+
+
+async def main(concurrency: int):
+    # Como no arranque do servidor (start_conversion_workers), sem HTTP nem limpeza de ficheiros
+    server.executors.install(asyncio.get_running_loop())
+    await server.ensure_indexes(server.db)
+    await server.job_queue.ensure_indexes()
+    await server.extraction_cache.ensure_indexes()
+    await server.transaction_store.ensure_indexes()
+    pool = ConversionWorkerPool(
+        server.job_queue,
+        server.process_conversion_job,
+        server.fail_conversion_job,
+        concurrency=concurrency,
+    )
+    pool.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logging.info("A terminar workers de conversão...")
+    await pool.stop()
+    # Depois dos workers: deixa terminar o trabalho já submetido aos pools
+    await server.executors.shutdown()
+    server.password_hasher.shutdown()
+    server.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker da fila de conversões")
+    parser.add_argument("--concurrency", type=int, default=max(1, server.CONVERSION_WORKERS))
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))
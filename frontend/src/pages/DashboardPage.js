@@ -16,6 +16,9 @@ const DashboardPage = ({ user, onLogout }) => {
   const navigate = useNavigate();
   const [subscription, setSubscription] = useState(null);
   const [conversions, setConversions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [liveExtraction, setLiveExtraction] = useState(null);
   const [uploading, setUploading] = useState(false);
   const [selectedBank, setSelectedBank] = useState('Millennium');
   const [loading, setLoading] = useState(true);
@@ -35,7 +38,8 @@ const DashboardPage = ({ user, onLogout }) => {
       ]);
 
       setSubscription(subResponse.data);
-      setConversions(convResponse.data);
+      setConversions(convResponse.data.items);
+      setNextCursor(convResponse.data.next_cursor);
     } catch (error) {
       toast.error('Erro ao carregar dados');
     } finally {
@@ -43,10 +47,142 @@ const DashboardPage = ({ user, onLogout }) => {
     }
   };
 
+  const loadMoreConversions = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/conversions`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { cursor: nextCursor }
+      });
+      setConversions((prev) => [...prev, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error('Erro ao carregar conversões');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Lê o stream SSE com fetch (o EventSource não permite o header Authorization)
+  const streamConversionEvents = async (conversionId) => {
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${API}/conversions/${conversionId}/events`, {
+      headers: { Authorization: `Bearer ${token}` }
+    });
+    if (!response.ok || !response.body) {
+      throw new Error('Erro ao acompanhar a conversão');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) return null;
+      buffer += decoder.decode(value, { stream: true });
+
+      let separator;
+      while ((separator = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, separator);
+        buffer = buffer.slice(separator + 2);
+        let event = 'message';
+        let data = '';
+        raw.split('\n').forEach((line) => {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) data += line.slice(5).trim();
+        });
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        if (event === 'started') {
+          setLiveExtraction({ count: 0, rows: [] });
+        } else if (event === 'transaction') {
+          // Só as últimas linhas ficam visíveis; o extrato completo vem no download
+          setLiveExtraction((prev) => ({
+            count: (prev?.count || 0) + 1,
+            rows: [...(prev?.rows || []).slice(-7), payload.transacao]
+          }));
+        } else if (event === 'complete') {
+          return payload;
+        } else if (event === 'error') {
+          throw new Error(payload.detail);
+        }
+      }
+    }
+  };
+
+  const isZip = (file) => /\.zip$/i.test(file.name) || file.type.includes('zip');
+
+  const waitForBatch = async (batchId) => {
+    const token = localStorage.getItem('token');
+    for (;;) {
+      const response = await axios.get(`${API}/conversions/batch/${batchId}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      const batch = response.data;
+      setLiveExtraction({ count: batch.transactions_count, rows: [], batch });
+      if (batch.status !== 'processing') return batch;
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
+  const handleBatchUpload = async (files) => {
+    const formData = new FormData();
+    files.forEach((file) => formData.append('files', file));
+
+    const token = localStorage.getItem('token');
+    const response = await axios.post(
+      `${API}/conversions/batch?bank_name=${selectedBank}`,
+      formData,
+      {
+        headers: {
+          Authorization: `Bearer ${token}`,
+          'Content-Type': 'multipart/form-data'
+        }
+      }
+    );
+    fetchData();
+    const batch = await waitForBatch(response.data.batch_id);
+    if (batch.status === 'failed') {
+      throw new Error('Nenhum extrato do lote foi convertido');
+    }
+    const message = batch.status === 'partial'
+      ? `${batch.completed} de ${batch.total} extratos convertidos`
+      : `${batch.total} extratos convertidos com sucesso!`;
+    toast.success(message, {
+      action: {
+        label: 'Excel do lote',
+        onClick: () => downloadFile(`/conversions/batch/${batch.id}/download/excel`, `lote-${batch.id.slice(0, 8)}.xlsx`)
+      }
+    });
+  };
+
   const handleFileUpload = async (e) => {
-    const file = e.target.files[0];
-    if (!file) return;
+    const files = Array.from(e.target.files);
+    if (!files.length) return;
+
+    if (files.length > 1 || isZip(files[0])) {
+      if (files.some((f) => f.type !== 'application/pdf' && !isZip(f))) {
+        toast.error('Por favor, selecione apenas arquivos PDF ou ZIP');
+        return;
+      }
+      setUploading(true);
+      try {
+        await handleBatchUpload(files);
+      } catch (error) {
+        toast.error(error.response?.data?.detail || error.message || 'Erro ao processar arquivos');
+      } finally {
+        fetchData();
+        setUploading(false);
+        setLiveExtraction(null);
+        e.target.value = '';
+      }
+      return;
+    }
 
+    const file = files[0];
     if (file.type !== 'application/pdf') {
       toast.error('Por favor, selecione um arquivo PDF');
       return;
@@ -59,7 +195,7 @@ const DashboardPage = ({ user, onLogout }) => {
     try {
       const token = localStorage.getItem('token');
       const response = await axios.post(
-        `${API}/conversions/upload?bank_name=${selectedBank}`,
+        `${API}/conversions/upload?bank_name=${selectedBank}&async_mode=true`,
         formData,
         {
           headers: {
@@ -69,31 +205,61 @@ const DashboardPage = ({ user, onLogout }) => {
         }
       );
 
-      toast.success('Conversão concluída com sucesso!');
+      let result = null;
+      if (response.status === 202) {
+        setLiveExtraction({ count: 0, rows: [] });
+        fetchData();
+        result = await streamConversionEvents(response.data.conversion_id);
+      }
+
+      const reconciliation = result?.reconciliacao;
+      if (reconciliation && !reconciliation.ok) {
+        // Índices a partir de 0 no backend; para o utilizador a primeira linha é a 1
+        const rows = (reconciliation.linhas_divergentes || []).slice(0, 5).map((i) => i + 1);
+        toast.warning(
+          'Conversão concluída, mas os saldos do extrato não batem certo' +
+            (rows.length ? ` (verifique as linhas ${rows.join(', ')})` : '') +
+            '. Confira o ficheiro antes de o usar.'
+        );
+      } else {
+        toast.success('Conversão concluída com sucesso!');
+      }
       fetchData();
     } catch (error) {
-      toast.error(error.response?.data?.detail || 'Erro ao processar arquivo');
+      toast.error(error.response?.data?.detail || error.message || 'Erro ao processar arquivo');
+      fetchData();
     } finally {
       setUploading(false);
+      setLiveExtraction(null);
       e.target.value = '';
     }
   };
 
-  const handleDownload = async (conversionId, format) => {
+  const handleDownload = (conversionId, format) =>
+    downloadFile(
+      `/conversions/${conversionId}/download/${format}`,
+      `extrato.${format === 'csv' ? 'csv' : 'xlsx'}`
+    );
+
+  const downloadFile = async (path, filename) => {
     try {
       const token = localStorage.getItem('token');
-      const response = await axios.get(
-        `${API}/conversions/${conversionId}/download/${format}`,
-        {
-          headers: { Authorization: `Bearer ${token}` },
-          responseType: 'blob'
-        }
-      );
+      // redirect=false: com armazenamento S3 a API devolve um URL pré-assinado
+      // em vez do ficheiro, e o download é feito diretamente ao bucket
+      const separator = path.includes('?') ? '&' : '?';
+      const response = await axios.get(`${API}${path}${separator}redirect=false`, {
+        headers: { Authorization: `Bearer ${token}` },
+        responseType: 'blob'
+      });
 
-      const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
-      link.href = url;
-      link.setAttribute('download', `extrato.${format === 'csv' ? 'csv' : 'xlsx'}`);
+      if ((response.headers['content-type'] || '').includes('application/json')) {
+        const { url } = JSON.parse(await response.data.text());
+        link.href = url;
+      } else {
+        link.href = window.URL.createObjectURL(new Blob([response.data]));
+        link.setAttribute('download', filename);
+      }
       document.body.appendChild(link);
       link.click();
       link.remove();
@@ -189,7 +355,8 @@ const usagePercentage = limit ? (used / limit) * 100 : 0;
                   <input
                     id="file-upload"
                     type="file"
-                    accept=".pdf"
+                    accept=".pdf,.zip"
+                    multiple
                     onChange={handleFileUpload}
                     disabled={uploading}
                     style={{ display: 'none' }}
@@ -199,8 +366,26 @@ const usagePercentage = limit ? (used / limit) * 100 : 0;
                   <p className="upload-text">
                     {uploading ? 'Processando...' : 'Clique para fazer upload do PDF'}
                   </p>
-                  <p className="upload-hint">Apenas arquivos PDF</p>
+                  <p className="upload-hint">Arquivos PDF (vários de uma vez) ou um ZIP</p>
                 </label>
+
+                {liveExtraction && (
+                  <div className="live-extraction" data-testid="live-extraction">
+                    <p className="live-extraction-count" data-testid="live-extraction-count">
+                      {liveExtraction.count} transações extraídas...
+                    </p>
+                    {liveExtraction.batch && (
+                      <p className="live-extraction-row" data-testid="live-extraction-batch">
+                        {liveExtraction.batch.completed + liveExtraction.batch.failed} de {liveExtraction.batch.total} extratos concluídos
+                      </p>
+                    )}
+                    {liveExtraction.rows.map((row, index) => (
+                      <p key={index} className="live-extraction-row">
+                        {row.data} • {row.descricao} • {row.valor}
+                      </p>
+                    ))}
+                  </div>
+                )}
               </div>
             </CardContent>
           </Card>
@@ -257,6 +442,16 @@ const usagePercentage = limit ? (used / limit) * 100 : 0;
                       )}
                     </div>
                   ))}
+                  {nextCursor && (
+                    <Button
+                      variant="outline"
+                      onClick={loadMoreConversions}
+                      disabled={loadingMore}
+                      data-testid="load-more-conversions-btn"
+                    >
+                      {loadingMore ? 'A carregar...' : 'Carregar mais'}
+                    </Button>
+                  )}
                 </div>
               )}
             </CardContent>
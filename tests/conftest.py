@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Os módulos do backend importam-se uns aos outros pelo nome (corre-se a partir de backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
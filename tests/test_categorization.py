@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from categorization import (
+    RULES_VERSION, _Automaton, backfill_categories, categorize, categorize_transactions, is_credit, merchant_start, normalize_description,
+)
+
+
+@pytest.mark.parametrize("descricao, categoria", [
+    ("COMPRA 4512 FARMÁCIA S. JOÃO 12/03", "Saúde"),
+    ("TRF SEG SOCIAL 2024", "Segurança Social"),
+    ("DD EDP COMERCIAL 123", "Serviços essenciais"),
+    ("DD NOS COMUNICACOES SA", "Serviços essenciais"),
+    ("PAG. SERV. AUTORIDADE TRIBUTÁRIA IUC", "Pagamento à AT"),
+    ("HOSPITAL VETERINARIO DO PORTO", "IVA - Veterinários"),
+    ("SEGURO SAUDE MEDIS", "Saúde"),
+    ("COMPRA 1234 REST O PESCADOR", "IVA - Restauração e alojamento"),
+    ("COMPRA CAFE CENTRAL", "IVA - Restauração e alojamento"),
+    ("CP COMBOIOS DE PORTUGAL", "IVA - Passes mensais"),
+])
+def test_categorize(descricao, categoria):
+    assert categorize(descricao) == categoria
+
+
+@pytest.mark.parametrize("descricao, categoria", [
+    ("REEMBOLSO IRS 2023", "Reembolso de IRS"),
+    ("CENTRO NACIONAL DE PENSOES SEG SOCIAL", "Pensões"),
+    ("TRF PENSAO CGA", "Pensões"),
+    ("TRF SALARIO MARCO", "Rendimentos do trabalho"),
+])
+def test_income_categories_apply_to_credits_only(descricao, categoria):
+    assert categorize(descricao, credit=True) == categoria
+    assert categorize(descricao) != categoria
+
+
+def test_debit_salary_transfer_is_not_income():
+    rows = [
+        {"descricao": "TRF SALARIO", "valor": 900.0, "tipo": "débito"},
+        {"descricao": "TRF SALARIO", "valor": 900.0, "tipo": "crédito"},
+    ]
+    categorized, _ = categorize_transactions(rows)
+    assert [row["categoria_fiscal"] for row in categorized] == [None, "Rendimentos do trabalho"]
+
+
+def test_guesthouse_purchase_is_not_a_pension():
+    assert categorize("COMPRA PENSAO ALEGRIA LISBOA") is None
+
+
+def test_is_credit_uses_tipo_then_sign():
+    assert is_credit({"tipo": "Crédito", "valor": -1})
+    assert not is_credit({"tipo": "débito", "valor": 5})
+    assert is_credit({"valor": 5.0})
+    assert not is_credit({"valor": "5"})
+    assert not is_credit({})
+
+
+@pytest.mark.parametrize("descricao", [
+    "TRF P/ MARIA NOS PAGAMENTOS",
+    "COMPRA NOS CTT",
+    "TRF P/ JOAO REST DO JANTAR",
+    "TRF MARIA CAFE",
+    "MB WAY TSU",
+    "OBRAS REFORMA COZINHA",
+    "LEVANTAMENTO MB",
+    "",
+])
+def test_ambiguous_words_do_not_categorize(descricao):
+    assert categorize(descricao) is None
+
+
+def test_normalize_description_drops_accents_punctuation_and_numbers():
+    assert normalize_description("Compra 1234 Farmácia S. João 12/03") == ("COMPRA", "FARMACIA", "S", "JOAO")
+
+
+def test_merchant_start_skips_operation_words():
+    assert merchant_start(("COMPRA", "MB", "REST", "O")) == 2
+    assert merchant_start(("COMPRA",)) == 1
+
+
+def test_longest_pattern_wins_and_ties_go_to_rule_order():
+    automaton = _Automaton((
+        ("A", ("X Y Z", "Y")),
+        ("B", ("X Y", "Z W", "Q")),
+    ))
+    assert automaton.best(("X", "Y", "Z")) == "A"    # 3 palavras
+    assert automaton.best(("X", "Y")) == "B"         # 2 palavras vencem "Y"
+    assert automaton.best(("Y", "Q")) == "A"         # empate: regra anterior
+    assert automaton.best(("X", "Z", "W")) == "B"    # encontrado pela ligação de falha
+    assert automaton.best(("K",)) is None
+
+
+def test_anchored_pattern_falls_back_to_the_next_best_match():
+    automaton = _Automaton((
+        ("A", ("^R",)),
+        ("B", ("R",)),
+    ))
+    assert automaton.best(("R",), start=0) == "A"
+    assert automaton.best(("P", "R"), start=0) == "B"
+
+
+def test_categorize_transactions_copies_only_changed_rows():
+    rows = [
+        {"descricao": "COMPRA FARMACIA", "categoria_fiscal": "Saúde"},
+        {"descricao": "COMPRA LIDL", "categoria_fiscal": None},
+    ]
+    categorized, changed = categorize_transactions(rows)
+    assert changed == 1
+    assert categorized[0] is rows[0]
+    assert categorized[1] == {"descricao": "COMPRA LIDL", "categoria_fiscal": "Despesas gerais familiares"}
+    assert rows[1]["categoria_fiscal"] is None
+
+
+def test_backfill_skips_conversions_not_yet_migrated():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["t"]
+        await db.conversions.insert_many([
+            {"id": "new", "status": "completed"},
+            {"id": "legacy", "status": "completed", "extracted_data": {"transacoes": [{"descricao": "COMPRA LIDL"}]}},
+        ])
+        await db.conversion_transactions.insert_one(
+            {"conversion_id": "new", "seq": 0, "rows": [{"descricao": "COMPRA LIDL"}]}
+        )
+        changed = []
+
+        async def on_changed(conversion):
+            changed.append(conversion["id"])
+
+        totals = await backfill_categories(db.conversions, db.conversion_transactions, on_changed)
+        versions = {c["id"]: c.get("categorization_version") async for c in db.conversions.find()}
+        rows = (await db.conversion_transactions.find_one({"conversion_id": "new"}))["rows"]
+        return totals, versions, rows, changed
+
+    totals, versions, rows, changed = asyncio.run(scenario())
+    assert versions == {"new": RULES_VERSION, "legacy": None}
+    assert rows[0]["categoria_fiscal"] == "Despesas gerais familiares"
+    assert changed == ["new"]
+    assert totals["conversions"] == 1 and totals["legacy"] == 1
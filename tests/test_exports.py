@@ -0,0 +1,26 @@
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from exports import write_spool, write_spool_sheet, write_xlsx_spool
+
+
+def test_xlsx_from_spool_keeps_sheets_rows_and_empty_sheets(tmp_path):
+    spool = tmp_path / "lote.jsonl"
+    with open(spool, "w", encoding="utf-8") as out:
+        write_spool_sheet(out, 0, "jan.pdf")
+        write_spool(out, 0, [{"data": "01/01/2025", "descricao": "Café", "valor": 1.5, "tipo": "débito"}])
+        write_spool(out, 0, [{"data": "02/01/2025", "descricao": "B", "valor": 2.0, "tipo": "crédito"}])
+        write_spool_sheet(out, 1, "vazio.pdf")
+        write_spool_sheet(out, 2, "mar.pdf")
+        write_spool(out, 2, [{"data": "03/03/2025", "descricao": "C", "valor": 3.0, "tipo": "débito"}])
+
+    path = tmp_path / "lote.xlsx"
+    write_xlsx_spool(spool, path)
+
+    wb = openpyxl.load_workbook(path)
+    assert wb.sheetnames == ["jan.pdf", "vazio.pdf", "mar.pdf"]
+    jan = list(wb["jan.pdf"].values)
+    assert len(jan) == 3 and jan[1][:3] == ("01/01/2025", "Café", 1.5)
+    assert len(list(wb["vazio.pdf"].values)) == 1
+    assert list(wb["mar.pdf"].values)[1][1] == "C"
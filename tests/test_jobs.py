@@ -0,0 +1,201 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import jobs
+from jobs import JOB_DONE, JOB_FAILED, JOB_LEASED, JOB_QUEUED, ConversionJobQueue
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+class Clock:
+    def __init__(self):
+        self.now = START
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobs, "_utcnow", clock)
+    return clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def without_id_projection(collection):
+    """O mongomock só respeita ``sort``/``return_document`` se o documento trouxer ``_id``."""
+    find_one_and_update = collection.find_one_and_update
+
+    async def patched(filter, update, projection=None, **kwargs):
+        doc = await find_one_and_update(filter, update, **kwargs)
+        if doc is not None and projection == {"_id": 0}:
+            doc.pop("_id")
+        return doc
+
+    collection.find_one_and_update = patched
+    return collection
+
+
+async def queue(**kwargs):
+    collection = without_id_projection(mongomock_motor.AsyncMongoMockClient()["t"]["conversion_jobs"])
+    job_queue = ConversionJobQueue(collection, **kwargs)
+    await job_queue.ensure_indexes()
+    return job_queue
+
+
+async def stored(job_queue, job_id):
+    return await job_queue.collection.find_one({"id": job_id}, {"_id": 0})
+
+
+def naive(value):
+    # O mongomock devolve datas sem fuso, como o pymongo sem tz_aware
+    return value.replace(tzinfo=None)
+
+
+def test_claim_takes_the_oldest_available_job_once(clock):
+    async def scenario():
+        job_queue = await queue(lease_seconds=60)
+        first = await job_queue.enqueue("c1", {"n": 1})
+        clock.advance(1)
+        await job_queue.enqueue("c2", {"n": 2})
+        claimed = await job_queue.claim("w1")
+        second = await job_queue.claim("w2")
+        third = await job_queue.claim("w3")
+        return first, claimed, second, third, await job_queue.depth()
+
+    first, claimed, second, third, depth = run(scenario())
+    assert claimed["id"] == first and claimed["payload"] == {"n": 1}
+    assert claimed["status"] == JOB_LEASED and claimed["worker_id"] == "w1" and claimed["attempts"] == 1
+    assert naive(claimed["lease_expires_at"]) == naive(START + timedelta(seconds=61))
+    assert second["conversion_id"] == "c2"
+    assert third is None
+    assert depth == 2
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(clock):
+    async def scenario():
+        job_queue = await queue(lease_seconds=60)
+        job_id = await job_queue.enqueue("c1", {})
+        await job_queue.claim("w1")
+        clock.advance(59)
+        before_expiry = await job_queue.claim("w2")
+        clock.advance(1)
+        taken = await job_queue.claim("w2")
+        # O worker antigo já não manda no job
+        extended = await job_queue.extend_lease(job_id, "w1")
+        await job_queue.complete(job_id, "w1")
+        after_stale_complete = await stored(job_queue, job_id)
+        await job_queue.complete(job_id, "w2")
+        return before_expiry, taken, extended, after_stale_complete, await stored(job_queue, job_id)
+
+    before_expiry, taken, extended, stale, done = run(scenario())
+    assert before_expiry is None
+    assert taken["worker_id"] == "w2" and taken["attempts"] == 2
+    assert extended is False
+    assert stale["status"] == JOB_LEASED and stale["worker_id"] == "w2"
+    assert done["status"] == JOB_DONE and done["lease_expires_at"] is None
+
+
+def test_extend_lease_keeps_the_job(clock):
+    async def scenario():
+        job_queue = await queue(lease_seconds=60)
+        job_id = await job_queue.enqueue("c1", {})
+        await job_queue.claim("w1")
+        clock.advance(50)
+        extended = await job_queue.extend_lease(job_id, "w1")
+        clock.advance(50)
+        return extended, await job_queue.claim("w2"), await stored(job_queue, job_id)
+
+    extended, other, job = run(scenario())
+    assert extended is True
+    assert other is None
+    assert naive(job["lease_expires_at"]) == naive(START + timedelta(seconds=110))
+
+
+def test_fail_requeues_with_exponential_backoff(clock):
+    async def scenario():
+        job_queue = await queue(max_attempts=5)
+        job_id = await job_queue.enqueue("c1", {})
+        delays = []
+        for _ in range(3):
+            job = await job_queue.claim("w1")
+            final = await job_queue.fail(job, "w1", "erro " * 500)
+            saved = await stored(job_queue, job_id)
+            delays.append((naive(saved["available_at"]) - naive(clock.now)).total_seconds())
+            assert not final and saved["status"] == JOB_QUEUED and saved["lease_expires_at"] is None
+            clock.advance(delays[-1] - 1)
+            assert await job_queue.claim("w1") is None
+            clock.advance(1)
+        return delays, saved
+
+    delays, saved = run(scenario())
+    assert delays == [10, 20, 40]
+    assert len(saved["last_error"]) == 1000
+
+
+def test_fail_backoff_is_capped(clock):
+    async def scenario():
+        job_queue = await queue(max_attempts=20)
+        job_id = await job_queue.enqueue("c1", {})
+        job = await job_queue.claim("w1")
+        await job_queue.fail({**job, "attempts": 9}, "w1", "erro")
+        return await stored(job_queue, job_id)
+
+    job = run(scenario())
+    assert naive(job["available_at"]) == naive(START + timedelta(seconds=300))
+
+
+def test_fail_is_final_after_the_last_attempt_or_without_retry(clock):
+    async def scenario():
+        job_queue = await queue(max_attempts=2)
+        last = await job_queue.enqueue("c1", {})
+        job = await job_queue.claim("w1")
+        await job_queue.fail(job, "w1", "erro")
+        clock.advance(10)
+        job = await job_queue.claim("w1")
+        exhausted = await job_queue.fail(job, "w1", "erro")
+
+        permanent = await job_queue.enqueue("c2", {})
+        job = await job_queue.claim("w1")
+        not_retried = await job_queue.fail(job, "w1", "sem LLM", retry=False)
+        return exhausted, not_retried, await stored(job_queue, last), await stored(job_queue, permanent)
+
+    exhausted, not_retried, last, permanent = run(scenario())
+    assert exhausted is True and not_retried is True
+    assert last["status"] == JOB_FAILED and last["attempts"] == 2
+    assert permanent["status"] == JOB_FAILED and permanent["attempts"] == 1 and permanent["last_error"] == "sem LLM"
+
+
+def test_reap_expired_fails_only_jobs_without_attempts_left(clock):
+    async def scenario():
+        job_queue = await queue(lease_seconds=60, max_attempts=2)
+        dead_id = await job_queue.enqueue("c1", {})
+        await job_queue.collection.update_one({"id": dead_id}, {"$set": {"attempts": 1}})
+        await job_queue.claim("w1")                      # última tentativa
+        retry_id = await job_queue.enqueue("c2", {})
+        await job_queue.claim("w2")                      # ainda tem outra tentativa
+        clock.advance(30)
+        early = await job_queue.reap_expired()
+        clock.advance(30)
+        reaped = await job_queue.reap_expired()
+        again = await job_queue.reap_expired()
+        retried = await job_queue.claim("w3")
+        return early, reaped, again, retried, await stored(job_queue, dead_id), retry_id
+
+    early, reaped, again, retried, dead, retry_id = run(scenario())
+    assert early == []
+    assert [job["conversion_id"] for job in reaped] == ["c1"]
+    assert again == []
+    assert dead["status"] == JOB_FAILED and dead["last_error"] == "lease expired"
+    assert retried["id"] == retry_id and retried["attempts"] == 2
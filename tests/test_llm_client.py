@@ -0,0 +1,246 @@
+import asyncio
+
+import pytest
+
+from llm_client import CircuitBreaker, LLMBackend, LLMClient, LLMError, LLMUnavailable, TokenBucket, TransientLLMError
+
+
+class FakeClock:
+    """Relógio manual: ``sleep`` avança o tempo em vez de esperar."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+class MaxJitter:
+    """``uniform`` devolve sempre o limite superior, para o backoff ser previsível."""
+
+    def uniform(self, low: float, high: float) -> float:
+        return high
+
+
+class ScriptedBackend(LLMBackend):
+    """Cada chamada consome o próximo passo: uma exceção ou a lista de pedaços a entregar."""
+
+    name = "scripted"
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def stream(self, prompt, file_path=None, mime_type="application/pdf"):
+        self.calls += 1
+        step = self.steps.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        for chunk in step:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+def make_client(backend, clock, **kwargs):
+    options = dict(requests_per_minute=0, failure_threshold=100, clock=clock, sleep=clock.sleep, rng=MaxJitter())
+    options.update(kwargs)
+    return LLMClient(backend, **options)
+
+
+def test_retries_transient_errors_with_exponential_backoff():
+    clock = FakeClock()
+    backend = ScriptedBackend(TransientLLMError("503"), TransientLLMError("503"), TransientLLMError("503"), ["ok"])
+    client = make_client(backend, clock, retry_base_seconds=1.0, retry_max_seconds=30.0)
+
+    assert asyncio.run(client.complete("p")) == "ok"
+    assert clock.sleeps == [1.0, 2.0, 4.0]
+    assert client.counters["retries"] == 3 and client.counters["succeeded"] == 1
+
+
+def test_backoff_is_capped_and_jittered_below_the_cap():
+    client = make_client(ScriptedBackend(), FakeClock(), retry_base_seconds=10.0, retry_max_seconds=15.0)
+    assert [client._backoff(attempt) for attempt in range(3)] == [10.0, 15.0, 15.0]
+
+    class MinJitter:
+        def uniform(self, low, high):
+            return low
+
+    client.rng = MinJitter()
+    assert client._backoff(5) == 0
+
+
+def test_gives_up_after_max_retries():
+    clock = FakeClock()
+    backend = ScriptedBackend(*[ConnectionError("reset")] * 3)
+    client = make_client(backend, clock, max_retries=2)
+
+    with pytest.raises(LLMError):
+        asyncio.run(client.complete("p"))
+    assert backend.calls == 3
+    assert len(clock.sleeps) == 2
+    assert client.counters["failed"] == 1
+
+
+def test_permanent_errors_are_not_retried():
+    backend = ScriptedBackend(ValueError("prompt inválido"))
+    client = make_client(backend, FakeClock())
+
+    with pytest.raises(LLMError):
+        asyncio.run(client.complete("p"))
+    assert backend.calls == 1 and client.counters["retries"] == 0
+
+
+def test_no_retry_after_a_chunk_was_delivered():
+    backend = ScriptedBackend(["{", TransientLLMError("503")], ["{}"])
+    client = make_client(backend, FakeClock())
+
+    async def consume():
+        received = []
+        with pytest.raises(LLMError):
+            async for chunk in client.stream("p"):
+                received.append(chunk)
+        return received
+
+    assert asyncio.run(consume()) == ["{"]
+    assert backend.calls == 1
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now = 29.9
+    assert not breaker.allow()
+    clock.now = 30
+    # Só uma chamada de teste de cada vez
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0 and breaker.allow()
+
+
+def test_failed_trial_reopens_the_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    clock.now = 19.9
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_trial_without_verdict_lets_the_next_call_try():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow() and not breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def test_open_circuit_rejects_without_calling_the_backend():
+    clock = FakeClock()
+    backend = ScriptedBackend(TransientLLMError("503"), ["ok"])
+    client = make_client(backend, clock, max_retries=0, failure_threshold=1, reset_seconds=60)
+
+    async def scenario():
+        with pytest.raises(LLMError):
+            await client.complete("p")
+        with pytest.raises(LLMUnavailable):
+            await client.complete("p")
+        clock.now += 60
+        return await client.complete("p")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert backend.calls == 2
+    assert client.counters["circuit_rejected"] == 1
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_token_bucket_allows_bursts_then_paces():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock, sleep=clock.sleep)
+
+    async def scenario():
+        return [await bucket.acquire() for _ in range(4)]
+
+    waits = asyncio.run(scenario())
+    assert waits == [0.0, 0.0, 0.5, 0.5]
+    clock.now += 10
+    # Recarrega só até à capacidade
+    assert asyncio.run(scenario()) == [0.0, 0.0, 0.5, 0.5]
+
+
+def test_token_bucket_disabled_with_zero_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0, capacity=1, clock=clock, sleep=clock.sleep)
+    assert asyncio.run(bucket.acquire()) == 0.0
+    assert clock.sleeps == []
+
+
+class GatedBackend(LLMBackend):
+    """Cada chamada fica à espera de ``release`` e regista quantas estão ativas por utilizador."""
+
+    name = "gated"
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.active = {}
+        self.peak = {}
+
+    async def stream(self, prompt, file_path=None, mime_type="application/pdf"):
+        self.active[prompt] = self.active.get(prompt, 0) + 1
+        self.peak[prompt] = max(self.peak.get(prompt, 0), self.active[prompt])
+        await self.release.wait()
+        self.active[prompt] -= 1
+        yield "ok"
+
+
+def test_per_user_limit_and_cleanup():
+    async def scenario():
+        backend = GatedBackend()
+        client = LLMClient(backend, max_concurrency=10, max_concurrency_per_user=1, requests_per_minute=0)
+        calls = [asyncio.create_task(client.complete(user, user_id=user)) for user in ("u1", "u1", "u2")]
+        await asyncio.sleep(0.01)
+        during = (dict(backend.active), len(client._per_user), client.stats()["in_flight"])
+        backend.release.set()
+        await asyncio.gather(*calls)
+        return during, backend.peak, client._per_user
+
+    (active, users, in_flight), peak, per_user = asyncio.run(scenario())
+    # u1 tem uma chamada à espera; u2 não fica bloqueado por u1
+    assert active == {"u1": 1, "u2": 1}
+    assert users == 2 and in_flight == 2
+    assert peak == {"u1": 1, "u2": 1}
+    assert per_user == {}
+
+
+def test_global_limit_applies_across_users():
+    async def scenario():
+        backend = GatedBackend()
+        client = LLMClient(backend, max_concurrency=1, max_concurrency_per_user=5, requests_per_minute=0)
+        calls = [asyncio.create_task(client.complete("p", user_id=user)) for user in ("u1", "u2")]
+        await asyncio.sleep(0.01)
+        during = backend.active.get("p")
+        backend.release.set()
+        await asyncio.gather(*calls)
+        return during
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,181 @@
+import json
+
+import pytest
+
+from llm_json import (
+    TransactionStreamParser, merge_continuation, parse_extraction_response, repair_json, salvage_extraction,
+    skip_boundary,
+)
+
+
+def repaired(text):
+    return json.loads(repair_json(text))
+
+
+def test_repair_drops_trailing_commas():
+    assert repaired('{"transacoes": [{"valor": 1,}, {"valor": 2},], }') == {"transacoes": [{"valor": 1}, {"valor": 2}]}
+
+
+@pytest.mark.parametrize("raw, value", [
+    ("1.234,56", 1234.56),
+    ("-12,5", -12.5),
+    ("0,07", 0.07),
+    ("12.345.678,90", 12345678.9),
+])
+def test_repair_converts_decimal_commas(raw, value):
+    assert repaired(f'{{"valor": {raw}, "saldo": {raw}}}') == {"valor": value, "saldo": value}
+
+
+def test_repair_leaves_strings_alone():
+    text = '{"descricao": "PAG: 1,50}, ok", "valor": 1,50}'
+    assert repaired(text) == {"descricao": "PAG: 1,50}, ok", "valor": 1.5}
+
+
+def test_repair_smart_quotes():
+    text = "{“banco”: “CGD”, “descricao”: “diz \"ola\"”}"
+    assert repaired(text) == {"banco": "CGD", "descricao": 'diz "ola"'}
+
+
+def test_repair_escapes_newlines_inside_strings():
+    assert repaired('{"descricao": "linha 1\nlinha 2"}') == {"descricao": "linha 1\nlinha 2"}
+
+
+def test_salvage_truncated_array():
+    response = (
+        '{"banco": "CGD", "saldo_inicial": 10.0, "transacoes": ['
+        '{"descricao": "A", "valor": 1,5}, {"descricao": "B", "val'
+    )
+    assert salvage_extraction(response) == {
+        "banco": "CGD",
+        "saldo_inicial": 10.0,
+        "transacoes": [{"descricao": "A", "valor": 1.5}],
+        "parcial": True,
+    }
+
+
+def test_salvage_truncated_before_any_transaction():
+    assert salvage_extraction('{"banco": "CGD", "transacoes": [{"descr') == {
+        "banco": "CGD", "transacoes": [], "parcial": True,
+    }
+
+
+def test_salvage_keeps_fields_after_the_array_and_flags_unreadable_rows():
+    response = '{"banco": "X", "transacoes": [{"a": 1}, {"a": }], "saldo_final": 5}'
+    assert salvage_extraction(response) == {
+        "banco": "X", "saldo_final": 5, "transacoes": [{"a": 1}], "parcial": True,
+    }
+
+
+def test_salvage_complete_after_repair_is_not_partial():
+    assert salvage_extraction('texto antes {"transacoes": [{"a": 1},],}') == {"transacoes": [{"a": 1}]}
+
+
+@pytest.mark.parametrize("response", ["", "sem json", "{", '{"transacoes'])
+def test_salvage_nothing_usable(response):
+    assert salvage_extraction(response) is None
+
+
+def test_parse_extraction_response_repairs_fenced_json():
+    response = '```json\n{"banco": "CGD", "transacoes": [{"valor": 1,5},]}\n```'
+    assert parse_extraction_response(response, "CGD") == {"banco": "CGD", "transacoes": [{"valor": 1.5}]}
+
+
+def test_parse_extraction_response_reports_unusable_responses():
+    data = parse_extraction_response("não consegui ler o extrato", "CGD")
+    assert data["banco"] == "CGD" and data["transacoes"] == [] and data["erro"]
+
+
+A = {"data": "01/01/2025", "descricao": "A", "valor": 1.0}
+B = {"data": "02/01/2025", "descricao": "B", "valor": 2.0}
+C = {"data": "03/01/2025", "descricao": "C", "valor": 3.0}
+
+
+def test_merge_continuation_drops_the_repeated_boundary_row():
+    data = {"banco": "CGD", "saldo_final": 0.0, "transacoes": [A, B], "parcial": True}
+    merged = merge_continuation(data, {"transacoes": [B, C], "saldo_final": 9.0})
+    assert merged["transacoes"] == [A, B, C]
+    assert merged["saldo_final"] == 9.0
+    assert "parcial" not in merged
+    assert data["transacoes"] == [A, B]
+
+
+def test_merge_continuation_keeps_a_different_first_row():
+    merged = merge_continuation({"transacoes": [A, B], "parcial": True}, {"transacoes": [C, B]})
+    assert merged["transacoes"] == [A, B, C, B]
+
+
+def test_merge_continuation_with_empty_list():
+    data = {"transacoes": [A], "saldo_final": 1.0, "parcial": True}
+    merged = merge_continuation(data, {"transacoes": []})
+    assert merged == {"transacoes": [A], "saldo_final": 1.0}
+    # Continuação ilegível: continua parcial e sem perder o que já havia
+    failed = merge_continuation(data, {"transacoes": [], "erro": "Erro ao processar resposta da IA."})
+    assert failed == {"transacoes": [A], "saldo_final": 1.0, "parcial": True}
+
+
+def test_merge_continuation_still_partial():
+    merged = merge_continuation({"transacoes": [A], "parcial": True}, {"transacoes": [A, B], "parcial": True})
+    assert merged == {"transacoes": [A, B], "parcial": True}
+
+
+RESPONSE = (
+    '```json\n{"banco": "CGD", "notas": [{"x": 1}], "descricao": "\\"transacoes\\": [{}]",\n'
+    ' "transacoes": [\n'
+    '  {"data": "01/01/2025", "descricao": "PAG {REF} [1]", "valor": 1.5, "tags": [{"k": "v"}]},\n'
+    '  {"data": "02/01/2025", "descricao": "aspas \\" e \\\\", "valor": 2}\n'
+    ' ],\n'
+    ' "saldo_final": 3.5}\n```'
+)
+
+
+def stream(chunks):
+    parser = TransactionStreamParser()
+    return parser, [parser.feed(chunk) for chunk in chunks]
+
+
+def test_stream_parser_emits_each_row_when_its_object_closes():
+    parser, per_chunk = stream([RESPONSE])
+    items = per_chunk[0]
+    assert items == json.loads(RESPONSE[8:-4])["transacoes"]
+    assert parser.emitted == 2 and parser.skipped == 0
+    assert parser.array_closed
+    assert parser.text == RESPONSE
+    assert parser.remainder.split() == [",", '"saldo_final":', "3.5}", "```"]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_stream_parser_is_independent_of_chunking(size):
+    chunks = [RESPONSE[i:i + size] for i in range(0, len(RESPONSE), size)]
+    parser, per_chunk = stream(chunks)
+    assert [item for items in per_chunk for item in items] == stream([RESPONSE])[1][0]
+    assert parser.text == RESPONSE
+    # Cada linha sai no pedaço que fecha o seu objeto
+    first_close = RESPONSE.index('"tags": [{"k": "v"}]}') + len('"tags": [{"k": "v"}]}')
+    emitted_at = next(i for i, items in enumerate(per_chunk) if items)
+    assert emitted_at == (first_close - 1) // size
+
+
+def test_stream_parser_counts_unreadable_rows():
+    parser, per_chunk = stream(['{"transacoes": [{"valor": 1,5}, {"valor": 2}]}'])
+    assert per_chunk[0] == [{"valor": 2}]
+    assert parser.skipped == 1 and parser.emitted == 1
+
+
+def test_stream_parser_truncated_response():
+    parser, per_chunk = stream(['{"transacoes": [{"valor": 1}, {"val'])
+    assert per_chunk[0] == [{"valor": 1}]
+    assert not parser.array_closed
+
+
+def test_skip_boundary_drops_only_a_repeated_first_row():
+    published = []
+    callback = skip_boundary(published.append, B)
+    for row in (B, C, B):
+        callback(row)
+    assert published == [C, B]
+
+    published.clear()
+    callback = skip_boundary(published.append, B)
+    for row in (C, B):
+        callback(row)
+    assert published == [C, B]
@@ -0,0 +1,92 @@
+import math
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from normalization import normalize_statement, parse_amount_text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("1.234.567,89", 1234567.89),
+    ("1,234,567.89", 1234567.89),
+    ("1.234.567", 1234567.0),
+    ("25,30-", -25.30),
+    ("-25.30", -25.30),
+    ("1234.56", 1234.56),
+    ("1234,5", 1234.5),
+    ("0,125", 0.125),
+    ("€ 12,00", 12.0),
+    ("42", 42.0),
+])
+def test_parse_amount_text(text, expected):
+    assert parse_amount_text(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("text", [
+    "1.234",        # milhares PT ou 1,234 EN
+    "1,234",
+    "1.234.56",     # dois pontos e depois decimais
+    "12,34,567.00",  # agrupamento errado
+    "1.23,456",
+    "abc",
+    "",
+    None,
+])
+def test_parse_amount_text_rejects_ambiguous_or_invalid(text):
+    assert math.isnan(parse_amount_text(text))
+
+
+def statement(transactions, saldo_inicial=1000.0, saldo_final=None):
+    return {"banco": "CGD", "saldo_inicial": saldo_inicial, "saldo_final": saldo_final, "transacoes": transactions}
+
+
+def test_english_amount_is_not_truncated():
+    data = statement([{"data": "02/01/2025", "descricao": "A", "valor": "1,234.56", "tipo": "crédito"}], 0.0, 1234.56)
+    normalized, totals, reconciliation = normalize_statement(data)
+    assert normalized["transacoes"][0]["valor"] == 1234.56
+    assert totals["total_credits"] == 1234.56
+    assert reconciliation["ok"] and reconciliation["linhas_invalidas"] == []
+
+
+def test_ambiguous_amount_is_flagged_and_left_unchanged():
+    rows = [
+        {"data": "02/01/2025", "descricao": "A", "valor": "1.234", "tipo": "débito"},
+        {"data": "03/01/2025", "descricao": "B", "valor": "10,00", "tipo": "débito"},
+    ]
+    normalized, totals, reconciliation = normalize_statement(statement(rows, 1000.0, 990.0))
+    assert normalized["transacoes"][0]["valor"] == "1.234"
+    assert normalized["transacoes"][1]["valor"] == 10.0
+    assert totals["total_debits"] == 10.0
+    assert reconciliation["linhas_invalidas"] == [0]
+
+
+def test_iso_dates_and_pt_strings_are_canonical():
+    rows = [{"data": "2025-01-02", "descricao": "A", "valor": "50,00", "tipo": "Débito"}]
+    normalized, _, reconciliation = normalize_statement(statement(rows, 100.0, 50.0))
+    assert normalized["transacoes"][0] == {"data": "02/01/2025", "descricao": "A", "valor": 50.0, "tipo": "débito"}
+    assert reconciliation["ok"] and reconciliation["verificado"]
+
+
+def test_flipped_sign_is_reported():
+    rows = [
+        {"data": "02/01/2025", "descricao": "A", "valor": 50.0, "tipo": "débito"},
+        {"data": "03/01/2025", "descricao": "B", "valor": 30.0, "tipo": "débito"},
+    ]
+    _, _, reconciliation = normalize_statement(statement(rows, 1000.0, 980.0))
+    assert not reconciliation["ok"]
+    assert reconciliation["linhas_divergentes"] == [1]
+
+
+def test_empty_statement_with_different_balances_is_a_mismatch():
+    _, _, reconciliation = normalize_statement(statement([], 1000.0, 900.0))
+    assert reconciliation["ok"] is False
+    assert reconciliation["verificado"] is True
+    assert reconciliation["diferenca"] == 100.0
+
+
+def test_empty_statement_with_equal_balances_is_ok():
+    _, _, reconciliation = normalize_statement(statement([], 1000.0, 1000.0))
+    assert reconciliation["ok"] and reconciliation["verificado"]
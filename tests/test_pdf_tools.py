@@ -0,0 +1,137 @@
+import re
+import zlib
+
+import pytest
+
+from pdf_tools import count_pdf_pages, plan_page_ranges
+
+
+def page_objects(pages, count=None):
+    """Catálogo (1), raiz da árvore (2) e ``pages`` páginas (3...)."""
+    kids = " ".join(f"{3 + i} 0 R" for i in range(pages))
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{kids}] /Count {pages if count is None else count} >>".encode(),
+    }
+    for i in range(pages):
+        objects[3 + i] = b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>"
+    return objects
+
+
+def xref_table_pdf(objects):
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for num, body in objects.items():
+        offsets[num] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (num, body)
+    xref = len(out)
+    size = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for num in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[num]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    return bytes(out)
+
+
+def xref_stream_pdf(objects):
+    """Páginas num object stream e xref em stream Flate com /Predictor 12."""
+    compressed = {num: body for num, body in objects.items() if num != 1}
+    header, body = [], b""
+    for num, obj in compressed.items():
+        header.append(b"%d %d" % (num, len(body)))
+        body += obj + b" "
+    header = b" ".join(header) + b" "
+    objstm_num = max(objects) + 1
+    xref_num = objstm_num + 1
+    data = zlib.compress(header + body)
+
+    out = bytearray(b"%PDF-1.5\n")
+    offsets = {1: len(out)}
+    out += b"1 0 obj\n%s\nendobj\n" % objects[1]
+    offsets[objstm_num] = len(out)
+    out += b"%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\nstream\n" % (
+        objstm_num, len(compressed), len(header), len(data)
+    )
+    out += data + b"\nendstream\nendobj\n"
+    offsets[xref_num] = len(out)
+
+    rows, previous = b"", bytes(4)
+    for num in range(xref_num + 1):
+        if num in offsets:
+            row = bytes([1]) + offsets[num].to_bytes(2, "big") + bytes([0])
+        elif num in compressed:
+            row = bytes([2]) + objstm_num.to_bytes(2, "big") + bytes([list(compressed).index(num)])
+        else:
+            row = bytes(4)
+        rows += bytes([2]) + bytes((a - b) & 0xFF for a, b in zip(row, previous))
+        previous = row
+    stream = zlib.compress(rows)
+    out += (
+        b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 2 1] /Root 1 0 R /Filter /FlateDecode "
+        b"/DecodeParms << /Columns 4 /Predictor 12 >> /Length %d >>\nstream\n"
+        % (xref_num, xref_num + 1, len(stream))
+    )
+    out += stream + b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % offsets[xref_num]
+    return bytes(out)
+
+
+def count(tmp_path, content):
+    path = tmp_path / "extrato.pdf"
+    path.write_bytes(content)
+    return count_pdf_pages(str(path))
+
+
+@pytest.mark.parametrize("build", [xref_table_pdf, xref_stream_pdf])
+def test_counts_valid_files(tmp_path, build):
+    assert count(tmp_path, build(page_objects(7))) == 7
+
+
+@pytest.mark.parametrize("build", [xref_table_pdf, xref_stream_pdf])
+def test_matches_pypdf(tmp_path, build):
+    pypdf = pytest.importorskip("pypdf")
+    content = build(page_objects(3))
+    path = tmp_path / "extrato.pdf"
+    path.write_bytes(content)
+    assert count_pdf_pages(str(path)) == len(pypdf.PdfReader(str(path)).pages)
+
+
+@pytest.mark.parametrize("build", [xref_table_pdf, xref_stream_pdf])
+def test_rejects_implausible_count(tmp_path, build):
+    assert count(tmp_path, build(page_objects(1, count=999999999))) is None
+
+
+def test_indirect_count(tmp_path):
+    objects = page_objects(2)
+    objects[2] = objects[2].replace(b"/Count 2", b"/Count 5 0 R")
+    objects[5] = b"2"
+    assert count(tmp_path, xref_table_pdf(objects)) == 2
+
+
+def test_truncated_xref_table_falls_back_to_page_objects(tmp_path):
+    content = xref_table_pdf(page_objects(4))
+    xref = content.index(b"\nxref\n")
+    # Subsecção a declarar mais entradas do que as que existem no ficheiro
+    crafted = content[:xref] + content[xref:].replace(b"0 7\n", b"0 9999999\n", 1)
+    assert crafted != content
+    assert count(tmp_path, crafted) == 4
+
+
+def test_truncated_file(tmp_path):
+    content = xref_table_pdf(page_objects(4))
+    # Sem trailer/startxref: conta os objetos /Type /Page que restam
+    assert count(tmp_path, content[:content.index(b"5 0 obj")]) == 2
+    assert count(tmp_path, b"%PDF-1.4\n") is None
+    assert count(tmp_path, b"") is None
+
+
+def test_truncated_xref_stream(tmp_path):
+    content = xref_stream_pdf(page_objects(3))
+    crafted = re.sub(rb"/Size \d+", b"/Size 70000000", content, count=1)
+    assert crafted != content
+    # Páginas dentro do object stream: o fallback não as vê
+    assert count(tmp_path, crafted) is None
+
+
+def test_plan_page_ranges():
+    assert plan_page_ranges(5, 2) == [(0, 2), (2, 4), (4, 5)]
+    assert plan_page_ranges(0, 2) == []
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+
+from profiling import ProfilingMiddleware
+
+TOKEN = "segredo"
+
+
+def get(directory, headers, token=TOKEN, keep=50):
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, directory=directory, enabled=True, token=token, keep=keep)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            return await client.get("/ping", headers=headers)
+
+    return asyncio.run(scenario())
+
+
+def test_profiles_with_token(tmp_path):
+    response = get(tmp_path, {"X-Profile": TOKEN})
+    assert response.status_code == 200
+    assert (tmp_path / response.headers["x-profile"]).exists()
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Profile": "1"}, {"X-Profile": "errado"}])
+def test_ignores_requests_without_token(tmp_path, headers):
+    response = get(tmp_path, headers)
+    assert response.status_code == 200
+    assert "x-profile" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_disabled_without_configured_token(tmp_path):
+    response = get(tmp_path / "profiles", {"X-Profile": ""}, token="")
+    assert "x-profile" not in response.headers
+    assert not (tmp_path / "profiles").exists()
+
+
+def test_keeps_latest_profiles(tmp_path):
+    for _ in range(3):
+        get(tmp_path, {"X-Profile": TOKEN}, keep=2)
+    assert len(list(tmp_path.glob("*.folded"))) == 2
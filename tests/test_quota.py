@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from db_indexes import INDEXES
+from quota import load_subscription, release_quota, reserve_quota, switch_plan
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def subscriptions():
+    collection = mongomock_motor.AsyncMongoMockClient()["t"]["subscriptions"]
+    await collection.create_indexes(INDEXES["subscriptions"])
+    return collection
+
+
+def test_switch_plan_updates_the_active_subscription_in_place():
+    async def scenario():
+        collection = await subscriptions()
+        free = await load_subscription(collection, "u1")
+        _, reservation = await reserve_quota(collection, "u1", pages=3)
+        paid = await switch_plan(collection, "u1", "pro", 1000)
+        # Um pedido da quota depois da mudança usa a subscrição paga, sem criar outra
+        after, second = await reserve_quota(collection, "u1", pages=10)
+        await release_quota(collection, reservation)
+        return free, paid, after, second, await collection.count_documents({"user_id": "u1"})
+
+    free, paid, after, second, count = run(scenario())
+    assert count == 1
+    assert paid["id"] == free["id"]
+    assert paid["plan_type"] == "pro" and paid["pages_limit"] == 1000 and paid["conversions_limit"] is None
+    assert second is not None
+    assert after["pages_used_this_month"] == 10
+
+
+def test_switch_plan_creates_the_subscription_if_missing():
+    async def scenario():
+        collection = await subscriptions()
+        await switch_plan(collection, "u2", "starter", 400)
+        return await load_subscription(collection, "u2")
+
+    subscription = run(scenario())
+    assert subscription["plan_type"] == "starter"
+    assert subscription["pages_used_this_month"] == 0
+
+
+def test_internal_reservation_id_is_not_returned():
+    async def scenario():
+        collection = await subscriptions()
+        reserved, _ = await reserve_quota(collection, "u3", pages=1)
+        return reserved, await load_subscription(collection, "u3"), await switch_plan(collection, "u3", "pro", 1000)
+
+    reserved, loaded, switched = run(scenario())
+    assert "last_reservation_id" in reserved
+    assert "last_reservation_id" not in loaded
+    assert "last_reservation_id" not in switched
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from retention import RetentionSweeper
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+RETENTION_DAYS = {"free": 7, "pro": 90}
+
+
+def conversion(conversion_id, days_ago, **extra):
+    created = NOW - timedelta(days=days_ago)
+    return {
+        "id": conversion_id,
+        "user_id": "u1",
+        "status": "completed",
+        "created_at": created.isoformat(),
+        "expires_at": (created + timedelta(days=7)).isoformat(),
+        **extra,
+    }
+
+
+def make_sweeper(purge, docs):
+    db = mongomock_motor.AsyncMongoMockClient()["t"]
+
+    async def setup():
+        await db.conversions.insert_many(docs)
+        return RetentionSweeper(db.conversions, db.subscriptions, purge, RETENTION_DAYS, retry_seconds=60)
+
+    return db, setup
+
+
+def test_sweep_purges_only_expired_conversions():
+    purged = []
+
+    async def purge(c):
+        purged.append(c["id"])
+
+    async def scenario():
+        db, setup = make_sweeper(purge, [
+            conversion("old", 10),
+            conversion("new", 1),
+            conversion("busy", 10, status="processing"),
+        ])
+        sweeper = await setup()
+        count = await sweeper.sweep(NOW)
+        again = await sweeper.sweep(NOW)
+        return count, again, await db.conversions.find_one({"id": "old"})
+
+    count, again, old = asyncio.run(scenario())
+    assert purged == ["old"]
+    assert count == 1 and again == 0
+    assert old["artifacts_purged_at"] == NOW.isoformat()
+
+
+def test_failed_purge_is_retried_with_backoff():
+    calls = []
+
+    async def purge(c):
+        calls.append(c["id"])
+        if len(calls) <= 2:
+            raise OSError("S3 indisponível")
+
+    async def scenario():
+        db, setup = make_sweeper(purge, [conversion("old", 10)])
+        sweeper = await setup()
+        states = []
+        for at in (NOW, NOW + timedelta(seconds=30), NOW + timedelta(seconds=61), NOW + timedelta(seconds=200)):
+            await sweeper.sweep(at)
+            states.append(await db.conversions.find_one({"id": "old"}, {"_id": 0}))
+        return sweeper, states
+
+    sweeper, states = asyncio.run(scenario())
+    first, during_backoff, second, done = states
+    # Falha: não fica marcada, conta a tentativa e agenda a próxima
+    assert "artifacts_purged_at" not in first
+    assert first["purge_attempts"] == 1
+    assert first["purge_retry_at"] == (NOW + timedelta(seconds=60)).isoformat()
+    # Dentro do backoff não é tentada
+    assert during_backoff == first
+    # Segunda falha: espera a dobrar
+    assert second["purge_attempts"] == 2
+    assert second["purge_retry_at"] == (NOW + timedelta(seconds=61 + 120)).isoformat()
+    # Sucesso: marcada e sem estado de retry
+    assert done["artifacts_purged_at"] == (NOW + timedelta(seconds=200)).isoformat()
+    assert "purge_attempts" not in done and "purge_retry_at" not in done
+    assert calls == ["old", "old", "old"]
+    assert sweeper.errors == 2 and sweeper.purged == 1
+
+
+def test_backfill_sets_expires_at_from_the_plan():
+    async def purge(c):
+        pass
+
+    async def scenario():
+        legacy = conversion("legacy", 3)
+        del legacy["expires_at"]
+        db, setup = make_sweeper(purge, [legacy])
+        await db.subscriptions.insert_one({"user_id": "u1", "status": "active", "plan_type": "pro"})
+        sweeper = await setup()
+        await sweeper.sweep(NOW)
+        return await db.conversions.find_one({"id": "legacy"})
+
+    legacy = asyncio.run(scenario())
+    assert legacy["expires_at"] == (NOW - timedelta(days=3) + timedelta(days=90)).isoformat()
+    assert "artifacts_purged_at" not in legacy
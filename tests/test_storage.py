@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from storage import LocalStorage, S3Storage, export_key, upload_key
+
+
+def roundtrip(storage, tmp_path):
+    async def scenario():
+        source = tmp_path / "source.pdf"
+        source.write_bytes(b"%PDF-1.4 conteudo")
+        key = upload_key("c1")
+        await storage.put_file(key, source, move=True, content_type="application/pdf")
+        exists = await storage.exists(key)
+        async with storage.local_copy(key) as path:
+            content = path.read_bytes()
+        await storage.delete(key)
+        missing = not await storage.exists(key)
+        with pytest.raises(FileNotFoundError):
+            async with storage.local_copy(key):
+                pass
+        # Apagar o que não existe não é erro (a limpeza pode repetir-se)
+        await storage.delete(export_key("c1.csv"))
+        return source.exists(), exists, content, missing
+
+    moved_source_exists, exists, content, missing = asyncio.run(scenario())
+    assert not moved_source_exists
+    assert exists and missing
+    assert content == b"%PDF-1.4 conteudo"
+
+
+def test_local_storage_roundtrip(tmp_path):
+    roundtrip(LocalStorage(tmp_path / "artifacts"), tmp_path)
+
+
+def test_local_storage_rejects_keys_outside_root(tmp_path):
+    storage = LocalStorage(tmp_path / "artifacts")
+    with pytest.raises(ValueError):
+        storage.path_for("../fora.pdf")
+
+
+def test_s3_storage_roundtrip(tmp_path):
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="artifacts")
+        storage = S3Storage("artifacts", prefix="bank", scratch_dir=tmp_path, client=client)
+        roundtrip(storage, tmp_path)
+        url = storage.presigned_url(upload_key("c1"), "extrato.pdf", "application/pdf")
+        assert "bank/uploads/c1.pdf" in url
+        assert not client.list_objects_v2(Bucket="artifacts").get("Contents")
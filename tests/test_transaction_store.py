@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from transaction_store import TransactionStore
+
+
+def rows(n, tag="a"):
+    return [{"descricao": f"{tag}{i}"} for i in range(n)]
+
+
+async def store():
+    collection = mongomock_motor.AsyncMongoMockClient()["t"]["conversion_transactions"]
+    transaction_store = TransactionStore(collection, batch_size=2)
+    await transaction_store.ensure_indexes()
+    return transaction_store
+
+
+def test_save_and_load_in_order():
+    async def scenario():
+        transaction_store = await store()
+        generation = await transaction_store.save("c1", rows(5))
+        return generation, await transaction_store.load("c1", generation)
+
+    generation, loaded = asyncio.run(scenario())
+    assert generation == 0
+    assert loaded == rows(5)
+
+
+def test_resave_keeps_the_old_generation_until_pruned():
+    async def scenario():
+        transaction_store = await store()
+        first = await transaction_store.save("c1", rows(3))
+        second = await transaction_store.save("c1", rows(4, "b"))
+        # Antes de a conversão trocar de geração, os leitores veem o extrato antigo completo
+        before = await transaction_store.load("c1", first)
+        await transaction_store.prune("c1", second)
+        return first, second, before, await transaction_store.load("c1", first), await transaction_store.load("c1", second)
+
+    first, second, before, old, new = asyncio.run(scenario())
+    assert second > first
+    assert before == rows(3)
+    assert old == []
+    assert new == rows(4, "b")
+
+
+def test_failed_save_leaves_the_current_rows():
+    async def scenario():
+        transaction_store = await store()
+        generation = await transaction_store.save("c1", rows(3))
+
+        async def fail(*args, **kwargs):
+            raise RuntimeError("falha de rede")
+
+        transaction_store.collection.insert_many = fail
+        with pytest.raises(RuntimeError):
+            await transaction_store.save("c1", rows(4, "b"))
+        return await transaction_store.load("c1", generation)
+
+    assert asyncio.run(scenario()) == rows(3)
+
+
+def test_batches_without_generation_are_read_as_none():
+    async def scenario():
+        transaction_store = await store()
+        await transaction_store.collection.insert_many([
+            {"conversion_id": "c1", "seq": 0, "rows": rows(2)},
+            {"conversion_id": "c1", "seq": 1, "rows": rows(1, "z")},
+        ])
+        legacy = await transaction_store.load("c1")
+        generation = await transaction_store.save("c1", rows(1, "b"))
+        await transaction_store.prune("c1", generation)
+        return legacy, generation, await transaction_store.load("c1"), await transaction_store.load("c1", generation)
+
+    legacy, generation, after, new = asyncio.run(scenario())
+    assert legacy == rows(2) + rows(1, "z")
+    assert generation == 2
+    assert after == []
+    assert new == rows(1, "b")
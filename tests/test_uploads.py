@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from fastapi import FastAPI, Request
+
+from uploads import MULTIPART_OVERHEAD, UploadLimitMiddleware
+
+LIMIT = 1024
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    app.add_middleware(UploadLimitMiddleware, limits={"/upload": LIMIT})
+    return app
+
+
+def post(content, headers=None):
+    pulled = {"bytes": 0}
+
+    async def chunks():
+        for i in range(0, len(content), 256):
+            pulled["bytes"] += 256
+            yield content[i:i + 256]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            body = content if headers and "content-length" in headers else chunks()
+            return await client.post("/upload", content=body, headers=headers or {"Authorization": "Bearer x"})
+
+    return asyncio.run(scenario()), pulled["bytes"]
+
+
+def test_small_upload_passes():
+    response, _ = post(b"x" * 100)
+    assert response.status_code == 200 and response.json() == {"size": 100}
+
+
+def test_chunked_upload_stops_at_the_limit():
+    total = 100 * (LIMIT + MULTIPART_OVERHEAD)
+    response, pulled = post(b"x" * total)
+    assert response.status_code == 413
+    assert pulled < LIMIT + MULTIPART_OVERHEAD + 2 * 256
+
+
+def test_content_length_above_limit_is_rejected():
+    content = b"x" * (LIMIT + MULTIPART_OVERHEAD + 1)
+    response, _ = post(content, {"Authorization": "Bearer x", "content-length": str(len(content))})
+    assert response.status_code == 413
+
+
+def test_missing_authorization_is_rejected_without_reading():
+    async def scenario():
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            return await client.post("/upload", content=b"x" * 10)
+
+    assert asyncio.run(scenario()).status_code == 403